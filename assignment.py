@@ -0,0 +1,317 @@
+"""
+Automatic assignment of service requests to professionals.
+
+The index keeps every active professional with a service type and pin in a
+pool keyed by (service_type, pin), bucketed by their current load (open
+requests assigned to them), so the least loaded professional for a request
+is found in constant time. A request matches the professionals whose
+service_type is the name of the service's category and whose pin is the
+customer's pin.
+
+The index is built at startup. Session flush hooks keep it up to date as
+requests are created, reassigned, closed or deleted, and as professionals
+are activated, edited or deleted. Bulk statements bypass the hooks, so they
+adjust the index themselves or call mark_stale(). The index lives in the
+process: it is also rebuilt after ASSIGNMENT_INDEX_MAX_AGE seconds, so
+changes made by other processes are picked up.
+"""
+from collections import defaultdict
+from threading import RLock
+import time
+from sqlalchemy import and_, case, event, func, inspect, select, update
+from sqlalchemy.orm import Session
+from extensions import db
+from model_history import OPEN_STATUSES, is_professional, stored_value
+from models import User, Role, UserRoles, Category, Service, Service_req
+import events
+
+ASSIGNMENT_INDEX_MAX_AGE = 60
+# most requests one backlog assignment may take
+MAX_BACKLOG_LIMIT = 10000
+# requests assigned per UPDATE statement
+ASSIGN_BATCH_SIZE = 500
+
+
+def _key(service_type, pin):
+    if not service_type or not pin:
+        return None
+    return service_type.strip().lower(), pin.strip()
+
+
+class _Pool:
+    """
+    Professionals of one (service_type, pin), bucketed by load
+    """
+    def __init__(self):
+        self.by_load = defaultdict(set)
+        self.min_load = None
+
+    def add(self, professional_id, load):
+        self.by_load[load].add(professional_id)
+        if self.min_load is None or load < self.min_load:
+            self.min_load = load
+
+    def discard(self, professional_id, load):
+        bucket = self.by_load[load]
+        bucket.discard(professional_id)
+        if not bucket:
+            del self.by_load[load]
+            if load == self.min_load:
+                if load + 1 in self.by_load:
+                    self.min_load = load + 1
+                else:
+                    self.min_load = min(self.by_load) if self.by_load else None
+
+    def least_loaded(self):
+        if self.min_load is None:
+            return None
+        return next(iter(self.by_load[self.min_load]))
+
+
+class ProfessionalIndex:
+    def __init__(self):
+        self._lock = RLock()
+        self._pools = defaultdict(_Pool)
+        # professional id -> (key, load)
+        self._members = {}
+        self._built_at = None
+
+    def _place(self, professional_id, key, load):
+        self._members[professional_id] = (key, load)
+        self._pools[key].add(professional_id, load)
+
+    def _remove(self, professional_id):
+        member = self._members.pop(professional_id, None)
+        if member:
+            key, load = member
+            self._pools[key].discard(professional_id, load)
+
+    def _load_rows(self, conn, professional_ids=None):
+        open_requests = (
+            select(Service_req.professional_id, func.count().label('load'))
+            .where(Service_req.service_status.in_(OPEN_STATUSES), Service_req.professional_id.isnot(None))
+            .group_by(Service_req.professional_id)
+        )
+        if professional_ids is not None:
+            open_requests = open_requests.where(Service_req.professional_id.in_(professional_ids))
+        open_requests = open_requests.subquery()
+        query = (
+            select(User.id, User.service_type, User.pin, func.coalesce(open_requests.c.load, 0))
+            .join(UserRoles, UserRoles.user_id == User.id)
+            .join(Role, and_(Role.id == UserRoles.role_id, Role.name == 'serv'))
+            .outerjoin(open_requests, open_requests.c.professional_id == User.id)
+            .where(User.active.is_(True))
+        )
+        if professional_ids is not None:
+            query = query.where(User.id.in_(professional_ids))
+        return conn.execute(query).all()
+
+    def rebuild(self, conn=None):
+        if conn is None:
+            with db.engine.connect() as conn:
+                return self.rebuild(conn)
+        rows = self._load_rows(conn)
+        with self._lock:
+            self._pools.clear()
+            self._members.clear()
+            for professional_id, service_type, pin, load in rows:
+                key = _key(service_type, pin)
+                if key:
+                    self._place(professional_id, key, load)
+            self._built_at = time.monotonic()
+
+    def mark_stale(self):
+        with self._lock:
+            self._built_at = None
+
+    def _ensure_fresh(self):
+        if self._built_at is None or time.monotonic() - self._built_at > ASSIGNMENT_INDEX_MAX_AGE:
+            self.rebuild()
+
+    def refresh(self, conn, professional_ids):
+        """
+        Re-read the given professionals (activation, new service type or pin) with their current load
+        """
+        rows = self._load_rows(conn, list(professional_ids))
+        with self._lock:
+            for professional_id in professional_ids:
+                self._remove(professional_id)
+            for professional_id, service_type, pin, load in rows:
+                key = _key(service_type, pin)
+                if key:
+                    self._place(professional_id, key, load)
+
+    def remove(self, professional_id):
+        with self._lock:
+            self._remove(professional_id)
+
+    def add_load(self, professional_id, delta):
+        with self._lock:
+            member = self._members.get(professional_id)
+            if member:
+                key, load = member
+                self._pools[key].discard(professional_id, load)
+                self._place(professional_id, key, max(0, load + delta))
+
+    def pick(self, service_type, pin):
+        """
+        Least loaded active professional for the service type and pin, or None
+        """
+        key = _key(service_type, pin)
+        if not key:
+            return None
+        with self._lock:
+            self._ensure_fresh()
+            pool = self._pools.get(key)
+            return pool.least_loaded() if pool else None
+
+    def assign_many(self, requests):
+        """
+        Plan assignments for (request id, service_type, pin) tuples in one
+        pass, counting each assignment towards the load before the next pick.
+        Returns [(request id, professional id)] for the requests that matched.
+        """
+        assignments = []
+        with self._lock:
+            self._ensure_fresh()
+            for request_id, service_type, pin in requests:
+                key = _key(service_type, pin)
+                pool = self._pools.get(key) if key else None
+                professional_id = pool.least_loaded() if pool else None
+                if professional_id is not None:
+                    self.add_load(professional_id, 1)
+                    assignments.append((request_id, professional_id))
+        return assignments
+
+    def loads(self):
+        with self._lock:
+            return {professional_id: load for professional_id, (key, load) in self._members.items()}
+
+
+index = ProfessionalIndex()
+
+
+def service_type_of(service_id):
+    return db.session.execute(
+        select(Category.name).join(Service, Service.category_id == Category.id).where(Service.id == service_id)
+    ).scalar()
+
+
+def assign_backlog(limit=None):
+    """
+    Assign every unassigned 'requested' request that has a matching
+    professional, with one query and an UPDATE ... RETURNING per
+    ASSIGN_BATCH_SIZE requests. A request assigned by someone else since
+    the query keeps its professional and is not returned.
+    Returns (assigned [(request id, professional id, customer id)], unmatched count).
+    """
+    Customer = db.aliased(User)
+    backlog = (
+        select(Service_req.id, Category.name, Customer.pin, Service_req.customer_id)
+        .join(Service, Service.id == Service_req.service_id)
+        .join(Category, Category.id == Service.category_id)
+        .join(Customer, Customer.id == Service_req.customer_id)
+        .where(Service_req.professional_id.is_(None), Service_req.service_status == 'requested')
+        .order_by(Service_req.date_of_request, Service_req.id)
+    )
+    if limit:
+        backlog = backlog.limit(limit)
+    rows = db.session.execute(backlog).all()
+    customers = {row.id: row.customer_id for row in rows}
+
+    assignments = index.assign_many((row.id, row.name, row.pin) for row in rows)
+    assigned = []
+    if assignments:
+        try:
+            with db.engine.begin() as conn:
+                for start in range(0, len(assignments), ASSIGN_BATCH_SIZE):
+                    batch = dict(assignments[start:start + ASSIGN_BATCH_SIZE])
+                    # requests assigned by hand since the query keep their professional
+                    changed = conn.execute(
+                        update(Service_req)
+                        .where(Service_req.id.in_(list(batch)), Service_req.professional_id.is_(None))
+                        .values(professional_id=case(batch, value=Service_req.id))
+                        .returning(Service_req.id)
+                    ).scalars().all()
+                    assigned.extend((request_id, batch[request_id], customers[request_id]) for request_id in changed)
+                    for request_id in batch.keys() - set(changed):
+                        index.add_load(batch[request_id], -1)
+                events.record(conn, [
+                    events.event_row('assigned', request_id, 'requested', customer_id, professional_id)
+                    for request_id, professional_id, customer_id in assigned
+                ])
+        except Exception:
+            index.mark_stale()
+            raise
+        events.publish()
+    return assigned, len(rows) - len(assignments)
+
+
+@event.listens_for(Session, 'before_flush')
+def collect_changes(session, flush_context, instances):
+    loads = defaultdict(int)
+    # users to re-read after the flush, ids of deleted users
+    refreshed, removed = set(), set()
+
+    for obj in session.new:
+        if isinstance(obj, Service_req) and obj.professional_id and (obj.service_status or 'requested') in OPEN_STATUSES:
+            loads[obj.professional_id] += 1
+        elif isinstance(obj, User) and is_professional(obj):
+            refreshed.add(obj)
+    for obj in session.deleted:
+        if isinstance(obj, Service_req):
+            # a deleted request frees the professional it is stored with, not the one it was changed to
+            professional_id = stored_value(session, obj, 'professional_id')
+            if professional_id and stored_value(session, obj, 'service_status') in OPEN_STATUSES:
+                loads[professional_id] -= 1
+        elif isinstance(obj, User):
+            removed.add(obj.id)
+
+    for obj in session.dirty:
+        if isinstance(obj, Service_req):
+            attrs = inspect(obj).attrs
+            if not (attrs.professional_id.history.has_changes() or attrs.service_status.history.has_changes()):
+                continue
+            old_professional = stored_value(session, obj, 'professional_id')
+            old_status = stored_value(session, obj, 'service_status')
+            if old_professional and old_status in OPEN_STATUSES:
+                loads[old_professional] -= 1
+            if obj.professional_id and obj.service_status in OPEN_STATUSES:
+                loads[obj.professional_id] += 1
+        elif isinstance(obj, User):
+            # refresh() drops users that are no longer active professionals, so losing the role counts too
+            attrs = inspect(obj).attrs
+            if any(attrs[name].history.has_changes() for name in ('active', 'service_type', 'pin', 'roles')):
+                refreshed.add(obj)
+
+    if loads or refreshed or removed:
+        flush_context.attributes['assignment_changes'] = (loads, refreshed, removed)
+
+
+@event.listens_for(Session, 'after_flush')
+def apply_changes(session, flush_context):
+    changes = flush_context.attributes.pop('assignment_changes', None)
+    if not changes:
+        return
+    loads, refreshed, removed = changes
+    for professional_id, delta in loads.items():
+        if delta:
+            index.add_load(professional_id, delta)
+    for professional_id in removed:
+        index.remove(professional_id)
+    if refreshed:
+        # new users only have their id after the flush
+        index.refresh(session.connection(), {user.id for user in refreshed})
+    # applied before the commit so picks later in the transaction see them
+    session.info['assignment_flushed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def forget_flushed(session):
+    session.info.pop('assignment_flushed', None)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_on_rollback(session, previous_transaction):
+    if session.info.pop('assignment_flushed', None):
+        index.mark_stale()
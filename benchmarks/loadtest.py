@@ -0,0 +1,300 @@
+"""
+Load test of the real Flask app against a synthetic dataset.
+
+Seeds a fresh SQLite database in bulk (users by role, categories, services,
+service requests and feedback), then drives the app through its test client
+and reports per endpoint p50/p95/p99 latency, throughput and SQL queries per
+request. Results are written as JSON so runs can be compared:
+
+    python benchmarks/loadtest.py --customers 2000 --requests 50000 --output before.json
+    python benchmarks/loadtest.py --customers 2000 --requests 50000 --output after.json --compare before.json
+
+The same --seed always produces the same dataset and request mix. The
+response cache uses SimpleCache unless --cache-type says otherwise
+(NullCache measures the uncached path).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SEARCH_TERMS = ['clean', 'plumb', 'paint', 'repair', 'garden', 'electric', 'kitchen', 'deep', 'urgent', 'weekly']
+STATUSES = ['requested', 'accepted', 'closed']
+BATCH_SIZE = 5000
+
+
+class QueryCounter:
+    """
+    SQL statements executed by the current thread
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+
+def create_app(database_path, cache_type):
+    # create_app reads FLASK_* overrides from the environment
+    os.environ['FLASK_SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database_path}'
+    os.environ['FLASK_CACHE_TYPE'] = cache_type
+    os.environ['FLASK_DEBUG'] = 'false'
+    import main
+    return main.app
+
+
+def insert_batches(conn, table, rows):
+    from sqlalchemy import insert
+    for start in range(0, len(rows), BATCH_SIZE):
+        conn.execute(insert(table), rows[start:start + BATCH_SIZE])
+
+
+def seed(app, args):
+    """
+    Bulk insert the synthetic dataset; returns the emails of the seeded users by role
+    """
+    from flask_security.utils import hash_password
+    from sqlalchemy import select
+    from extensions import db
+    from models import User, Role, UserRoles, Category, Service, Service_req, Feedback
+    import counters
+    import rollups
+
+    rng = random.Random(args.seed)
+    now = datetime(2024, 6, 30, 12, 0)
+    with app.app_context():
+        password = hash_password('pass')
+        with db.engine.begin() as conn:
+            roles = dict(conn.execute(select(Role.name, Role.id)).all())
+            first_id = (conn.execute(select(User.id).order_by(User.id.desc()).limit(1)).scalar() or 0) + 1
+
+            users, user_roles, emails = [], [], {'cust': [], 'serv': []}
+            for n in range(args.customers + args.professionals):
+                role = 'cust' if n < args.customers else 'serv'
+                email = f'{role}{n}@load.test'
+                users.append({
+                    'id': first_id + n, 'username': f'{role} {n}', 'email': email, 'password': password,
+                    'city': f'city {n % 20}', 'pin': str(600000 + n % 50), 'phone': f'98{n:08d}',
+                    'address': f'{n} Main Road', 'service_type': f'category {n % args.categories}' if role == 'serv' else None,
+                    'experience': str(n % 15) if role == 'serv' else None, 'active': True,
+                    'fs_uniquifier': uuid.UUID(int=rng.getrandbits(128)).hex,
+                })
+                user_roles.append({'user_id': first_id + n, 'role_id': roles[role]})
+                emails[role].append(email)
+            insert_batches(conn, User, users)
+            insert_batches(conn, UserRoles, user_roles)
+            customer_ids = [user['id'] for user in users[:args.customers]]
+            professional_ids = [user['id'] for user in users[args.customers:]]
+
+            insert_batches(conn, Category, [
+                {'name': f'category {n}', 'description': f'{SEARCH_TERMS[n % len(SEARCH_TERMS)]} services'}
+                for n in range(args.categories)
+            ])
+            category_ids = conn.execute(select(Category.id)).scalars().all()
+            insert_batches(conn, Service, [
+                {'name': f'{rng.choice(SEARCH_TERMS)} service {n}', 'category_id': rng.choice(category_ids),
+                 'description': ' '.join(rng.sample(SEARCH_TERMS, 3)), 'price': rng.randrange(100, 5000)}
+                for n in range(args.services)
+            ])
+            service_ids = conn.execute(select(Service.id)).scalars().all()
+
+            requests = []
+            for n in range(args.requests):
+                requested = now - timedelta(minutes=rng.randrange(365 * 24 * 60))
+                status = rng.choice(STATUSES)
+                requests.append({
+                    'customer_id': rng.choice(customer_ids), 'service_id': rng.choice(service_ids),
+                    'professional_id': rng.choice(professional_ids) if status != 'requested' or rng.random() < 0.3 else None,
+                    'date_of_request': requested, 'service_status': status,
+                    'date_of_completion': requested + timedelta(days=rng.randrange(1, 10)) if status == 'closed' else None,
+                    'remarks': ' '.join(rng.sample(SEARCH_TERMS, 2)),
+                })
+            insert_batches(conn, Service_req, requests)
+            insert_batches(conn, Feedback, [
+                {'service_id': rng.choice(service_ids), 'customer_id': rng.choice(customer_ids),
+                 'rating': rng.randrange(1, 6), 'comments': rng.choice(SEARCH_TERMS), 'date': now - timedelta(days=rng.randrange(365))}
+                for _ in range(args.feedback)
+            ])
+
+            # the bulk inserts bypassed the flush hooks; the FTS index followed through its triggers
+            counters.rebuild(conn)
+            rollups.rebuild(conn)
+    return emails
+
+
+def login(client, email):
+    return client.post('/user-login', json={'email': email, 'password': 'pass'}).get_json()['token']
+
+
+def scenarios(client, emails, rng):
+    """
+    {name: callable(client, rng) -> response}, authenticated as the role each
+    endpoint is built for; rng picks the users and parameters of each call
+    """
+    admin = {'Authentication-Token': login(client, 'admin@iitm.ac.in')}
+    customers = [{'Authentication-Token': login(client, email)} for email in rng.sample(emails['cust'], 20)]
+    professionals = [{'Authentication-Token': login(client, email)} for email in rng.sample(emails['serv'], 5)]
+
+    return {
+        'POST /user-login': lambda c, r: c.post('/user-login', json={'email': r.choice(emails['cust']), 'password': 'pass'}),
+        'GET /api/service_requests (admin)': lambda c, r: c.get('/api/service_requests', headers=admin),
+        'GET /api/service_requests (customer)': lambda c, r: c.get('/api/service_requests', headers=r.choice(customers)),
+        'GET /api/service_requests (professional)': lambda c, r: c.get(
+            '/api/service_requests', query_string={'status': r.choice(STATUSES)}, headers=r.choice(professionals)),
+        'POST /api/search_services': lambda c, r: c.post(
+            '/api/search_services', json={'search': r.choice(SEARCH_TERMS)}, headers=r.choice(customers)),
+        'GET /api/admin/summary': lambda c, r: c.get('/api/admin/summary', headers=admin),
+        'GET /api/feedbacks': lambda c, r: c.get('/api/feedbacks'),
+    }
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def run_scenario(app, call, counter, args):
+    latencies, queries = [], []
+    errors = 0
+    lock = threading.Lock()
+    per_thread = args.iterations // args.concurrency
+
+    def worker(index):
+        nonlocal errors
+        client = app.test_client()
+        # a generator per thread, so each thread makes the same calls whatever the scheduling
+        rng = random.Random(args.seed + index)
+        for _ in range(per_thread):
+            counter.reset()
+            start = time.perf_counter()
+            response = call(client, rng)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed * 1000)
+                queries.append(counter.count)
+                errors += response.status_code >= 400
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        'throughput_rps': round(len(latencies) / wall, 1) if wall else 0.0,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else 0.0,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)['endpoints']
+    print(f"\nagainst {baseline_path}")
+    for name, current in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'queries_per_request'):
+            if before[key]:
+                changes.append(f"{key} {(current[key] - before[key]) / before[key] * 100:+.0f}%")
+        print(f"{name:42} " + '  '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--professionals', type=int, default=100)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--services', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--feedback', type=int, default=5000)
+    parser.add_argument('--iterations', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=1, help='client threads per endpoint')
+    parser.add_argument('--cache-type', default='SimpleCache')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database', help='SQLite file to create (default: a temporary file)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='earlier JSON results to compare against')
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    database_path = os.path.abspath(args.database or os.path.join(tmp.name, 'loadtest.db'))
+    if os.path.exists(database_path):
+        sys.exit(f'{database_path} already exists, the load test needs a fresh database')
+
+    app = create_app(database_path, args.cache_type)
+    app.logger.setLevel('WARNING')
+    start = time.perf_counter()
+    emails = seed(app, args)
+    print(f"seeded in {time.perf_counter() - start:.1f}s")
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    counter = QueryCounter()
+    event.listen(Engine, 'before_cursor_execute', counter)
+
+    rng = random.Random(args.seed)
+    results = {}
+    for name, call in scenarios(app.test_client(), emails, rng).items():
+        results[name] = result = run_scenario(app, call, counter, args)
+        print(f"{name:42} p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  "
+              f"{result['throughput_rps']:8.1f} req/s  {result['queries_per_request']:5.1f} queries/req  "
+              f"{result['errors']} errors")
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'database')},
+        },
+        'endpoints': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nresults written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Compare query plans and timings of the hot queries with and without the
+indexes added by migration 2.
+
+    python benchmarks/query_plans.py --requests 200000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import insert, text
+from extensions import db
+from models import User, Role, UserRoles, Category, Service, Service_req, Feedback
+import migrations
+
+QUERIES = {
+    'token lookup': ('SELECT id FROM user WHERE fs_uniquifier = :uniquifier', lambda a: {'uniquifier': f'u{random.randrange(a.users)}'}),
+    'professionals': ('SELECT count(*) FROM user JOIN user_roles ON user.id = user_roles.user_id '
+                      'JOIN role ON role.id = user_roles.role_id WHERE role.name = :role', lambda a: {'role': 'serv'}),
+    'daily reminder': ('SELECT count(*) FROM service_req WHERE professional_id = :id AND service_status = :status',
+                       lambda a: {'id': random.randrange(1, a.users // 10), 'status': 'requested'}),
+    'professional summary': ('SELECT count(*) FROM service_req WHERE professional_id = :id AND service_status = :status',
+                             lambda a: {'id': random.randrange(1, a.users // 10), 'status': 'closed'}),
+    'customer requests this month': ('SELECT id FROM service_req WHERE customer_id = :id AND date_of_request >= :since',
+                                     lambda a: {'id': random.randrange(a.users // 10, a.users), 'since': datetime.utcnow().replace(day=1)}),
+    'customer closed this month': ('SELECT id FROM service_req WHERE customer_id = :id AND date_of_completion >= :since',
+                                   lambda a: {'id': random.randrange(a.users // 10, a.users), 'since': datetime.utcnow().replace(day=1)}),
+    'completed requests': ('SELECT count(*) FROM service_req WHERE service_status = :status', lambda a: {'status': 'closed'}),
+    'request list page': ('SELECT id FROM service_req WHERE (date_of_request, id) > (:date, 0) ORDER BY date_of_request, id LIMIT 100',
+                          lambda a: {'date': datetime.utcnow() - timedelta(days=random.randrange(365))}),
+    'service feedback': ('SELECT id FROM feedback WHERE service_id = :id ORDER BY rating DESC LIMIT 5',
+                         lambda a: {'id': random.randrange(1, a.services)}),
+}
+
+
+def seed(args):
+    now = datetime.utcnow()
+    professionals = args.users // 10
+    db.session.execute(insert(Role), [{'id': 1, 'name': 'serv'}, {'id': 2, 'name': 'cust'}])
+    db.session.execute(insert(User), [
+        {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com', 'password': 'x',
+         'active': True, 'fs_uniquifier': f'u{i}'}
+        for i in range(1, args.users + 1)
+    ])
+    db.session.execute(insert(UserRoles), [
+        {'user_id': i, 'role_id': 1 if i <= professionals else 2} for i in range(1, args.users + 1)
+    ])
+    db.session.execute(insert(Category), [{'id': 1, 'name': 'General', 'description': 'General'}])
+    db.session.execute(insert(Service), [
+        {'id': i, 'name': f'service {i}', 'price': 100, 'category_id': 1} for i in range(1, args.services + 1)
+    ])
+    statuses = ['requested', 'accepted', 'closed']
+    rows = []
+    for i in range(1, args.requests + 1):
+        status = random.choice(statuses)
+        requested = now - timedelta(days=random.randrange(365), seconds=random.randrange(86400))
+        rows.append({
+            'id': i,
+            'customer_id': random.randrange(professionals + 1, args.users + 1),
+            'professional_id': random.randrange(1, professionals + 1),
+            'service_id': random.randrange(1, args.services + 1),
+            'date_of_request': requested,
+            'date_of_completion': requested + timedelta(days=1) if status == 'closed' else None,
+            'service_status': status,
+        })
+    db.session.execute(insert(Service_req), rows)
+    db.session.execute(insert(Feedback), [
+        {'service_id': random.randrange(1, args.services + 1), 'customer_id': random.randrange(professionals + 1, args.users + 1),
+         'rating': random.randint(1, 5), 'date': now}
+        for _ in range(args.requests // 4)
+    ])
+    db.session.commit()
+
+
+def measure(args, label):
+    print(f"\n== {label} ==")
+    db.session.remove()
+    results = {}
+    for name, (sql, params) in QUERIES.items():
+        plan = db.session.execute(text('EXPLAIN QUERY PLAN ' + sql), params(args)).all()
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            db.session.execute(text(sql), params(args)).all()
+        elapsed = (time.perf_counter() - start) / args.repeat * 1000
+        results[name] = elapsed
+        print(f"{name:32} {elapsed:9.3f} ms   " + ' | '.join(row.detail for row in plan))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--services', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        db.init_app(app)
+        with app.app_context():
+            migrations.upgrade()
+            seed(args)
+
+            with db.engine.begin() as conn:
+                migrations.drop_indexes(conn, migrations.HOT_PATH_INDEXES)
+                conn.execute(text('ANALYZE'))
+            before = measure(args, 'without indexes')
+
+            with db.engine.begin() as conn:
+                migrations.hot_path_indexes(conn)
+                conn.execute(text('ANALYZE'))
+            after = measure(args, 'with indexes')
+
+            print("\n== speedup ==")
+            for name in QUERIES:
+                print(f"{name:32} {before[name] / after[name]:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Checks that the precompiled serializers produce byte-identical bodies to
+flask_restful's marshal + output_json for the service request, service and
+feedback field dicts (debug and non-debug, empty lists, missing relations,
+non-ASCII text, naive and aware datetimes, Row tuples), then times both
+paths on a large request list.
+
+    python benchmarks/serializer.py --rows 5000
+
+Exits non-zero if any body differs.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask_restful import marshal
+from flask_restful.representations.json import output_json
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, create_engine, select
+from resources import service_req_fields, service_fields, feedback_fields
+import serializers
+
+
+def user(i):
+    return SimpleNamespace(username=f'user {i} – Ünïcode', email=f'user{i}@example.com', phone=None,
+                           address='12 "Quoted" St\n', pin=str(600000 + i))
+
+
+def service_requests(n):
+    rows = []
+    for i in range(n):
+        requested = datetime(2024, 1, 1, 9, 30) + timedelta(hours=7 * i)
+        rows.append(SimpleNamespace(
+            id=i, customer_id=i % 100, customer=user(i % 100),
+            professional_id=None if i % 3 == 0 else i % 7,
+            professional=None if i % 3 == 0 else user(i % 7),
+            service_id=i % 10, service=SimpleNamespace(name=f'service {i % 10}'),
+            date_of_request=requested if i % 5 else requested.replace(tzinfo=timezone(timedelta(hours=5, minutes=30))),
+            date_of_completion=requested + timedelta(days=2) if i % 2 else None,
+            service_status=('requested', 'accepted', 'closed')[i % 3],
+            remarks=None if i % 4 == 0 else f'remark {i} \\ with \t escapes',
+        ))
+    return rows
+
+
+def services(n):
+    return [SimpleNamespace(id=i, name=f'service {i}', description=None if i % 2 else 'déscription',
+                            price=None if i % 3 == 0 else i * 100, category_id=i % 4) for i in range(n)]
+
+
+def feedback_rows(n):
+    # Row tuples, as FeedbackResource.get returns them
+    metadata = MetaData()
+    table = Table(
+        'feedback', metadata, Column('id', Integer), Column('service_id', Integer), Column('customer_id', Integer),
+        Column('customer_name', String), Column('service_name', String), Column('rating', Integer),
+        Column('comments', String), Column('date', DateTime),
+    )
+    engine = create_engine('sqlite://')
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        if n:
+            conn.execute(table.insert(), [
+                {'id': i, 'service_id': i % 10, 'customer_id': i % 100, 'customer_name': f'user {i}',
+                 'service_name': f'service {i % 10}', 'rating': 1 + i % 5,
+                 'comments': None if i % 2 else f'comment {i} ✓', 'date': datetime(2024, 2, 1, 10) + timedelta(minutes=i)}
+                for i in range(n)
+            ])
+        return conn.execute(select(table)).all()
+
+
+def check(app, label, fields, rows):
+    serializer = serializers.Serializer(fields)
+    with app.test_request_context():
+        expected = output_json(marshal(rows, fields), 200).get_data()
+        actual = serializers.output_json(serializer.dumps(rows), 200).get_data()
+    ok = expected == actual
+    print(f"{label:40} {'identical' if ok else 'DIFFERENT'} ({len(expected)} bytes)")
+    return ok
+
+
+def timed(app, fields, rows, repeat):
+    serializer = serializers.Serializer(fields)
+    results = {}
+    with app.test_request_context():
+        for label, run in (
+            ('marshal + output_json', lambda: output_json(marshal(rows, fields), 200)),
+            ('precompiled serializer', lambda: serializers.output_json(serializer.dumps(rows), 200)),
+        ):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                run()
+            results[label] = (time.perf_counter() - start) / repeat * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    ok = True
+    for debug in (True, False):
+        app = Flask(__name__)
+        app.debug = debug
+        mode = 'debug' if debug else 'production'
+        for name, fields, make in (
+            ('service_req_fields', service_req_fields, service_requests),
+            ('service_fields', service_fields, services),
+            ('feedback_fields', feedback_fields, feedback_rows),
+        ):
+            for n in (0, 1, 300):
+                ok &= check(app, f'{name} {mode} {n} rows', fields, make(n))
+
+        rows = service_requests(args.rows)
+        results = timed(app, service_req_fields, rows, args.repeat)
+        for label, ms in results.items():
+            print(f"{mode:10} {args.rows} service requests  {label:24} {ms:8.1f} ms")
+        print(f"{mode:10} speedup {results['marshal + output_json'] / results['precompiled serializer']:.1f}x\n")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
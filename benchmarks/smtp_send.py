@@ -0,0 +1,123 @@
+"""
+Messages/sec of the pooled SMTP sender against the previous
+connect-send-quit per message, using a local stand-in SMTP server.
+
+    python benchmarks/smtp_send.py --messages 500 --connect-latency 20
+
+--drop-every makes the server hang up after that many messages on a
+connection, to exercise transparent reconnects.
+"""
+import argparse
+import os
+import socketserver
+import sys
+import threading
+import time
+from smtplib import SMTP
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mail_service
+
+
+class StandInSMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        time.sleep(server.connect_latency)
+        self.reply('220 stand-in ESMTP')
+        delivered = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply('250 stand-in')
+            elif command.startswith(('MAIL', 'RCPT', 'RSET', 'NOOP')):
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                delivered += 1
+                with server.lock:
+                    server.delivered += 1
+                self.reply('250 OK')
+                if server.drop_every and delivered % server.drop_every == 0:
+                    return
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class StandInSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, connect_latency=0.0, drop_every=0):
+        super().__init__(('127.0.0.1', 0), StandInSMTPHandler)
+        self.connect_latency = connect_latency
+        self.drop_every = drop_every
+        self.delivered = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+def messages(n):
+    return [(f'user{i}@example.com', 'Monthly Activity Report', '<p>report</p>') for i in range(n)]
+
+
+def send_one_connection_each(port, batch):
+    # what mail_service.send_message did before pooling
+    for to, subject, body in batch:
+        client = SMTP(host='127.0.0.1', port=port)
+        client.send_message(msg=mail_service.build_message(to, subject, body))
+        client.quit()
+    return len(batch)
+
+
+def send_pooled(port, batch):
+    pool = mail_service.SMTPPool(host='127.0.0.1', port=port)
+    try:
+        return pool.send_messages(batch)
+    finally:
+        pool.close()
+
+
+def run(label, sender, args):
+    with StandInSMTPServer(args.connect_latency / 1000, args.drop_every) as server:
+        port = server.server_address[1]
+        start = time.perf_counter()
+        sent = sender(port, messages(args.messages))
+        elapsed = time.perf_counter() - start
+    print(f"{label:28} {sent:6} sent  {server.delivered:6} delivered  {sent / elapsed:10.1f} msg/s")
+    return sent / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--connect-latency', type=float, default=20.0, help='ms before the server greeting')
+    parser.add_argument('--drop-every', type=int, default=0)
+    args = parser.parse_args()
+    mail_service.logger.setLevel('WARNING')
+
+    baseline = run('connection per message', send_one_connection_each, args)
+    pooled = run('pooled connection', send_pooled, args)
+    print(f"speedup {pooled / baseline:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
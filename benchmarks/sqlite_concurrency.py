@@ -0,0 +1,136 @@
+"""
+Writers and long reporting readers hitting one SQLite file at the same
+time, with the engine defaults the app used to run on (rollback journal)
+against the tuned configuration from database.py (WAL, busy timeout,
+synchronous=NORMAL, caches, query_only readers on their own engine).
+
+    python benchmarks/sqlite_concurrency.py --rows 200000 --writers 4 --readers 4 --seconds 10
+
+Reports committed writes/s, completed report queries/s, write latency
+percentiles and how many operations failed with "database is locked".
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+import database
+
+SCHEMA = """
+CREATE TABLE service_req (
+    id INTEGER PRIMARY KEY,
+    customer_id INTEGER,
+    service_id INTEGER NOT NULL,
+    service_status VARCHAR(20) NOT NULL,
+    remarks TEXT
+)
+"""
+REPORT = """
+SELECT service_id, service_status, count(*), sum(length(remarks))
+FROM service_req GROUP BY service_id, service_status
+"""
+
+
+def seed(path, rows):
+    engine = create_engine(f'sqlite:///{path}')
+    with engine.begin() as conn:
+        conn.execute(text(SCHEMA))
+        conn.execute(text(
+            "INSERT INTO service_req (customer_id, service_id, service_status, remarks) "
+            "VALUES (:customer_id, :service_id, 'requested', :remarks)"
+        ), [{'customer_id': i % 1000, 'service_id': i % 50, 'remarks': f'remark {i} ' * 4} for i in range(rows)])
+    engine.dispose()
+
+
+def engines(path, tuned):
+    url = f'sqlite:///{path}'
+    if not tuned:
+        engine = create_engine(url)
+        return engine, engine
+    config = dict(database.DEFAULTS)
+    writer = create_engine(url, pool_size=config['DB_POOL_SIZE'], max_overflow=config['DB_MAX_OVERFLOW'])
+    reader = create_engine(url, pool_size=config['DB_READONLY_POOL_SIZE'], max_overflow=config['DB_MAX_OVERFLOW'])
+    database.install_pragmas(writer, database.pragmas(config))
+    database.install_pragmas(reader, database.pragmas(config, read_only=True))
+    return writer, reader
+
+
+def run(label, path, args, tuned):
+    writer, reader = engines(path, tuned)
+    stop = threading.Event()
+    lock = threading.Lock()
+    stats = {'writes': 0, 'reads': 0, 'locked': 0, 'latencies': []}
+
+    def write_loop(n):
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                with writer.begin() as conn:
+                    conn.execute(text(
+                        "INSERT INTO service_req (customer_id, service_id, service_status, remarks) "
+                        "VALUES (:customer_id, 1, 'requested', 'new')"
+                    ), {'customer_id': n})
+                    conn.execute(text(
+                        "UPDATE service_req SET service_status = 'accepted' WHERE id = :id"
+                    ), {'id': n + 1})
+            except OperationalError:
+                with lock:
+                    stats['locked'] += 1
+                continue
+            with lock:
+                stats['writes'] += 1
+                stats['latencies'].append(time.perf_counter() - start)
+
+    def read_loop():
+        while not stop.is_set():
+            try:
+                with reader.connect() as conn:
+                    conn.execute(text(REPORT)).all()
+            except OperationalError:
+                with lock:
+                    stats['locked'] += 1
+                continue
+            with lock:
+                stats['reads'] += 1
+
+    threads = [threading.Thread(target=write_loop, args=(n,)) for n in range(args.writers)]
+    threads += [threading.Thread(target=read_loop) for _ in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    writer.dispose()
+    reader.dispose()
+
+    latencies = sorted(stats['latencies']) or [0.0]
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+    print(f"{label:10} {stats['writes'] / args.seconds:9.1f} writes/s  {stats['reads'] / args.seconds:7.1f} reports/s  "
+          f"write p50 {pct(0.5):7.1f} ms  p99 {pct(0.99):8.1f} ms  locked errors {stats['locked']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, tuned in (('default', False), ('tuned', True)):
+            path = os.path.join(tmp, f'{label}.db')
+            seed(path, args.rows)
+            run(label, path, args, tuned)
+
+
+if __name__ == '__main__':
+    main()
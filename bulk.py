@@ -0,0 +1,365 @@
+"""
+Bulk import and export of services, categories and service requests as
+JSON Lines or CSV.
+
+Imports are validated row by row with the same rules as the single row
+endpoints, then written in batches of BATCH_SIZE rows, one transaction and
+one executemany per batch. Rows that fail validation are reported with
+their line number and skipped; they do not abort the rest of the batch.
+The upload is first copied to a temporary file and checked to be UTF-8,
+so a file that is not is rejected as a whole, before any row is written.
+Empty CSV cells count as missing values and get the field's default.
+Multi-row INSERTs bypass the session flush hooks, so each batch updates the
+admin summary counters, the monthly rollups and the service request events
+itself. The full-text index is kept in sync by its triggers.
+
+Exports stream the same format back out, so an export can be imported into
+another instance unchanged.
+"""
+from collections import Counter, namedtuple
+from datetime import datetime
+import codecs
+import csv
+import io
+import json
+import tempfile
+from flask import Response, request, stream_with_context
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from database import read_session
+from models import User, Category, Service, Service_req
+from pagination import NDJSON_MIMETYPE, STREAM_BATCH_SIZE
+from response_cache import invalidate, user_requests_tag
+import assignment
+import counters
+import events
+import rollups
+
+BATCH_SIZE = 1000
+# errors listed in the import report; the failed count is always complete
+MAX_REPORTED_ERRORS = 1000
+
+CSV_MIMETYPE = 'text/csv'
+FORMATS = ('jsonl', 'csv')
+# bytes read from the upload at a time
+UPLOAD_CHUNK_SIZE = 64 * 1024
+NEWLINE = b'\n'
+
+
+class InvalidUpload(ValueError):
+    pass
+
+
+def _str(value):
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise ValueError('must be a string')
+    return value
+
+
+def _int(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool) or isinstance(value, float):
+        raise ValueError('must be an integer')
+    return int(value)
+
+
+def _datetime(value):
+    if value is None or value == '':
+        return None
+    return datetime.fromisoformat(value)
+
+
+# (column, converter, required, default when the field is absent)
+Field = namedtuple('Field', 'name convert required default')
+Kind = namedtuple('Kind', 'model fields references')
+
+KINDS = {
+    'categories': Kind(Category, (
+        Field('id', _int, False, None),
+        Field('name', _str, True, None),
+        Field('description', _str, True, None),
+    ), {}),
+    'services': Kind(Service, (
+        Field('id', _int, False, None),
+        Field('name', _str, True, None),
+        Field('description', _str, False, None),
+        Field('price', _int, False, None),
+        Field('category_id', _int, True, None),
+    ), {'category_id': Category}),
+    'service_requests': Kind(Service_req, (
+        Field('id', _int, False, None),
+        Field('customer_id', _int, True, None),
+        Field('professional_id', _int, False, None),
+        Field('service_id', _int, True, None),
+        Field('date_of_request', _datetime, False, datetime.utcnow),
+        Field('date_of_completion', _datetime, False, None),
+        Field('service_status', _str, False, lambda: 'requested'),
+        Field('remarks', _str, False, lambda: 'No remarks'),
+    ), {'customer_id': User, 'professional_id': User, 'service_id': Service}),
+}
+
+
+def request_format(default='jsonl'):
+    """
+    Format of the upload (Content-Type) or download (Accept), overridden by ?format=
+    """
+    fmt = request.args.get('format')
+    if fmt:
+        return fmt
+    if request.method == 'POST':
+        return 'csv' if request.mimetype == CSV_MIMETYPE else default
+    best = request.accept_mimetypes.best_match([NDJSON_MIMETYPE, CSV_MIMETYPE])
+    return 'csv' if best == CSV_MIMETYPE else default
+
+
+def spool_upload(stream):
+    """
+    Copy the upload to a temporary file, checking on the way that it is
+    UTF-8, so an undecodable file is rejected before any row is imported.
+    Raises InvalidUpload with the line and byte offset of the first bad byte.
+    """
+    upload = tempfile.TemporaryFile()
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    offset, line = 0, 1
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_SIZE)
+        # bytes of a character split across chunks, never a newline
+        pending = decoder.getstate()[0]
+        try:
+            decoder.decode(chunk, final=not chunk)
+        except UnicodeDecodeError as e:
+            upload.close()
+            before = (pending + chunk)[:e.start]
+            raise InvalidUpload(
+                f'not valid UTF-8 at line {line + before.count(NEWLINE)} (byte {offset - len(pending) + e.start}): {e.reason}'
+            )
+        if not chunk:
+            break
+        upload.write(chunk)
+        offset += len(chunk)
+        line += chunk.count(NEWLINE)
+    upload.seek(0)
+    return upload
+
+
+def read_rows(stream, fmt):
+    """
+    Yield (line number, row dict or None, parse error or None) from a binary stream
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+
+    for line_no, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, f'invalid JSON: {e}'
+            continue
+        if isinstance(row, dict):
+            yield line_no, row, None
+        else:
+            yield line_no, None, 'expected a JSON object'
+
+
+def validate(kind, row):
+    """
+    Convert a raw row to column values; returns (values, {field: error})
+    """
+    values, errors = {}, {}
+    for field in kind.fields:
+        raw = row.get(field.name)
+        # an absent key, null and an empty CSV cell all mean the value is missing
+        if raw is None or raw == '':
+            if field.default is not None:
+                values[field.name] = field.default()
+            elif field.required:
+                errors[field.name] = 'is required'
+            else:
+                values[field.name] = None
+            continue
+        try:
+            value = field.convert(raw)
+        except (TypeError, ValueError) as e:
+            errors[field.name] = str(e)
+            continue
+        values[field.name] = value
+    # a closed request without a completion date would count as closed for
+    # the admin counters but as pending in the customer's monthly rollups
+    if values.get('service_status') == 'closed' and 'date_of_completion' in values \
+            and values['date_of_completion'] is None and 'date_of_completion' not in errors:
+        errors['date_of_completion'] = "is required when service_status is 'closed'"
+    return values, errors
+
+
+def _existing_ids(conn, model, ids):
+    ids = {id for id in ids if id is not None}
+    if not ids:
+        return set()
+    return set(conn.execute(select(model.id).where(model.id.in_(ids))).scalars())
+
+
+def _check_references(conn, kind, candidates):
+    """
+    Drop rows that point at missing rows or reuse an existing id; returns (kept, errors)
+    """
+    errors = {}
+    for column, model in kind.references.items():
+        found = _existing_ids(conn, model, (values[column] for _, values in candidates))
+        for line_no, values in candidates:
+            if values[column] is not None and values[column] not in found:
+                errors.setdefault(line_no, {})[column] = f'{model.__name__} {values[column]} not found'
+
+    taken = _existing_ids(conn, kind.model, (values['id'] for _, values in candidates))
+    seen = set()
+    for line_no, values in candidates:
+        id = values['id']
+        if id is not None and (id in taken or id in seen):
+            errors.setdefault(line_no, {})['id'] = f'id {id} already exists'
+        seen.add(id)
+
+    kept = [(line_no, values) for line_no, values in candidates if line_no not in errors]
+    return kept, errors
+
+
+def _record_inserts(conn, kind, rows, ids):
+    """
+    Counter, rollup and event bookkeeping the flush hooks would have done
+    for the inserted rows, whose ids the INSERT returned
+    """
+    if kind.model is Category:
+        counters.bump(conn, 'categories', len(rows))
+    elif kind.model is Service:
+        counters.bump(conn, 'services', len(rows))
+    elif kind.model is Service_req:
+        counters.bump(conn, 'service_reqs', len(rows))
+        for status, n in Counter(row['service_status'] for row in rows).items():
+            counters.bump(conn, counters.status_counter(status), n)
+        for service_id, n in Counter(row['service_id'] for row in rows).items():
+            counters.bump_service(conn, service_id, n)
+        rollups.rebuild(conn, {row['customer_id'] for row in rows})
+        events.record_created(conn, Service_req.id.in_(ids))
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+        self.user_ids = set()
+
+    def error(self, line_no, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_no, 'errors': errors})
+
+    def as_dict(self):
+        errors = sorted(self.errors, key=lambda error: error['line'])
+        return {'inserted': self.inserted, 'failed': self.failed, 'errors': errors}
+
+
+def _import_batch(kind, batch, report):
+    candidates = []
+    for line_no, row, parse_error in batch:
+        if parse_error:
+            report.error(line_no, {'row': parse_error})
+            continue
+        values, errors = validate(kind, row)
+        if errors:
+            report.error(line_no, errors)
+        else:
+            candidates.append((line_no, values))
+    if not candidates:
+        return
+
+    try:
+        with db.engine.begin() as conn:
+            candidates, errors = _check_references(conn, kind, candidates)
+            for line_no, row_errors in sorted(errors.items()):
+                report.error(line_no, row_errors)
+            if not candidates:
+                return
+            rows = [values for _, values in candidates]
+            ids = conn.execute(insert(kind.model).returning(kind.model.id), rows).scalars().all()
+            _record_inserts(conn, kind, rows, ids)
+    except IntegrityError as e:
+        for line_no, _ in candidates:
+            report.error(line_no, {'row': f'batch rejected by the database: {e.orig}'})
+        return
+
+    report.inserted += len(rows)
+    for row in rows:
+        report.user_ids.update((row.get('customer_id'), row.get('professional_id')))
+
+
+def import_rows(kind_name, rows):
+    """
+    Validate and insert parsed rows in batches; returns the import report
+    """
+    kind = KINDS[kind_name]
+    report = ImportReport()
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            _import_batch(kind, batch, report)
+            batch = []
+    if batch:
+        _import_batch(kind, batch, report)
+
+    if report.inserted:
+        if kind.model is Category:
+            invalidate('category')
+        elif kind.model is Service:
+            invalidate('service')
+        else:
+            assignment.index.mark_stale()
+            events.publish()
+            invalidate('service_req', *[user_requests_tag(id) for id in report.user_ids if id])
+    return report
+
+
+def _export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def export_response(kind_name, fmt):
+    """
+    Stream every row of a kind, ordered by id, in the import format
+    """
+    kind = KINDS[kind_name]
+    names = [field.name for field in kind.fields]
+    query = read_session.query(*[getattr(kind.model, name) for name in names]).order_by(kind.model.id)
+
+    def generate_jsonl():
+        for row in query.yield_per(STREAM_BATCH_SIZE):
+            yield json.dumps({name: _export_value(value) for name, value in zip(names, row)}) + '\n'
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(names)
+        for row in query.yield_per(STREAM_BATCH_SIZE):
+            writer.writerow([_export_value(value) for value in row])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    if fmt == 'csv':
+        generate, mimetype = generate_csv, CSV_MIMETYPE
+    else:
+        generate, mimetype = generate_jsonl, NDJSON_MIMETYPE
+    return Response(
+        stream_with_context(generate()), mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={kind_name}.{fmt}'},
+    )
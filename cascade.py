@@ -0,0 +1,205 @@
+"""
+Set-based cascading deletes for services and professionals.
+
+Dependent rows are deleted (or unassigned) with one statement per batch of
+CASCADE_BATCH_SIZE ids, each batch in its own transaction, so a large
+cascade never holds the write lock for long and can simply be run again if
+it is interrupted. Like bulk.py, the statements bypass the session flush
+hooks and keep the summary counters, rating aggregates, monthly rollups and
+service request events up to date themselves, and mark the assignment index
+stale; the full-text index follows through its triggers.
+
+A professional is deactivated before their cascade starts, so they can
+neither sign in nor be assigned work while it runs.
+
+delete_service() and delete_professional() are generators yielding
+(done, total) after every batch. Small cascades are drained inside the
+request; cascades larger than INLINE_CASCADE_LIMIT rows are handed to the
+delete_*_cascade Celery tasks, which publish the progress as task state.
+"""
+from collections import Counter, defaultdict
+from sqlalchemy import delete, func, select, update
+from extensions import db
+from model_history import OPEN_STATUSES
+from models import User, Service, Service_req, Feedback, ServiceStats
+from response_cache import invalidate, user_requests_tag
+import assignment
+import counters
+import events
+import principal_cache
+import rollups
+
+CASCADE_BATCH_SIZE = 1000
+INLINE_CASCADE_LIMIT = 5000
+
+
+def _count(conn, model, condition):
+    return conn.execute(select(func.count()).select_from(model).where(condition)).scalar()
+
+
+def service_cascade_size(service_id):
+    with db.engine.connect() as conn:
+        return (_count(conn, Service_req, Service_req.service_id == service_id)
+                + _count(conn, Feedback, Feedback.service_id == service_id))
+
+
+def professional_cascade_size(user_id):
+    with db.engine.connect() as conn:
+        return (_count(conn, Service_req, Service_req.professional_id == user_id)
+                + _count(conn, Service_req, Service_req.customer_id == user_id)
+                + _count(conn, Feedback, Feedback.customer_id == user_id))
+
+
+def _delete_feedback(condition):
+    while True:
+        with db.engine.begin() as conn:
+            rows = conn.execute(
+                select(Feedback.id, Feedback.service_id, Feedback.rating).where(condition).limit(CASCADE_BATCH_SIZE)
+            ).all()
+            if not rows:
+                return
+            conn.execute(delete(Feedback).where(Feedback.id.in_([row.id for row in rows])))
+
+            ratings = defaultdict(Counter)
+            for row in rows:
+                ratings[row.service_id][row.rating] -= 1
+            for service_id, service_ratings in ratings.items():
+                counters.bump_ratings(conn, service_id, service_ratings)
+        yield len(rows)
+
+
+def _delete_requests(condition, user_ids):
+    """
+    Delete matching service requests batch by batch, recording the affected users in user_ids
+    """
+    while True:
+        with db.engine.begin() as conn:
+            rows = conn.execute(
+                select(Service_req.id, Service_req.customer_id, Service_req.professional_id,
+                       Service_req.service_id, Service_req.service_status)
+                .where(condition).limit(CASCADE_BATCH_SIZE)
+            ).all()
+            if not rows:
+                return
+            conn.execute(delete(Service_req).where(Service_req.id.in_([row.id for row in rows])))
+            events.record(conn, [
+                events.event_row('deleted', row.id, row.service_status, row.customer_id, row.professional_id)
+                for row in rows
+            ])
+
+            counters.bump(conn, 'service_reqs', -len(rows))
+            for status, n in Counter(row.service_status for row in rows).items():
+                counters.bump(conn, counters.status_counter(status), -n)
+            for service_id, n in Counter(row.service_id for row in rows).items():
+                counters.bump_service(conn, service_id, -n)
+            customer_ids = {row.customer_id for row in rows if row.customer_id}
+            rollups.rebuild(conn, customer_ids)
+        user_ids.update(customer_ids, (row.professional_id for row in rows if row.professional_id))
+        yield len(rows)
+
+
+def _unassign_requests(professional_id, user_ids):
+    """
+    Detach a professional from their requests; open requests go back to 'requested'
+    """
+    condition = Service_req.professional_id == professional_id
+    while True:
+        with db.engine.begin() as conn:
+            rows = conn.execute(
+                select(Service_req.id, Service_req.customer_id, Service_req.service_status)
+                .where(condition).limit(CASCADE_BATCH_SIZE)
+            ).all()
+            if not rows:
+                return
+            ids = [row.id for row in rows]
+            conn.execute(update(Service_req).where(Service_req.id.in_(ids)).values(professional_id=None))
+            conn.execute(
+                update(Service_req)
+                .where(Service_req.id.in_(ids), Service_req.service_status.in_(OPEN_STATUSES))
+                .values(service_status='requested')
+            )
+
+            reopened = Counter()
+            changes = []
+            for row in rows:
+                status = row.service_status
+                if status in OPEN_STATUSES and status != 'requested':
+                    reopened[status] += 1
+                    status = 'requested'
+                changes.append(events.event_row('assigned', row.id, status, row.customer_id, None, professional_id))
+                if status != row.service_status:
+                    changes.append(events.event_row('status', row.id, status, row.customer_id, None))
+            events.record(conn, changes)
+            for status, n in reopened.items():
+                counters.bump(conn, counters.status_counter(status), -n)
+                counters.bump(conn, counters.status_counter('requested'), n)
+        user_ids.update(row.customer_id for row in rows if row.customer_id)
+        yield len(rows)
+
+
+def delete_service(service_id):
+    """
+    Delete a service with its feedback and service requests, yielding (done, total)
+    """
+    total = service_cascade_size(service_id)
+    done = 0
+    user_ids = set()
+    for deleted in _delete_feedback(Feedback.service_id == service_id):
+        done += deleted
+        yield done, total
+    for deleted in _delete_requests(Service_req.service_id == service_id, user_ids):
+        done += deleted
+        yield done, total
+
+    with db.engine.begin() as conn:
+        if conn.execute(delete(Service).where(Service.id == service_id)).rowcount:
+            counters.bump(conn, 'services', -1)
+        conn.execute(delete(ServiceStats).where(ServiceStats.service_id == service_id))
+    assignment.index.mark_stale()
+    events.publish()
+    invalidate('service', 'feedback', 'service_req', *[user_requests_tag(id) for id in user_ids])
+    yield done, total
+
+
+def delete_professional(user_id):
+    """
+    Delete a professional: unassign their requests, delete the requests and
+    feedback they made as a customer, then the user itself. Yields (done, total).
+    """
+    with db.engine.begin() as conn:
+        conn.execute(update(User).where(User.id == user_id).values(active=False))
+    principal_cache.evict_users([user_id])
+    assignment.index.mark_stale()
+
+    total = professional_cascade_size(user_id)
+    done = 0
+    user_ids = {user_id}
+    steps = (
+        _unassign_requests(user_id, user_ids),
+        _delete_feedback(Feedback.customer_id == user_id),
+        _delete_requests(Service_req.customer_id == user_id, user_ids),
+    )
+    for step in steps:
+        for n in step:
+            done += n
+            yield done, total
+
+    # through the session, so user_roles, the user counters and the principal cache follow
+    user = db.session.get(User, user_id)
+    if user is not None:
+        db.session.delete(user)
+        db.session.commit()
+    assignment.index.mark_stale()
+    events.publish()
+    invalidate('user', 'feedback', 'service_req', *[user_requests_tag(id) for id in user_ids])
+    yield done, total
+
+
+def run(cascade):
+    """
+    Drain a cascade inside the current request; returns the number of dependent rows handled
+    """
+    done = 0
+    for done, _ in cascade:
+        pass
+    return done
@@ -0,0 +1,90 @@
+"""
+Versioned snapshots of the catalog: categories, the services of each
+category, the service listing and the service types.
+
+Each document is serialized once, compressed once with gzip (and brotli
+when the Brotli package is installed) and kept in the process until its
+version changes. The version of a document is the version of the response
+cache tags it is built from ('category', 'service', ...), which every
+catalog write already bumps through invalidate(), so all workers see a
+write at the same time and rebuild on their next request. Responses carry
+an ETag for the version and answer If-None-Match with 304. When the cache
+is unavailable the documents are built and served uncached, without one.
+"""
+from collections import namedtuple
+from threading import Lock
+import gzip
+import hashlib
+import logging
+from flask import Response, request
+from response_cache import tag_versions
+import serializers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+Snapshot = namedtuple('Snapshot', 'version etag status bodies')
+
+
+def _encodings(body):
+    bodies = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        bodies['br'] = brotli.compress(body, quality=11)
+    return bodies
+
+
+class Catalog:
+    def __init__(self):
+        self._lock = Lock()
+        # document name -> Snapshot
+        self._snapshots = {}
+
+    def snapshot(self, name, tags, build):
+        """
+        Current snapshot of a document; build() returns the view result
+        (body, status) and only runs when the tags changed since the last build
+        """
+        try:
+            version = tuple(tag_versions(*tags))
+        except Exception as e:
+            logger.error(f"Response cache unavailable: {e}")
+            version = None
+        snapshot = self._snapshots.get(name)
+        if version is not None and snapshot is not None and snapshot.version == version:
+            return snapshot
+
+        data, status = build()
+        body = serializers.output_json(data, status).get_data()
+        if status != 200 or version is None:
+            # errors (an unknown category), and anything built without a version, are served uncached
+            return Snapshot(version, None, status, {'identity': body})
+        etag = hashlib.sha1(repr((name, version)).encode()).hexdigest()
+        snapshot = Snapshot(version, etag, status, _encodings(body))
+        with self._lock:
+            self._snapshots[name] = snapshot
+        return snapshot
+
+    def response(self, name, tags, build):
+        snapshot = self.snapshot(name, tags, build)
+        if snapshot.etag is None:
+            return Response(snapshot.bodies['identity'], status=snapshot.status, content_type='application/json')
+        encoding = request.accept_encodings.best_match([e for e in ('br', 'gzip') if e in snapshot.bodies])
+        etag = snapshot.etag if encoding is None else f'{snapshot.etag}-{encoding}'
+        headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+
+        # any representation of the current version is still valid
+        if any(request.if_none_match.contains(tag) for tag in
+               [snapshot.etag] + [f'{snapshot.etag}-{e}' for e in snapshot.bodies if e != 'identity']):
+            return Response(status=304, headers=headers)
+
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+        return Response(snapshot.bodies[encoding or 'identity'], status=snapshot.status,
+                        content_type='application/json', headers=headers)
+
+
+catalog = Catalog()
@@ -0,0 +1,266 @@
+"""
+Counters behind /api/admin/summary, maintained in the same transaction as
+the writes that change them.
+
+A before_flush hook works out how a flush changes the counts (new and
+deleted users, services, categories and service requests, request status
+changes and feedback ratings) and an after_flush hook applies the deltas as
+upserts, so the counters commit or roll back together with the rows. Bulk
+statements bypass the session and must call bump() / bump_service() /
+bump_ratings() themselves.
+
+    flask counters check     report drift against the base tables
+    flask counters rebuild   recompute every counter from scratch
+"""
+from collections import defaultdict
+import click
+from flask.cli import AppGroup
+from sqlalchemy import delete, event, func, inspect, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from extensions import db
+from database import read_session
+from model_history import is_professional, stored_value, was_professional
+from models import User, Role, UserRoles, Category, Service, Service_req, Feedback, SummaryCounter, ServiceStats
+
+
+def bump(conn, name, delta):
+    if delta:
+        stmt = insert(SummaryCounter).values(name=name, value=delta)
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=[SummaryCounter.name], set_={'value': SummaryCounter.value + delta}
+        ))
+
+
+def bump_service(conn, service_id, delta):
+    if delta:
+        stmt = insert(ServiceStats).values(service_id=service_id, request_count=delta)
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=[ServiceStats.service_id], set_={'request_count': ServiceStats.request_count + delta}
+        ))
+
+
+RATINGS = range(1, 6)
+RATING_COLUMNS = ('rating_count', 'rating_sum') + tuple(f'rating_{rating}' for rating in RATINGS)
+
+
+def rating_deltas(ratings):
+    """
+    ServiceStats column deltas for adding the given ratings (negative to remove)
+    """
+    deltas = defaultdict(int)
+    for rating, n in ratings.items():
+        deltas['rating_count'] += n
+        deltas['rating_sum'] += rating * n
+        if rating in RATINGS:
+            deltas[f'rating_{rating}'] += n
+    return {column: delta for column, delta in deltas.items() if delta}
+
+
+def bump_ratings(conn, service_id, ratings):
+    """
+    Apply {rating: count} to a service's rating aggregates
+    """
+    deltas = rating_deltas(ratings)
+    if deltas:
+        stmt = insert(ServiceStats).values(service_id=service_id, **deltas)
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=[ServiceStats.service_id],
+            set_={column: getattr(ServiceStats, column) + delta for column, delta in deltas.items()},
+        ))
+
+
+def rating_average(stats):
+    return round(stats.rating_sum / stats.rating_count, 2) if stats.rating_count else None
+
+
+def status_counter(status):
+    return f'service_reqs:{status}'
+
+
+def values(*names):
+    rows = read_session.query(SummaryCounter).filter(SummaryCounter.name.in_(names)).all()
+    found = {row.name: row.value for row in rows}
+    return {name: found.get(name, 0) for name in names}
+
+
+@event.listens_for(Session, 'before_flush')
+def collect_deltas(session, flush_context, instances):
+    counts = defaultdict(int)
+    services = defaultdict(int)
+    # service id -> {rating: count}
+    ratings = defaultdict(lambda: defaultdict(int))
+    deleted_services = []
+
+    changes = [(obj, 1) for obj in session.new] + [(obj, -1) for obj in session.deleted]
+    for obj, sign in changes:
+        if isinstance(obj, User):
+            counts['users'] += sign
+            # a deleted user takes away the roles that are stored, like deleted requests below
+            professional = is_professional(obj) if sign > 0 else was_professional(obj)
+            if professional:
+                counts['service_pros'] += sign
+        elif isinstance(obj, Service):
+            counts['services'] += sign
+            if sign < 0:
+                deleted_services.append(obj.id)
+        elif isinstance(obj, Category):
+            counts['categories'] += sign
+        elif isinstance(obj, Service_req):
+            # a deleted row takes away what is stored, not what was changed before the delete
+            status = obj.service_status if sign > 0 else stored_value(session, obj, 'service_status')
+            service_id = obj.service_id if sign > 0 else stored_value(session, obj, 'service_id')
+            counts['service_reqs'] += sign
+            counts[status_counter(status or 'requested')] += sign
+            services[service_id] += sign
+        elif isinstance(obj, Feedback):
+            if sign > 0:
+                ratings[obj.service_id][obj.rating] += 1
+            else:
+                ratings[stored_value(session, obj, 'service_id')][stored_value(session, obj, 'rating')] -= 1
+
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            if inspect(obj).attrs.roles.history.has_changes():
+                counts['service_pros'] += is_professional(obj) - was_professional(obj)
+            continue
+        if isinstance(obj, Feedback) and session.is_modified(obj):
+            attrs = inspect(obj).attrs
+            if attrs.rating.history.has_changes() or attrs.service_id.history.has_changes():
+                old = session.execute(select(Feedback.service_id, Feedback.rating).filter_by(id=obj.id)).one()
+                ratings[old.service_id][old.rating] -= 1
+                ratings[obj.service_id][obj.rating] += 1
+            continue
+        if not isinstance(obj, Service_req) or not session.is_modified(obj):
+            continue
+        attrs = inspect(obj).attrs
+        if attrs.service_status.history.has_changes():
+            counts[status_counter(stored_value(session, obj, 'service_status'))] -= 1
+            counts[status_counter(obj.service_status)] += 1
+        if attrs.service_id.history.has_changes():
+            services[stored_value(session, obj, 'service_id')] -= 1
+            services[obj.service_id] += 1
+
+    flush_context.attributes['counter_deltas'] = (counts, services, ratings, deleted_services)
+
+
+@event.listens_for(Session, 'after_flush')
+def apply_deltas(session, flush_context):
+    deltas = flush_context.attributes.pop('counter_deltas', None)
+    if not deltas:
+        return
+    counts, services, ratings, deleted_services = deltas
+    conn = session.connection()
+    for name, delta in counts.items():
+        bump(conn, name, delta)
+    for service_id, delta in services.items():
+        bump_service(conn, service_id, delta)
+    for service_id, service_ratings in ratings.items():
+        bump_ratings(conn, service_id, service_ratings)
+    if deleted_services:
+        conn.execute(delete(ServiceStats).where(ServiceStats.service_id.in_(deleted_services)))
+
+
+def actual_counts(conn):
+    def count(stmt):
+        return conn.execute(stmt).scalar()
+
+    counts = {
+        'users': count(select(func.count(User.id))),
+        'service_pros': count(
+            select(func.count(func.distinct(UserRoles.user_id)))
+            .join(Role, Role.id == UserRoles.role_id).where(Role.name == 'serv')
+        ),
+        'services': count(select(func.count(Service.id))),
+        'categories': count(select(func.count(Category.id))),
+        'service_reqs': count(select(func.count(Service_req.id))),
+    }
+    for status, n in conn.execute(select(Service_req.service_status, func.count()).group_by(Service_req.service_status)):
+        counts[status_counter(status)] = n
+    return counts
+
+
+def actual_service_counts(conn):
+    rows = conn.execute(select(Service_req.service_id, func.count()).group_by(Service_req.service_id))
+    return dict(rows.all())
+
+
+def actual_service_ratings(conn):
+    """
+    {service id: {column: value}} rating aggregates recomputed from the feedback table
+    """
+    found = defaultdict(lambda: defaultdict(int))
+    rows = conn.execute(select(Feedback.service_id, Feedback.rating, func.count()).group_by(Feedback.service_id, Feedback.rating))
+    for service_id, rating, n in rows:
+        for column, value in rating_deltas({rating: n}).items():
+            found[service_id][column] += value
+    return found
+
+
+def drift(conn):
+    """
+    {counter: (stored, actual)} for every counter that disagrees with the base tables
+    """
+    found = {}
+    stored = dict(conn.execute(select(SummaryCounter.name, SummaryCounter.value)).all())
+    actual = actual_counts(conn)
+    for name in stored.keys() | actual.keys():
+        if stored.get(name, 0) != actual.get(name, 0):
+            found[name] = (stored.get(name, 0), actual.get(name, 0))
+
+    stored = dict(conn.execute(select(ServiceStats.service_id, ServiceStats.request_count)).all())
+    actual = actual_service_counts(conn)
+    for service_id in stored.keys() | actual.keys():
+        if stored.get(service_id, 0) != actual.get(service_id, 0):
+            found[f'service:{service_id}'] = (stored.get(service_id, 0), actual.get(service_id, 0))
+
+    columns = [getattr(ServiceStats, column) for column in RATING_COLUMNS]
+    stored = {row.service_id: row for row in conn.execute(select(ServiceStats.service_id, *columns))}
+    actual = actual_service_ratings(conn)
+    for service_id in stored.keys() | actual.keys():
+        for column in RATING_COLUMNS:
+            stored_value = getattr(stored[service_id], column) if service_id in stored else 0
+            actual_value = actual[service_id][column] if service_id in actual else 0
+            if stored_value != actual_value:
+                found[f'service:{service_id}:{column}'] = (stored_value, actual_value)
+    return found
+
+
+def rebuild(conn):
+    conn.execute(delete(SummaryCounter))
+    conn.execute(delete(ServiceStats))
+    counts = actual_counts(conn)
+    conn.execute(insert(SummaryCounter), [{'name': name, 'value': value} for name, value in counts.items()])
+    services = actual_service_counts(conn)
+    ratings = actual_service_ratings(conn)
+    rows = [
+        {'service_id': service_id, 'request_count': services.get(service_id, 0),
+         **{column: ratings[service_id][column] if service_id in ratings else 0 for column in RATING_COLUMNS}}
+        for service_id in services.keys() | ratings.keys()
+    ]
+    if rows:
+        conn.execute(insert(ServiceStats), rows)
+
+
+counters_cli = AppGroup('counters', help='Maintain the admin summary counters.')
+
+
+@counters_cli.command('check')
+def check_command():
+    """Report counters that drifted from the base tables."""
+    with db.engine.connect() as conn:
+        found = drift(conn)
+    for name, (stored, actual) in sorted(found.items()):
+        click.echo(f'{name}: stored {stored}, actual {actual}')
+    if found:
+        raise click.exceptions.Exit(1)
+    click.echo('Counters are consistent')
+
+
+@counters_cli.command('rebuild')
+def rebuild_command():
+    """Recompute every counter from the base tables."""
+    with db.engine.begin() as conn:
+        found = drift(conn)
+        rebuild(conn)
+    click.echo(f'Counters rebuilt, {len(found)} had drifted')
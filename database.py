@@ -0,0 +1,103 @@
+"""
+SQLite engine configuration and the read-only session.
+
+Every connection of the main engine gets the SQLITE_* pragmas below: WAL
+journaling so readers and the writer no longer block each other, a busy
+timeout instead of an immediate "database is locked", synchronous=NORMAL
+(safe with WAL) and larger page and mmap caches. Each key can be
+overridden in the app config, or from the environment as FLASK_<KEY>.
+
+A second engine (the "readonly" bind) opens the same file with
+query_only set. read_session is bound to it and is meant for endpoints and
+tasks that only read, such as listings, summaries, exports and reports,
+so their queries run on their own connections and can never write.
+"""
+from flask.globals import app_ctx
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import scoped_session, sessionmaker
+from extensions import db
+
+READONLY_BIND = 'readonly'
+
+DEFAULTS = {
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_BUSY_TIMEOUT_MS': 5000,
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    # negative: KiB rather than pages
+    'SQLITE_CACHE_SIZE': -32000,
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+    'DB_POOL_SIZE': 10,
+    'DB_MAX_OVERFLOW': 20,
+    'DB_POOL_TIMEOUT': 30,
+    'DB_READONLY_POOL_SIZE': 10,
+}
+
+
+def _app_ctx_id():
+    # one read session per app context, like db.session
+    return id(app_ctx._get_current_object())
+
+
+read_session = scoped_session(sessionmaker(), scopefunc=_app_ctx_id)
+
+
+def pragmas(config, read_only=False):
+    statements = [
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA cache_size={int(config['SQLITE_CACHE_SIZE'])}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+    ]
+    if read_only:
+        statements.append("PRAGMA query_only=ON")
+    return statements
+
+
+def install_pragmas(engine, statements):
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+
+
+def _is_file_database(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def init_app(app):
+    """
+    Configure and initialise Flask-SQLAlchemy for the app, replacing db.init_app(app)
+    """
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    file_database = _is_file_database(uri)
+    if file_database:
+        options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+        options.setdefault('pool_size', app.config['DB_POOL_SIZE'])
+        options.setdefault('max_overflow', app.config['DB_MAX_OVERFLOW'])
+        options.setdefault('pool_timeout', app.config['DB_POOL_TIMEOUT'])
+        app.config.setdefault('SQLALCHEMY_BINDS', {})[READONLY_BIND] = {
+            'url': uri,
+            'pool_size': app.config['DB_READONLY_POOL_SIZE'],
+            'max_overflow': app.config['DB_MAX_OVERFLOW'],
+            'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+        }
+
+    db.init_app(app)
+
+    with app.app_context():
+        if file_database:
+            install_pragmas(db.engine, pragmas(app.config))
+            install_pragmas(db.engines[READONLY_BIND], pragmas(app.config, read_only=True))
+        # an in-memory database only exists on the main engine's connection
+        read_session.configure(bind=db.engines.get(READONLY_BIND, db.engine))
+
+    app.teardown_appcontext(lambda exc: read_session.remove())
+
@@ -0,0 +1,56 @@
+"""
+Process-wide Jinja environment for the email templates.
+
+Templates are loaded from the app directory (not the working directory),
+compiled once per process and cached as bytecode on disk so worker cold
+starts skip compilation. Templates are only checked for changes in debug.
+"""
+from collections import defaultdict
+from threading import Lock
+import os
+import time
+from flask import current_app, has_app_context
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_environment = None
+_stats = defaultdict(lambda: {'renders': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+_lock = Lock()
+
+
+def environment():
+    global _environment
+    if _environment is None:
+        debug = current_app.debug if has_app_context() else False
+        cache_dir = current_app.config.get('EMAIL_TEMPLATE_CACHE_DIR') if has_app_context() else None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        _environment = Environment(
+            loader=FileSystemLoader(APP_DIR),
+            bytecode_cache=FileSystemBytecodeCache(cache_dir),
+            auto_reload=debug,
+        )
+    return _environment
+
+
+def render(template_name, /, **context):
+    template = environment().get_template(template_name)
+    start = time.perf_counter()
+    content = template.render(**context)
+    elapsed = time.perf_counter() - start
+
+    with _lock:
+        stats = _stats[template_name]
+        stats['renders'] += 1
+        stats['total_seconds'] += elapsed
+        stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+    return content
+
+
+def render_stats():
+    """
+    {template: {renders, total_seconds, max_seconds}} since the process started
+    """
+    with _lock:
+        return {name: dict(stats) for name, stats in _stats.items()}
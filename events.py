@@ -0,0 +1,304 @@
+"""
+Change feed of service requests over Server-Sent Events.
+
+Every create, assignment, status change and deletion of a service request
+is appended to the service_req_event table in the same transaction as the
+change: session flush hooks record ORM writes, and the bulk statements in
+bulk.py, cascade.py and assignment.py call record() themselves. Event ids
+only grow, so a client resumes from the last id it saw (the Last-Event-ID
+header EventSource sends on reconnect, or ?last_event_id).
+
+The table is the source of truth. After a commit, a broker wakes the open
+streams so they read the new rows right away: Redis pub/sub when
+EVENT_BROKER_URL (or the Redis cache URL) points at Redis, otherwise an
+in-process broker. Streams also re-read every EVENT_HEARTBEAT_SECONDS, so
+an event published by another process with the in-process broker is
+late, never lost. Each stream ends after EVENT_STREAM_MAX_SECONDS and
+EventSource reconnects from where it stopped, so a worker thread is not
+held forever.
+"""
+from datetime import datetime, timedelta
+from threading import Condition
+import json
+import logging
+from flask import Response, current_app, request, stream_with_context
+from sqlalchemy import delete, event, func, insert, inspect, literal, select
+from sqlalchemy.orm import Session
+from database import read_session
+from model_history import stored_value
+from models import Service_req, ServiceReqEvent
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'EVENT_BROKER_URL': None,
+    'EVENT_CHANNEL': 'service_req_events',
+    'EVENT_HEARTBEAT_SECONDS': 15,
+    'EVENT_STREAM_MAX_SECONDS': 300,
+    'EVENT_RETENTION_DAYS': 7,
+}
+# events sent per query while a stream catches up
+EVENT_BATCH_SIZE = 500
+
+
+class MemoryBroker:
+    """
+    Wakes the streams of this process
+    """
+    def __init__(self):
+        self._condition = Condition()
+        self._generation = 0
+
+    def publish(self):
+        with self._condition:
+            self._generation += 1
+            self._condition.notify_all()
+
+    def subscribe(self):
+        return MemorySubscription(self)
+
+
+class MemorySubscription:
+    def __init__(self, broker):
+        self._broker = broker
+        self._seen = broker._generation
+
+    def wait(self, timeout):
+        """
+        True if something was published since the last wait, blocking up to timeout seconds
+        """
+        condition = self._broker._condition
+        with condition:
+            condition.wait_for(lambda: self._broker._generation != self._seen, timeout)
+            published = self._broker._generation != self._seen
+            self._seen = self._broker._generation
+        return published
+
+    def close(self):
+        pass
+
+
+class RedisBroker:
+    """
+    Wakes the streams of every process through a Redis pub/sub channel
+    """
+    def __init__(self, url, channel):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self._channel = channel
+
+    def publish(self):
+        try:
+            self._redis.publish(self._channel, 'new')
+        except Exception as e:
+            # streams still pick the events up on their next heartbeat
+            logger.error(f"Failed to publish service request events: {e}")
+
+    def subscribe(self):
+        return RedisSubscription(self._redis.pubsub(ignore_subscribe_messages=True), self._channel)
+
+
+class RedisSubscription:
+    def __init__(self, pubsub, channel):
+        self._pubsub = pubsub
+        self._pubsub.subscribe(channel)
+
+    def wait(self, timeout):
+        published = self._pubsub.get_message(timeout=timeout) is not None
+        # collapse a burst of notifications into one read
+        while self._pubsub.get_message(timeout=0) is not None:
+            pass
+        return published
+
+    def close(self):
+        self._pubsub.close()
+
+
+broker = MemoryBroker()
+
+
+def event_row(kind, service_req_id, status, customer_id, professional_id, previous_professional_id=None):
+    return {
+        'service_req_id': service_req_id, 'kind': kind, 'status': status, 'customer_id': customer_id,
+        'professional_id': professional_id, 'previous_professional_id': previous_professional_id,
+        'created_at': datetime.utcnow(),
+    }
+
+
+def record(conn, rows):
+    """
+    Append events from a bulk statement's transaction; call publish() once it commits
+    """
+    if rows:
+        conn.execute(insert(ServiceReqEvent), rows)
+
+
+def record_created(conn, condition):
+    """
+    Append 'created' events for the service requests matching condition, straight from the table
+    """
+    conn.execute(insert(ServiceReqEvent).from_select(
+        ['service_req_id', 'kind', 'status', 'customer_id', 'professional_id', 'created_at'],
+        select(Service_req.id, literal('created'), Service_req.service_status, Service_req.customer_id,
+               Service_req.professional_id, literal(datetime.utcnow()))
+        .where(condition).order_by(Service_req.id),
+    ))
+
+
+def publish():
+    broker.publish()
+
+
+@event.listens_for(Session, 'before_flush')
+def collect_events(session, flush_context, instances):
+    # (kind, request, previous professional); rows are built after the flush, when new requests have ids
+    changes = []
+    for obj in session.new:
+        if isinstance(obj, Service_req):
+            changes.append(('created', obj, None))
+    for obj in session.deleted:
+        if isinstance(obj, Service_req):
+            changes.append(('deleted', obj, None))
+    for obj in session.dirty:
+        if not isinstance(obj, Service_req):
+            continue
+        attrs = inspect(obj).attrs
+        if attrs.professional_id.history.has_changes():
+            previous = stored_value(session, obj, 'professional_id')
+            if previous != obj.professional_id:
+                changes.append(('assigned', obj, previous))
+        if attrs.service_status.history.has_changes():
+            if stored_value(session, obj, 'service_status') != obj.service_status:
+                changes.append(('status', obj, None))
+    if changes:
+        flush_context.attributes['service_req_events'] = changes
+
+
+@event.listens_for(Session, 'after_flush')
+def append_events(session, flush_context):
+    changes = flush_context.attributes.pop('service_req_events', None)
+    if not changes:
+        return
+    rows = [
+        event_row(kind, obj.id, obj.service_status or 'requested', obj.customer_id, obj.professional_id, previous)
+        for kind, obj, previous in changes
+    ]
+    record(session.connection(), rows)
+    session.info['service_req_events'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def publish_events(session):
+    if session.info.pop('service_req_events', None):
+        publish()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def drop_events(session, previous_transaction):
+    session.info.pop('service_req_events', None)
+
+
+def visible_to(user_id, roles):
+    """
+    Filter on the events a user may see, the same requests GET
+    /api/service_requests lists: all for admins and professionals, the
+    requests they made for customers
+    """
+    if 'admin' in roles or 'serv' in roles:
+        return None
+    if 'cust' in roles:
+        return ServiceReqEvent.customer_id == user_id
+    return ServiceReqEvent.id.is_(None)
+
+
+def _fetch(after_id, condition):
+    query = read_session.query(ServiceReqEvent).filter(ServiceReqEvent.id > after_id)
+    if condition is not None:
+        query = query.filter(condition)
+    try:
+        return query.order_by(ServiceReqEvent.id).limit(EVENT_BATCH_SIZE).all()
+    finally:
+        # give the connection back while the stream waits
+        read_session.remove()
+
+
+def _format(change):
+    data = {
+        'id': change.id,
+        'service_request_id': change.service_req_id,
+        'kind': change.kind,
+        'status': change.status,
+        'customer_id': change.customer_id,
+        'professional_id': change.professional_id,
+        'previous_professional_id': change.previous_professional_id,
+        'at': change.created_at.isoformat(),
+    }
+    return f'id: {change.id}\nevent: {change.kind}\ndata: {json.dumps(data)}\n\n'
+
+
+def _start_id():
+    """
+    Id to resume after: Last-Event-ID, ?last_event_id, or the newest event for a new subscriber
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if last_event_id is not None:
+        try:
+            return int(last_event_id), True
+        except ValueError:
+            pass
+    newest = read_session.query(func.max(ServiceReqEvent.id)).scalar() or 0
+    return newest, False
+
+
+def stream(user_id, roles):
+    """
+    text/event-stream response of the events visible to the user
+    """
+    config = current_app.config
+    heartbeat = config['EVENT_HEARTBEAT_SECONDS']
+    condition = visible_to(user_id, roles)
+    after_id, resuming = _start_id()
+    oldest = read_session.query(func.min(ServiceReqEvent.id)).scalar()
+    read_session.remove()
+
+    def generate():
+        nonlocal after_id
+        subscription = broker.subscribe()
+        deadline = datetime.utcnow() + timedelta(seconds=config['EVENT_STREAM_MAX_SECONDS'])
+        try:
+            yield f'retry: {int(heartbeat * 1000)}\n\n'
+            if resuming and oldest is not None and after_id < oldest - 1:
+                # the events after Last-Event-ID were pruned, the client has to reload
+                yield 'event: reset\ndata: {}\n\n'
+            while datetime.utcnow() < deadline:
+                changes = _fetch(after_id, condition)
+                for change in changes:
+                    yield _format(change)
+                if changes:
+                    after_id = changes[-1].id
+                if len(changes) == EVENT_BATCH_SIZE:
+                    continue
+                if not subscription.wait(heartbeat):
+                    yield ': keepalive\n\n'
+        finally:
+            subscription.close()
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def prune(conn, before):
+    return conn.execute(delete(ServiceReqEvent).where(ServiceReqEvent.created_at < before)).rowcount
+
+
+def init_app(app):
+    global broker
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    url = app.config['EVENT_BROKER_URL']
+    if url is None and app.config.get('CACHE_TYPE') == 'RedisCache':
+        url = app.config.get('CACHE_REDIS_URL')
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        broker = RedisBroker(url, app.config['EVENT_CHANNEL'])
+    else:
+        broker = MemoryBroker()
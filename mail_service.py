@@ -1,28 +1,133 @@
-from smtplib import SMTP
+from smtplib import SMTP, SMTPServerDisconnected
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from contextlib import contextmanager
 import logging
+import queue
 
 SMTP_HOST = "localhost"
 SMTP_PORT = 1025
 SENDER_EMAIL = 'donot-reply@household.project'
 SENDER_PASSWORD = ''
 
+# idle connections kept open per process
+SMTP_POOL_SIZE = 4
+SMTP_TIMEOUT = 30
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def send_message(to, subject, content_body):
+
+def build_message(to, subject, content_body):
+    msg = MIMEMultipart()
+    msg["To"] = to
+    msg["Subject"] = subject
+    msg["From"] = SENDER_EMAIL
+    msg.attach(MIMEText(content_body, 'html'))
+    return msg
+
+
+class SMTPPool:
+    """
+    Reuses authenticated SMTP connections across messages. A connection the
+    server dropped while idle is replaced and the message retried once.
+    """
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, username=SENDER_EMAIL, password=SENDER_PASSWORD,
+                 size=SMTP_POOL_SIZE, timeout=SMTP_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        logger.info(f"Connecting to SMTP server {self.host}:{self.port}")
+        client = SMTP(host=self.host, port=self.port, timeout=self.timeout)
+        if self.password:
+            client.login(self.username, self.password)
+        return client
+
+    @staticmethod
+    def _close(client):
+        try:
+            client.quit()
+        except Exception:
+            client.close()
+
+    @contextmanager
+    def connection(self):
+        try:
+            client = self._idle.get_nowait()
+        except queue.Empty:
+            client = self._connect()
+        conn = _Connection(self, client)
+        try:
+            yield conn
+        except Exception:
+            self._close(conn.client)
+            raise
+        try:
+            self._idle.put_nowait(conn.client)
+        except queue.Full:
+            self._close(conn.client)
+
+    def send_messages(self, messages, failed=None):
+        """
+        Send (to, subject, content_body) tuples over one pooled connection.
+        Failures are logged per message, and their indices appended to the
+        failed list when one is given; returns the number sent.
+        """
+        sent = 0
+        with self.connection() as conn:
+            for i, (to, subject, content_body) in enumerate(messages):
+                try:
+                    conn.send(build_message(to, subject, content_body))
+                    sent += 1
+                    logger.info(f"Email sent to {to}")
+                except Exception as e:
+                    logger.error(f"Failed to send email to {to}: {e}")
+                    if failed is not None:
+                        failed.append(i)
+        return sent
+
+    def close(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+class _Connection:
+    def __init__(self, pool, client):
+        self.pool = pool
+        self.client = client
+
+    def send(self, msg):
+        try:
+            self.client.send_message(msg=msg)
+        except (SMTPServerDisconnected, ConnectionError):
+            self.client.close()
+            self.client = self.pool._connect()
+            self.client.send_message(msg=msg)
+
+
+pool = SMTPPool()
+
+
+def send_messages(messages, failed=None):
+    messages = list(messages)
     try:
-        msg = MIMEMultipart()
-        msg["To"] = to
-        msg["Subject"] = subject
-        msg["From"] = SENDER_EMAIL
-        msg.attach(MIMEText(content_body, 'html'))
-        
-        logger.info(f"Connecting to SMTP server {SMTP_HOST}:{SMTP_PORT}")
-        client = SMTP(host=SMTP_HOST, port=SMTP_PORT)
-        client.send_message(msg=msg)
-        client.quit()
-        logger.info(f"Email sent to {to}")
+        return pool.send_messages(messages, failed)
     except Exception as e:
-        logger.error(f"Failed to send email to {to}: {e}")
\ No newline at end of file
+        # no connection, nothing was sent
+        logger.error(f"Failed to send emails: {e}")
+        if failed is not None:
+            failed[:] = range(len(messages))
+        return 0
+
+
+def send_message(to, subject, content_body):
+    return send_messages([(to, subject, content_body)]) == 1
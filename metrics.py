@@ -0,0 +1,181 @@
+"""
+Per endpoint request metrics in the Prometheus text format.
+
+Every request is recorded under its Flask endpoint and method: request
+count by status, a latency histogram, SQL statements and time (from the
+engine events in query_counter.py), response cache hits and misses (from
+response_cache.py), slow queries and response size. Email template
+render times (from email_templates.py) are reported per template, for the
+renders made in this process. GET /metrics serves the totals to admins.
+
+The registry lives in the process, so with several workers each one
+reports its own totals; scrape every worker or sum them in Prometheus.
+Streamed responses are recorded when their headers are sent, without a
+size and without the queries run while streaming. Requests that end in
+an unhandled exception are recorded as 500s when the request is torn down.
+"""
+from collections import defaultdict
+from threading import Lock
+import time
+from flask import Response, g, request
+from flask_security import auth_required, roles_required
+import email_templates
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class EndpointStats:
+    def __init__(self):
+        self.statuses = defaultdict(int)
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.seconds = 0.0
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.slow_queries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.response_bytes = 0
+        self.sized_responses = 0
+
+    @property
+    def requests(self):
+        return sum(self.statuses.values())
+
+
+class Registry:
+    def __init__(self):
+        self._stats = defaultdict(EndpointStats)
+        self._lock = Lock()
+
+    def record(self, endpoint, method, status, seconds, sql_count, sql_seconds, slow_queries,
+               cache_hits, cache_misses, response_bytes):
+        with self._lock:
+            stats = self._stats[(endpoint, method)]
+            stats.statuses[status] += 1
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats.buckets[i] += 1
+                    break
+            stats.seconds += seconds
+            stats.sql_count += sql_count
+            stats.sql_seconds += sql_seconds
+            stats.slow_queries += slow_queries
+            stats.cache_hits += cache_hits
+            stats.cache_misses += cache_misses
+            if response_bytes is not None:
+                stats.response_bytes += response_bytes
+                stats.sized_responses += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._stats.items())
+            lines = []
+
+            def metric(name, kind, help, samples):
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                lines.extend(samples)
+
+            def labels(endpoint, method, **extra):
+                pairs = {'endpoint': endpoint, 'method': method, **extra}
+                return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs.items()) + '}'
+
+            metric('http_requests_total', 'counter', 'Requests handled, by endpoint, method and status.', [
+                f'http_requests_total{labels(e, m, status=str(status))} {n}'
+                for (e, m), stats in items for status, n in sorted(stats.statuses.items())
+            ])
+
+            samples = []
+            for (e, m), stats in items:
+                cumulative = 0
+                for bound, n in zip(LATENCY_BUCKETS, stats.buckets):
+                    cumulative += n
+                    samples.append(f'http_request_duration_seconds_bucket{labels(e, m, le=repr(bound))} {cumulative}')
+                samples.append(f'http_request_duration_seconds_bucket{labels(e, m, le="+Inf")} {stats.requests}')
+                samples.append(f'http_request_duration_seconds_sum{labels(e, m)} {stats.seconds:.6f}')
+                samples.append(f'http_request_duration_seconds_count{labels(e, m)} {stats.requests}')
+            metric('http_request_duration_seconds', 'histogram', 'Request latency.', samples)
+
+            metric('sql_queries_total', 'counter', 'SQL statements run while handling requests.', [
+                f'sql_queries_total{labels(e, m)} {stats.sql_count}' for (e, m), stats in items
+            ])
+            metric('sql_query_duration_seconds_total', 'counter', 'Time spent in SQL statements.', [
+                f'sql_query_duration_seconds_total{labels(e, m)} {stats.sql_seconds:.6f}' for (e, m), stats in items
+            ])
+            metric('sql_slow_queries_total', 'counter', 'Statements slower than SLOW_QUERY_THRESHOLD_MS.', [
+                f'sql_slow_queries_total{labels(e, m)} {stats.slow_queries}' for (e, m), stats in items
+            ])
+            metric('response_cache_requests_total', 'counter', 'Response cache lookups, by result.', [
+                f'response_cache_requests_total{labels(e, m, result=result)} {n}'
+                for (e, m), stats in items if stats.cache_hits or stats.cache_misses
+                for result, n in (('hit', stats.cache_hits), ('miss', stats.cache_misses))
+            ])
+            metric('http_response_size_bytes', 'summary', 'Size of non-streamed response bodies.', [
+                sample for (e, m), stats in items for sample in (
+                    f'http_response_size_bytes_sum{labels(e, m)} {stats.response_bytes}',
+                    f'http_response_size_bytes_count{labels(e, m)} {stats.sized_responses}',
+                )
+            ])
+
+            templates = sorted(email_templates.render_stats().items())
+            metric('template_render_seconds', 'summary', 'Time spent rendering email templates.', [
+                sample for template, stats in templates for sample in (
+                    f'template_render_seconds_sum{{template="{_escape(template)}"}} {stats["total_seconds"]:.6f}',
+                    f'template_render_seconds_count{{template="{_escape(template)}"}} {stats["renders"]}',
+                )
+            ])
+            metric('template_render_seconds_max', 'gauge', 'Slowest render of each email template.', [
+                f'template_render_seconds_max{{template="{_escape(template)}"}} {stats["max_seconds"]:.6f}'
+                for template, stats in templates
+            ])
+            return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+def start_request():
+    g.metrics_start = time.perf_counter()
+    g.sql_count = 0
+    g.sql_seconds = 0.0
+
+
+def _record(status, response_bytes):
+    g.metrics_recorded = True
+    registry.record(
+        request.endpoint or 'unmatched', request.method, status,
+        time.perf_counter() - g.metrics_start, g.sql_count, g.sql_seconds, g.get('slow_queries', 0),
+        g.get('cache_hits', 0), g.get('cache_misses', 0), response_bytes,
+    )
+
+
+def record_request(response):
+    if 'metrics_start' in g:
+        _record(response.status_code, None if response.is_streamed else response.calculate_content_length())
+    return response
+
+
+def record_failed_request(exc):
+    """
+    Record requests whose exception skipped the after_request hooks as 500s
+    """
+    if 'metrics_start' in g and not g.get('metrics_recorded'):
+        _record(500, None)
+
+
+@auth_required('token')
+@roles_required('admin')
+def metrics_view():
+    return Response(registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def init_app(app):
+    app.before_request(start_request)
+    app.after_request(record_request)
+    app.teardown_request(record_failed_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,146 @@
+"""
+Versioned schema migrations.
+
+Migrations run in order at startup, each in its own transaction, and the
+applied versions are recorded in the schema_migrations table. Migration 1
+creates the whole current schema on a fresh database, so every later
+migration has to be safe to run against tables that are already up to date.
+"""
+from datetime import datetime
+from sqlalchemy import text
+from extensions import db
+from models import (SummaryCounter, ServiceStats, ReportChunk, ReportDelivery, MonthlyActivity, ServiceReqEvent,
+                    Reminder, TaskWatermark)
+import counters
+import rollups
+import search_index
+import logging
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(f):
+        MIGRATIONS.append((version, description, f))
+        return f
+    return register
+
+
+def create_indexes(conn, names):
+    indexes = {index.name: index for table in db.metadata.sorted_tables for index in table.indexes}
+    for name in names:
+        indexes[name].create(conn, checkfirst=True)
+
+
+def drop_indexes(conn, names):
+    for name in names:
+        conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+
+
+@migration(1, 'baseline schema')
+def baseline(conn):
+    db.metadata.create_all(conn)
+
+
+HOT_PATH_INDEXES = (
+    'ix_user_fs_uniquifier',
+    'ix_user_roles_user_id',
+    'ix_user_roles_role_id',
+    'ix_service_category_id',
+    'ix_service_req_professional_status',
+    'ix_service_req_customer_request_date',
+    'ix_service_req_customer_completion_date',
+    'ix_service_req_status',
+    'ix_service_req_request_date',
+    'ix_service_req_service_id',
+    'ix_feedback_service_rating',
+    'ix_feedback_customer_id',
+)
+
+
+@migration(2, 'indexes for hot query predicates')
+def hot_path_indexes(conn):
+    create_indexes(conn, HOT_PATH_INDEXES)
+
+
+@migration(3, 'full-text search index')
+def full_text_search(conn):
+    search_index.create(conn)
+
+
+@migration(4, 'admin summary counters')
+def summary_counters(conn):
+    SummaryCounter.__table__.create(conn, checkfirst=True)
+    ServiceStats.__table__.create(conn, checkfirst=True)
+    counters.rebuild(conn)
+
+
+@migration(5, 'monthly report progress')
+def report_chunks(conn):
+    ReportChunk.__table__.create(conn, checkfirst=True)
+
+
+@migration(6, 'monthly customer activity rollups')
+def monthly_activity(conn):
+    MonthlyActivity.__table__.create(conn, checkfirst=True)
+    rollups.rebuild(conn)
+
+
+@migration(7, 'service rating aggregates')
+def service_ratings(conn):
+    existing = {row.name for row in conn.execute(text('PRAGMA table_info(service_stats)'))}
+    for column in counters.RATING_COLUMNS:
+        if column not in existing:
+            conn.execute(text(f'ALTER TABLE service_stats ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0'))
+    counters.rebuild(conn)
+
+
+@migration(8, 'service request change feed')
+def service_req_events(conn):
+    ServiceReqEvent.__table__.create(conn, checkfirst=True)
+
+
+@migration(9, 'incremental reminders')
+def reminders(conn):
+    Reminder.__table__.create(conn, checkfirst=True)
+    TaskWatermark.__table__.create(conn, checkfirst=True)
+
+
+@migration(10, 'monthly report deliveries')
+def report_deliveries(conn):
+    ReportDelivery.__table__.create(conn, checkfirst=True)
+
+
+@migration(11, 'drop unread change feed indexes')
+def drop_event_professional_indexes(conn):
+    # professionals see every event, so nothing filters on these columns
+    drop_indexes(conn, ('ix_service_req_event_professional_id', 'ix_service_req_event_previous_professional_id'))
+
+
+def applied_versions(conn):
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version INTEGER PRIMARY KEY, description VARCHAR NOT NULL, applied_at DATETIME NOT NULL)'
+    ))
+    return {row.version for row in conn.execute(text('SELECT version FROM schema_migrations'))}
+
+
+def upgrade(target=None):
+    """
+    Apply every migration not yet recorded, up to and including target
+    """
+    with db.engine.begin() as conn:
+        applied = applied_versions(conn)
+
+    for version, description, f in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in applied or (target is not None and version > target):
+            continue
+        logger.info(f"Applying migration {version}: {description}")
+        with db.engine.begin() as conn:
+            f(conn)
+            conn.execute(
+                text('INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)'),
+                {'v': version, 'd': description, 't': datetime.utcnow()}
+            )
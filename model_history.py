@@ -0,0 +1,37 @@
+"""
+Helpers shared by the session flush hooks (counters, rollups, assignment,
+events) that need to know what a row looked like before the changes
+pending in the session.
+"""
+from sqlalchemy import inspect, select
+
+# statuses of requests still waiting for work; they count towards a professional's load
+OPEN_STATUSES = ('requested', 'accepted')
+
+
+def stored_value(session, obj, attr):
+    """
+    Value of attr in the database, before the changes pending in the session
+    """
+    history = inspect(obj).attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.added:
+        # changed without being loaded first
+        return session.execute(select(getattr(type(obj), attr)).filter_by(id=obj.id)).scalar()
+    return getattr(obj, attr)
+
+
+def is_professional(user):
+    return any(role.name == 'serv' for role in user.roles)
+
+
+def was_professional(user):
+    """
+    Whether the user had the serv role before the changes pending in the session
+    """
+    history = inspect(user).attrs.roles.history
+    if not history.has_changes():
+        # also loads roles that were never loaded into the session
+        return is_professional(user)
+    return any(role.name == 'serv' for role in [*history.unchanged, *history.deleted])
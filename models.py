@@ -1,91 +1,255 @@
-from extensions import db, security
-from flask_security import UserMixin, RoleMixin
-from flask_security.models import fsqla_v3 as fsq
-from datetime import datetime
-
-fsq.FsModels.set_db_info(db)
-
-class User(db.Model, UserMixin):
-    id = db.Column(db.Integer, primary_key = True)
-    username = db.Column(db.String, nullable = False)
-    email = db.Column(db.String, nullable = False, unique = True)
-    password = db.Column(db.String, nullable = False)
-    city = db.Column(db.String, nullable = True)
-    pin = db.Column(db.String(6))
-    phone = db.Column(db.String(15))
-    address = db.Column(db.String)
-    service_type = db.Column(db.String)
-    experience = db.Column(db.String(3))
-    active = db.Column(db.Boolean)
-    fs_uniquifier = db.Column(db.String(), nullable = False)
-    roles = db.relationship('Role', secondary = 'user_roles')
-
-class Role(db.Model, RoleMixin):
-    id = db.Column(db.Integer, primary_key = True)
-    name = db.Column(db.String(80), unique = True, nullable = False)
-    description = db.Column(db.String)
-
-class UserRoles(db.Model):
-    id = db.Column(db.Integer, primary_key = True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    role_id = db.Column(db.Integer, db.ForeignKey('role.id'))
-
-class Category(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String, nullable=False)
-    description = db.Column(db.String, nullable=False)
-    # Relationship to Service
-    services = db.relationship('Service', backref='category', lazy=True)
-
-class Service(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String, nullable=False)
-    description = db.Column(db.Text)
-    price = db.Column(db.Integer)
-    # Foreign key to Category
-    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
-
-
-class Service_req(db.Model):
-    id = db.Column(db.Integer, primary_key = True)
-    customer_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    professional_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    service_id = db.Column(db.Integer, db.ForeignKey('service.id'), nullable=False)
-    date_of_request = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
-    date_of_completion = db.Column(db.DateTime, nullable=True)
-    
-    service_status = db.Column(db.String(20), default="requested", nullable=False)
-    
-    remarks = db.Column(db.Text, nullable=True)
-
-    # Relationships to services, customers, professionals
-    service = db.relationship('Service', backref='service_requests')
-    professional = db.relationship('User', foreign_keys = [professional_id])
-    customer = db.relationship('User', foreign_keys= [customer_id])
-
-    def __repr__(self):
-        return f"<ServiceRequest(id={self.id}, service_status={self.service_status})>"
-
-class DailyVisit(db.Model):
-    __tablename__ = 'daily_visits'
-    id = db.Column(db.Integer, autoincrement=True, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    date = db.Column(db.Date)
-    user = db.relationship('User', backref='visits')
-
-class Feedback(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    service_id = db.Column(db.Integer, db.ForeignKey('service.id'), nullable=False)
-    customer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    rating = db.Column(db.Integer, nullable=False)  # rating can be 1-5 for example
-    comments = db.Column(db.Text, nullable=True)
-    date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
-
-    # Relationships
-    service = db.relationship('Service', backref='feedbacks')
-    customer = db.relationship('User', backref='feedbacks')
-
-    def __repr__(self):
-        return f"<Feedback(id={self.id}, rating={self.rating}, service_id={self.service_id})>"
-
-    
\ No newline at end of file
+from extensions import db, security
+from flask_security import UserMixin, RoleMixin
+from flask_security.models import fsqla_v3 as fsq
+from datetime import datetime
+
+fsq.FsModels.set_db_info(db)
+
+class User(db.Model, UserMixin):
+    id = db.Column(db.Integer, primary_key = True)
+    username = db.Column(db.String, nullable = False)
+    email = db.Column(db.String, nullable = False, unique = True)
+    password = db.Column(db.String, nullable = False)
+    city = db.Column(db.String, nullable = True)
+    pin = db.Column(db.String(6))
+    phone = db.Column(db.String(15))
+    address = db.Column(db.String)
+    service_type = db.Column(db.String)
+    experience = db.Column(db.String(3))
+    active = db.Column(db.Boolean)
+    fs_uniquifier = db.Column(db.String(), nullable = False)
+    roles = db.relationship('Role', secondary = 'user_roles')
+
+    __table_args__ = (
+        db.Index('ix_user_fs_uniquifier', 'fs_uniquifier'),
+    )
+
+class Role(db.Model, RoleMixin):
+    id = db.Column(db.Integer, primary_key = True)
+    name = db.Column(db.String(80), unique = True, nullable = False)
+    description = db.Column(db.String)
+
+class UserRoles(db.Model):
+    id = db.Column(db.Integer, primary_key = True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    role_id = db.Column(db.Integer, db.ForeignKey('role.id'))
+
+    __table_args__ = (
+        db.Index('ix_user_roles_user_id', 'user_id'),
+        db.Index('ix_user_roles_role_id', 'role_id'),
+    )
+
+class Category(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, nullable=False)
+    description = db.Column(db.String, nullable=False)
+    # Relationship to Service
+    services = db.relationship('Service', backref='category', lazy=True)
+
+class Service(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, nullable=False)
+    description = db.Column(db.Text)
+    price = db.Column(db.Integer)
+    # Foreign key to Category
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_service_category_id', 'category_id'),
+    )
+
+
+class Service_req(db.Model):
+    id = db.Column(db.Integer, primary_key = True)
+    customer_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    professional_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    service_id = db.Column(db.Integer, db.ForeignKey('service.id'), nullable=False)
+    date_of_request = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    date_of_completion = db.Column(db.DateTime, nullable=True)
+    
+    service_status = db.Column(db.String(20), default="requested", nullable=False)
+    
+    remarks = db.Column(db.Text, nullable=True)
+
+    # Relationships to services, customers, professionals
+    service = db.relationship('Service', backref='service_requests')
+    professional = db.relationship('User', foreign_keys = [professional_id])
+    customer = db.relationship('User', foreign_keys= [customer_id])
+
+    # Composite indexes matching the filters used in resources.py and tasks.py
+    __table_args__ = (
+        db.Index('ix_service_req_professional_status', 'professional_id', 'service_status'),
+        db.Index('ix_service_req_customer_request_date', 'customer_id', 'date_of_request'),
+        db.Index('ix_service_req_customer_completion_date', 'customer_id', 'date_of_completion'),
+        db.Index('ix_service_req_status', 'service_status'),
+        db.Index('ix_service_req_request_date', 'date_of_request', 'id'),
+        db.Index('ix_service_req_service_id', 'service_id'),
+    )
+
+    def __repr__(self):
+        return f"<ServiceRequest(id={self.id}, service_status={self.service_status})>"
+
+class DailyVisit(db.Model):
+    __tablename__ = 'daily_visits'
+    id = db.Column(db.Integer, autoincrement=True, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    date = db.Column(db.Date)
+    user = db.relationship('User', backref='visits')
+
+class Feedback(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    service_id = db.Column(db.Integer, db.ForeignKey('service.id'), nullable=False)
+    customer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    rating = db.Column(db.Integer, nullable=False)  # rating can be 1-5 for example
+    comments = db.Column(db.Text, nullable=True)
+    date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    # Relationships
+    service = db.relationship('Service', backref='feedbacks')
+    customer = db.relationship('User', backref='feedbacks')
+
+    __table_args__ = (
+        db.Index('ix_feedback_service_rating', 'service_id', 'rating'),
+        db.Index('ix_feedback_customer_id', 'customer_id'),
+    )
+
+    def __repr__(self):
+        return f"<Feedback(id={self.id}, rating={self.rating}, service_id={self.service_id})>"
+
+
+class SummaryCounter(db.Model):
+    __tablename__ = 'summary_counter'
+    name = db.Column(db.String(80), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<SummaryCounter(name={self.name}, value={self.value})>"
+
+class ServiceStats(db.Model):
+    __tablename__ = 'service_stats'
+    # No foreign key, this is a rollup maintained by counters.py
+    service_id = db.Column(db.Integer, primary_key=True)
+    request_count = db.Column(db.Integer, nullable=False, default=0)
+    # feedback ratings: count, sum and how many of each rating from 1 to 5
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_1 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_2 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_3 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_4 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_5 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        db.Index('ix_service_stats_request_count', 'request_count'),
+    )
+
+    def __repr__(self):
+        return f"<ServiceStats(service_id={self.service_id}, request_count={self.request_count})>"
+
+class ReportChunk(db.Model):
+    """
+    Progress of one chunk of customers in a monthly report run
+    """
+    __tablename__ = 'report_chunk'
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(7), nullable=False)  # YYYY-MM
+    first_customer_id = db.Column(db.Integer, nullable=False)
+    last_customer_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), default="pending", nullable=False)  # pending, dispatched, sending, done
+    sent = db.Column(db.Integer, default=0, nullable=False)
+    failed = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('period', 'first_customer_id'),
+    )
+
+    def __repr__(self):
+        return f"<ReportChunk(id={self.id}, period={self.period}, status={self.status})>"
+
+class ReportDelivery(db.Model):
+    """
+    Monthly report sent to one customer, so a chunk that runs again skips them
+    """
+    __tablename__ = 'report_delivery'
+    period = db.Column(db.String(7), primary_key=True)  # YYYY-MM
+    customer_id = db.Column(db.Integer, primary_key=True)
+    sent_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<ReportDelivery(period={self.period}, customer_id={self.customer_id})>"
+
+class MonthlyActivity(db.Model):
+    """
+    Per customer and month rollup of requested and closed service requests,
+    maintained by rollups.py
+    """
+    __tablename__ = 'monthly_activity'
+    customer_id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.String(7), primary_key=True)  # YYYY-MM
+    requested_count = db.Column(db.Integer, default=0, nullable=False)
+    closed_count = db.Column(db.Integer, default=0, nullable=False)
+    requested_ids = db.Column(db.Text, default="[]", nullable=False)  # JSON list of Service_req ids
+    closed_ids = db.Column(db.Text, default="[]", nullable=False)
+
+    def __repr__(self):
+        return f"<MonthlyActivity(customer_id={self.customer_id}, month={self.month})>"
+
+class ServiceReqEvent(db.Model):
+    """
+    Append only log of service request changes (created, assigned, status,
+    deleted), read by the change feed in events.py
+    """
+    __tablename__ = 'service_req_event'
+    id = db.Column(db.Integer, primary_key=True)
+    # No foreign key, events outlive deleted requests
+    service_req_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    status = db.Column(db.String(20), nullable=True)
+    customer_id = db.Column(db.Integer, nullable=True)
+    professional_id = db.Column(db.Integer, nullable=True)
+    previous_professional_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_service_req_event_customer_id', 'customer_id', 'id'),
+        db.Index('ix_service_req_event_created_at', 'created_at'),
+        # ids are never reused, even after old events are pruned
+        {'sqlite_autoincrement': True},
+    )
+
+    def __repr__(self):
+        return f"<ServiceReqEvent(id={self.id}, service_req_id={self.service_req_id}, kind={self.kind})>"
+
+class Reminder(db.Model):
+    """
+    Reminder about one pending service request to its professional, so
+    send_daily_reminders sends it once
+    """
+    __tablename__ = 'reminder'
+    service_req_id = db.Column(db.Integer, primary_key=True)
+    professional_id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), nullable=False)  # sending, sent, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    # run that is sending it
+    claimed_by = db.Column(db.String(32), nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_reminder_status', 'status'),
+    )
+
+    def __repr__(self):
+        return f"<Reminder(service_req_id={self.service_req_id}, professional_id={self.professional_id}, status={self.status})>"
+
+class TaskWatermark(db.Model):
+    """
+    Last service request event a periodic task has processed
+    """
+    __tablename__ = 'task_watermark'
+    name = db.Column(db.String(50), primary_key=True)
+    last_event_id = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<TaskWatermark(name={self.name}, last_event_id={self.last_event_id})>"
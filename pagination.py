@@ -0,0 +1,73 @@
+import base64
+from datetime import datetime
+from flask import Response, request, stream_with_context
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# rows fetched per round trip when streaming from a server side cursor
+STREAM_BATCH_SIZE = 500
+
+
+def encode_cursor(date, id):
+    raw = f"{date.isoformat()}|{id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        date, id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(date), int(id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f'Invalid cursor: {cursor}')
+
+
+def page_size():
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def wants_ndjson():
+    if request.args.get('format') == 'ndjson':
+        return True
+    best = request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def after_cursor(query, date_column, id_column, cursor):
+    """
+    Order a query newest first and restrict it to the rows after the given keyset cursor
+    """
+    query = query.order_by(date_column.desc(), id_column.desc())
+    if cursor:
+        date, id = decode_cursor(cursor)
+        query = query.filter(tuple_(date_column, id_column) < tuple_(date, id))
+    return query
+
+
+def keyset_page(query, date_column, id_column, cursor, limit):
+    """
+    Fetch one page of rows ordered by (date_column, id_column), newest first,
+    so clients that ignore the cursor still see the latest rows.
+    Returns the rows and the cursor of the next page (None on the last page).
+    """
+    rows = after_cursor(query, date_column, id_column, cursor).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, date_column.key), getattr(last, id_column.key))
+
+
+def ndjson_response(query, serializer):
+    """
+    Stream a query as newline delimited JSON, one serialized row per line.
+    Rows are pulled from the database in batches so memory stays flat.
+    """
+    def generate():
+        for row in query.yield_per(STREAM_BATCH_SIZE):
+            yield serializer.row(row) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
@@ -0,0 +1,139 @@
+"""
+In-process cache of authenticated principals keyed by fs_uniquifier.
+
+Token (and session) authentication looks the user up by fs_uniquifier on
+every request. CachingUserDatastore answers that lookup from a bounded LRU
+of compact principals (user id, active flag and roles) and rebuilds the
+User as a detached instance merged into the session without loading, so
+role checks cost no query; other columns load lazily on first access.
+
+Entries expire after PRINCIPAL_CACHE_TTL seconds and are evicted when a
+user is deactivated, deleted, changes roles or has fs_uniquifier rotated.
+Core statements that change users bypass those ORM events and must call
+evict_users() once they commit.
+Eviction is per process, so with several workers the TTL bounds how long
+another process may keep using a stale entry.
+"""
+from collections import OrderedDict, namedtuple
+from threading import Lock
+import time
+from flask_security import SQLAlchemyUserDatastore
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
+from extensions import db
+from models import User, Role
+
+PRINCIPAL_CACHE_SIZE = 4096
+PRINCIPAL_CACHE_TTL = 60
+
+# roles is a tuple of (id, name, description)
+Principal = namedtuple('Principal', 'id fs_uniquifier active roles')
+
+
+class PrincipalCache:
+    def __init__(self, maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, uniquifier):
+        with self._lock:
+            entry = self._entries.get(uniquifier)
+            if entry is None:
+                return None
+            principal, expires = entry
+            if expires < time.monotonic():
+                del self._entries[uniquifier]
+                return None
+            self._entries.move_to_end(uniquifier)
+            return principal
+
+    def put(self, principal):
+        with self._lock:
+            self._entries[principal.fs_uniquifier] = (principal, time.monotonic() + self.ttl)
+            self._entries.move_to_end(principal.fs_uniquifier)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def evict(self, *uniquifiers):
+        with self._lock:
+            for uniquifier in uniquifiers:
+                self._entries.pop(uniquifier, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+principals = PrincipalCache()
+
+
+def evict_users(user_ids):
+    """
+    Evict the principals of users changed outside the session
+    """
+    with db.engine.connect() as conn:
+        uniquifiers = conn.execute(select(User.fs_uniquifier).where(User.id.in_(user_ids))).scalars().all()
+    principals.evict(*uniquifiers)
+
+
+def _attach(session, principal):
+    roles = []
+    for role_id, name, description in principal.roles:
+        role = Role(id=role_id, name=name, description=description)
+        make_transient_to_detached(role)
+        roles.append(session.merge(role, load=False))
+    user = User(id=principal.id, fs_uniquifier=principal.fs_uniquifier, active=principal.active, roles=roles)
+    make_transient_to_detached(user)
+    return session.merge(user, load=False)
+
+
+class CachingUserDatastore(SQLAlchemyUserDatastore):
+    def find_user(self, case_insensitive=False, **kwargs):
+        if case_insensitive or list(kwargs) != ['fs_uniquifier']:
+            return super().find_user(case_insensitive, **kwargs)
+
+        principal = principals.get(kwargs['fs_uniquifier'])
+        if principal is not None:
+            return _attach(self.db.session, principal)
+
+        user = super().find_user(**kwargs)
+        if user is not None:
+            principals.put(Principal(
+                user.id, user.fs_uniquifier, user.active,
+                tuple((role.id, role.name, role.description) for role in user.roles)
+            ))
+        return user
+
+
+def _uniquifiers(target):
+    attrs = inspect(target).attrs
+    return {target.fs_uniquifier, *attrs.fs_uniquifier.history.deleted} - {None}
+
+
+def _evict(target, uniquifiers):
+    principals.evict(*uniquifiers)
+    # evict again once the change is visible to other requests
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('evict_principals', set()).update(uniquifiers)
+
+
+@event.listens_for(User, 'after_update')
+def evict_changed_user(mapper, connection, target):
+    attrs = inspect(target).attrs
+    if any(attrs[name].history.has_changes() for name in ('active', 'fs_uniquifier', 'roles')):
+        _evict(target, _uniquifiers(target))
+
+
+@event.listens_for(User, 'after_delete')
+def evict_deleted_user(mapper, connection, target):
+    _evict(target, _uniquifiers(target))
+
+
+@event.listens_for(Session, 'after_commit')
+def evict_committed(session):
+    uniquifiers = session.info.pop('evict_principals', None)
+    if uniquifiers:
+        principals.evict(*uniquifiers)
@@ -0,0 +1,77 @@
+from functools import wraps
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger('slow_queries')
+
+DEFAULT_SLOW_QUERY_THRESHOLD_MS = 200
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context() and 'query_count' in g:
+        g.query_count += 1
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'handle_error')
+def drop_query_timer(exception_context):
+    starts = exception_context.connection.info.get('query_start') if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def time_query(conn, cursor, statement, parameters, context, executemany):
+    """
+    Add the statement to the request's SQL totals (g.sql_count, g.sql_seconds)
+    and log it when it ran longer than SLOW_QUERY_THRESHOLD_MS
+    """
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if not has_app_context():
+        return
+    if 'sql_count' in g:
+        g.sql_count += 1
+        g.sql_seconds += elapsed
+
+    threshold = current_app.config.get('SLOW_QUERY_THRESHOLD_MS', DEFAULT_SLOW_QUERY_THRESHOLD_MS)
+    if threshold is not None and elapsed * 1000 >= threshold:
+        endpoint = f"{request.method} {request.endpoint}" if has_request_context() else 'outside a request'
+        g.slow_queries = g.get('slow_queries', 0) + 1
+        slow_query_logger.warning(
+            f"{elapsed * 1000:.1f} ms in {endpoint}: {statement} "
+            f"parameters={parameters if not executemany else f'{len(parameters)} rows'}"
+        )
+
+
+def query_budget(max_queries):
+    """
+    Fail (in testing or with QUERY_BUDGET_STRICT) or warn when a view runs
+    more than max_queries SQL statements, authentication included.
+    Put it above @auth_required so the token lookup is counted too.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            g.query_count = 0
+            result = f(*args, **kwargs)
+            if g.query_count > max_queries:
+                message = f"{request.method} {request.endpoint} ran {g.query_count} queries, budget is {max_queries}"
+                if current_app.config.get('QUERY_BUDGET_STRICT', current_app.testing):
+                    raise QueryBudgetExceeded(message)
+                logger.warning(message)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,155 @@
+"""
+Incremental reminders about pending service requests.
+
+Each run only looks at the service requests that changed since the last
+one: the task_watermark row keeps the id of the last service request event
+(events.py) a run processed, and the events after it name the requests
+that were created, assigned or had their status changed. Of those, the
+requests still 'requested' and assigned to an active professional are due.
+The reminder table records every (request, professional) reminder, so
+nobody is reminded twice about the same request. A run therefore costs
+time in proportion to new activity, not to all pending work.
+
+Runs catch up on their own. The events stay in the table, so a run after
+missed runs reads everything since the watermark. The first run, or a run
+after the events it needed were pruned, scans every pending request once.
+
+Reminders are claimed (status 'sending', with the run's token) in the
+same transaction that moves the watermark, and sent after it commits, so
+overlapping runs never send the same reminder. Failed sends are retried
+up to MAX_REMINDER_ATTEMPTS times by later runs. A claim older than
+STALE_CLAIM belongs to a run that died, and it is retried too.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from uuid import uuid4
+from sqlalchemy import and_, exists, func, not_, or_, select, update
+from sqlalchemy.dialects.sqlite import insert
+from extensions import db
+from models import User, Role, Service_req, ServiceReqEvent, Reminder, TaskWatermark
+
+REMINDER_WATERMARK = 'daily_reminders'
+MAX_REMINDER_ATTEMPTS = 3
+STALE_CLAIM = timedelta(hours=1)
+
+
+def _retryable(now):
+    return or_(
+        and_(Reminder.status == 'failed', Reminder.attempts < MAX_REMINDER_ATTEMPTS),
+        and_(Reminder.status == 'sending', Reminder.updated_at < now - STALE_CLAIM),
+    )
+
+
+def due_reminders(conn, changed, now):
+    """
+    (request id, request date, professional id, email, username) of the
+    pending requests among changed (a select of request ids, or None for
+    every request) and the retryable ones, whose professional was not reminded yet
+    """
+    reminded = exists().where(
+        Reminder.service_req_id == Service_req.id,
+        Reminder.professional_id == Service_req.professional_id,
+        not_(_retryable(now)),
+    )
+    query = (
+        select(Service_req.id, Service_req.date_of_request, User.id.label('professional_id'), User.email, User.username)
+        .join(User, User.id == Service_req.professional_id)
+        .where(Service_req.service_status == 'requested', User.active.is_(True))
+        .where(User.roles.any(Role.name == 'serv'))
+        .where(~reminded)
+    )
+    if changed is not None:
+        retries = select(Reminder.service_req_id).where(_retryable(now))
+        query = query.where(or_(Service_req.id.in_(changed), Service_req.id.in_(retries)))
+    return conn.execute(query.order_by(User.id, Service_req.date_of_request)).all()
+
+
+def _claim(conn, rows, token, now):
+    """
+    Claim the reminders for this run; returns the rows no other run holds
+    """
+    if not rows:
+        return []
+    stmt = insert(Reminder)
+    conn.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[Reminder.service_req_id, Reminder.professional_id],
+            set_={'status': 'sending', 'claimed_by': token, 'attempts': Reminder.attempts + 1, 'updated_at': now},
+            where=_retryable(now),
+        ),
+        [{'service_req_id': row.id, 'professional_id': row.professional_id, 'status': 'sending',
+          'claimed_by': token, 'attempts': 1, 'updated_at': now} for row in rows],
+    )
+    claimed = set(conn.execute(
+        select(Reminder.service_req_id, Reminder.professional_id)
+        .where(Reminder.claimed_by == token, Reminder.status == 'sending')
+    ).all())
+    return [row for row in rows if (row.id, row.professional_id) in claimed]
+
+
+def pending_totals(conn, professional_ids):
+    """
+    {professional id: (pending request count, oldest request date)} of all
+    the 'requested' requests assigned to these professionals, not only the
+    ones being reminded about
+    """
+    if not professional_ids:
+        return {}
+    rows = conn.execute(
+        select(Service_req.professional_id, func.count(), func.min(Service_req.date_of_request))
+        .where(Service_req.service_status == 'requested', Service_req.professional_id.in_(professional_ids))
+        .group_by(Service_req.professional_id)
+    ).all()
+    return {professional_id: (count, oldest) for professional_id, count, oldest in rows}
+
+
+def claim_due(now=None):
+    """
+    Advance the watermark and claim the reminders due since the last run.
+    Returns {professional id: [rows]}, the pending totals of those
+    professionals (read in the same transaction, so every one of them has
+    some) and the run's token.
+    """
+    now = now or datetime.utcnow()
+    token = uuid4().hex
+    with db.engine.begin() as conn:
+        watermark = conn.execute(
+            select(TaskWatermark.last_event_id).where(TaskWatermark.name == REMINDER_WATERMARK)
+        ).scalar()
+        oldest, newest = conn.execute(select(func.min(ServiceReqEvent.id), func.max(ServiceReqEvent.id))).one()
+        newest = newest or 0
+
+        if watermark is None or (oldest is not None and watermark < oldest - 1):
+            # first run, or the events since the last run were pruned
+            changed = None
+        else:
+            changed = select(ServiceReqEvent.service_req_id).where(
+                ServiceReqEvent.id > watermark, ServiceReqEvent.id <= newest
+            )
+        rows = _claim(conn, due_reminders(conn, changed, now), token, now)
+        totals = pending_totals(conn, list({row.professional_id for row in rows}))
+
+        stmt = insert(TaskWatermark).values(name=REMINDER_WATERMARK, last_event_id=newest, updated_at=now)
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=[TaskWatermark.name], set_={'last_event_id': newest, 'updated_at': now}
+        ))
+
+    by_professional = defaultdict(list)
+    for row in rows:
+        by_professional[row.professional_id].append(row)
+    return by_professional, totals, token
+
+
+def finish(token, professional_ids, status):
+    """
+    Mark this run's claimed reminders of these professionals sent or failed
+    """
+    if not professional_ids:
+        return
+    with db.engine.begin() as conn:
+        conn.execute(
+            update(Reminder)
+            .where(Reminder.claimed_by == token, Reminder.status == 'sending',
+                   Reminder.professional_id.in_(professional_ids))
+            .values(status=status, claimed_by=None, updated_at=datetime.utcnow())
+        )
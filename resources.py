@@ -1,12 +1,29 @@
-from flask import request
+from flask import current_app, request
+from celery.result import AsyncResult
 from flask_restful import Resource, Api, fields, reqparse, marshal_with, marshal
 from flask_security import auth_required, roles_required, current_user
-from extensions import db, cache
-from models import User, Role, Category, Service, Service_req, Feedback
+from extensions import db
+from models import User, Role, Category, Service, Service_req, Feedback, ServiceStats, MonthlyActivity
 from datetime import datetime
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import case, func
+from sqlalchemy.orm import joinedload
+from pagination import after_cursor, keyset_page, ndjson_response, page_size, wants_ndjson
+from query_counter import query_budget
+import assignment
+from catalog import catalog
+import search_index
+import counters
+import bulk
+import serializers
+import cascade
+import events
+import tasks
+from response_cache import cached_response, invalidate, not_modified, principal_scope, public_scope, role_scope, user_requests_tag
+import response_cache
+from database import read_session
 
 api = Api(prefix='/api')
+api.representation('application/json')(serializers.output_json)
 
 parser = reqparse.RequestParser()
 
@@ -16,6 +33,11 @@ parser.add_argument('description', type=str)
 parser.add_argument('price', type=int)
 parser.add_argument('category_id', type=int, required=True, help='ID of the category')
 
+def service_req_tags(*user_ids):
+    # tags to invalidate when service requests of these customers/professionals change
+    return ['service_req'] + [user_requests_tag(user_id) for user_id in set(user_ids) if user_id]
+
+
 service_fields = {
     'id': fields.Integer,
     'name': fields.String,
@@ -23,13 +45,31 @@ service_fields = {
     'price': fields.Integer,
     'category_id': fields.Integer,
 }
+service_serializer = serializers.Serializer(service_fields)
+
+# the service listing also shows the rating aggregates kept in service_stats
+service_listing_fields = dict(service_fields, rating_count=fields.Integer, rating_average=fields.Float)
+service_listing_serializer = serializers.Serializer(service_listing_fields)
+
+def service_listing():
+    services = (
+        read_session.query(
+            Service.id, Service.name, Service.description, Service.price, Service.category_id,
+            func.coalesce(ServiceStats.rating_count, 0).label('rating_count'),
+            func.round(ServiceStats.rating_sum * 1.0 / func.nullif(ServiceStats.rating_count, 0), 2).label('rating_average'),
+        )
+        .outerjoin(ServiceStats, ServiceStats.service_id == Service.id)
+        .order_by(Service.id)
+        .all()
+    )
+    return service_listing_serializer.dumps(services), 200
+
 
 class ServiceResource(Resource):
     @auth_required('token')
-    @marshal_with(service_fields)
     def get(self):
-        services = Service.query.all()
-        return services
+        # ratings come from service_stats, which feedback writes change
+        return catalog.response('services', ('service', 'feedback'), service_listing)
     
     @auth_required('token')
     @marshal_with(service_fields)
@@ -43,6 +83,7 @@ class ServiceResource(Resource):
         )
         db.session.add(service)
         db.session.commit()
+        invalidate('service')
         return {'message': 'Service created'}, 201
 
     @auth_required('token')
@@ -54,27 +95,21 @@ class ServiceResource(Resource):
         service.price = args.price
         service.category_id = args.category_id
         db.session.commit()
+        invalidate('service')
         return {'message': 'Service updated'}, 200
 
     @auth_required('token')
+    @roles_required('admin')
     def delete(self, id):
-        # Find all service requests related to this service
-        related_requests = Service_req.query.filter_by(service_id=id).all()
+        Service.query.get_or_404(id)
 
-        # Delete each related service request
-        for req in related_requests:
-            db.session.delete(req)
+        # Large cascades run in the background; poll /api/tasks/<task_id> for progress
+        if cascade.service_cascade_size(id) > cascade.INLINE_CASCADE_LIMIT:
+            task = tasks.delete_service_cascade.delay(id)
+            return {'message': 'Service deletion started', 'task_id': task.id}, 202
 
-        # Now delete the service itself
-        service = Service.query.get_or_404(id)
-        db.session.delete(service)
-        
-        try:
-            db.session.commit()  # Commit the transaction
-            return {'message': 'Service and associated service requests deleted'}, 200
-        except IntegrityError as e:
-            db.session.rollback()  # Rollback the session in case of an error
-            return {'message': f'Error deleting service: {str(e)}'}, 400
+        deleted = cascade.run(cascade.delete_service(id))
+        return {'message': 'Service and associated service requests deleted', 'deleted': deleted}, 200
 
 
 api.add_resource(ServiceResource, '/services', '/services/<int:id>')
@@ -106,23 +141,63 @@ service_req_fields = {
     'service_status': fields.String,
     'remarks': fields.String
 }
+service_req_serializer = serializers.Serializer(service_req_fields)
+
+# Eager load exactly the related columns service_req_fields reads, in the same query
+_user_columns = (User.username, User.email, User.phone, User.address, User.pin)
+service_req_load_options = (
+    joinedload(Service_req.customer).load_only(*_user_columns),
+    joinedload(Service_req.professional).load_only(*_user_columns),
+    joinedload(Service_req.service).load_only(Service.name),
+)
+
+
 
+def service_requests_scope():
+    # admins and professionals see the same list, customers only their own
+    if any(role.name in ['admin', 'serv'] for role in current_user.roles):
+        return role_scope()
+    return principal_scope()
 
 
 class ServiceRequestResource(Resource):
+    @query_budget(4)
     @auth_required('token')
-    @cache.cached(timeout = 5)
-    @marshal_with(service_req_fields)
+    @cached_response('service_req', 'service', 'user', scope = service_requests_scope, unless = wants_ndjson)
     def get(self):
         user = current_user  
 
+        query = read_session.query(Service_req).options(*service_req_load_options)
         if any(role.name in ['admin', 'serv'] for role in user.roles):
-            service_requests = Service_req.query.all()
+            customer_id = request.args.get('customer_id', type=int)
+            if customer_id:
+                query = query.filter_by(customer_id=customer_id)
         else:
         # Fetch service requests related to this user
-            service_requests = Service_req.query.filter_by(customer_id=user.id).all()
+            query = query.filter_by(customer_id=user.id)
+
+        # Optional filters
+        professional_id = request.args.get('professional_id', type=int)
+        if professional_id:
+            query = query.filter_by(professional_id=professional_id)
+        status = request.args.get('status')
+        if status:
+            query = query.filter_by(service_status=status)
+
+        cursor = request.args.get('cursor')
+        try:
+            if wants_ndjson():
+                query = after_cursor(query, Service_req.date_of_request, Service_req.id, cursor)
+                return ndjson_response(query, service_req_serializer)
 
-        return service_requests
+            service_requests, next_cursor = keyset_page(
+                query, Service_req.date_of_request, Service_req.id, cursor, page_size()
+            )
+        except ValueError as e:
+            return {'message': str(e)}, 400
+
+        headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+        return service_req_serializer.dumps(service_requests), 200, headers
 
     @auth_required('token')
     def post(self):
@@ -147,6 +222,11 @@ class ServiceRequestResource(Resource):
             professional = User.query.get(professional_id)
             if not professional:
                 return {'message': 'Professional not found'}, 404
+        elif data.get('auto_assign', current_app.config.get('AUTO_ASSIGN_REQUESTS', True)):
+            # least loaded active professional for the category in the customer's pin, if any
+            professional_id = assignment.index.pick(assignment.service_type_of(service.id), customer.pin)
+            if professional_id:
+                professional = db.session.get(User, professional_id)
 
         # Create a new service request
         service_request = Service_req(
@@ -159,6 +239,7 @@ class ServiceRequestResource(Resource):
 
         db.session.add(service_request)
         db.session.commit()
+        invalidate(*service_req_tags(service_request.customer_id, service_request.professional_id))
 
         return {'message': 'Service request successfully', 'service_request_id': service_request.id}, 201
 
@@ -167,6 +248,7 @@ class ServiceRequestResource(Resource):
     def patch(self, service_request_id):
         data = request.get_json()
         service_request = Service_req.query.get_or_404(service_request_id)
+        previous_professional_id = service_request.professional_id
 
         # Optionally update professional_id if provided
         professional_id = data.get('professional_id')
@@ -183,6 +265,9 @@ class ServiceRequestResource(Resource):
                 service_request.date_of_completion = datetime.utcnow()
 
         db.session.commit()
+        invalidate(*service_req_tags(
+            service_request.customer_id, service_request.professional_id, previous_professional_id
+        ))
         return {'message': 'Service updated successfully', 'service_status': service_request.service_status}, 200
 
 
@@ -190,37 +275,89 @@ class ServiceRequestResource(Resource):
 
 api.add_resource(ServiceRequestResource, '/service_requests', '/service_requests/<int:service_request_id>')
 
+
+class ServiceRequestEvents(Resource):
+    @auth_required('token')
+    def get(self):
+        # Server-Sent Events of the service request changes the user can see, resumable with Last-Event-ID
+        return events.stream(current_user.id, {role.name for role in current_user.roles})
+
+api.add_resource(ServiceRequestEvents, '/service_requests/events')
+
+
+class AssignBacklog(Resource):
+    @auth_required('token')
+    @roles_required('admin')
+    def post(self):
+        # assign the unassigned 'requested' requests to the least loaded matching professionals
+        data = request.get_json(silent=True) or {}
+        limit = data.get('limit')
+        if limit is not None and (type(limit) is not int or not 1 <= limit <= assignment.MAX_BACKLOG_LIMIT):
+            return {'message': f'limit must be an integer from 1 to {assignment.MAX_BACKLOG_LIMIT}'}, 400
+        assigned, unmatched = assignment.assign_backlog(limit)
+        if assigned:
+            invalidate(*service_req_tags(*[user_id for _, professional_id, customer_id in assigned
+                                           for user_id in (professional_id, customer_id)]))
+        return {'assigned': len(assigned), 'unmatched': unmatched}, 200
+
+api.add_resource(AssignBacklog, '/service_requests/assign')
+
 class Service_Prof_Resources(Resource):
     @auth_required('token')
+    @roles_required('admin')
     def delete(self, user_id):
         service_professional = User.query.filter_by(id = user_id).first()
-        if service_professional:
-            db.session.delete(service_professional)
-            db.session.commit()
-            return{'message': f'Service professional with ID {user_id} deleted'}, 200
-        else:
-            return {'message': f'User with ID {user_id} not found'}, 404
+        # only service professionals are deleted here, with their requests and feedback
+        if not service_professional or not any(role.name == 'serv' for role in service_professional.roles):
+            return {'message': f'Service professional with ID {user_id} not found'}, 404
+
+        if cascade.professional_cascade_size(user_id) > cascade.INLINE_CASCADE_LIMIT:
+            task = tasks.delete_professional_cascade.delay(user_id)
+            return {'message': f'Deletion of service professional {user_id} started', 'task_id': task.id}, 202
+
+        cascade.run(cascade.delete_professional(user_id))
+        return{'message': f'Service professional with ID {user_id} deleted'}, 200
 
 api.add_resource(Service_Prof_Resources, '/service_pro/<int:user_id>')
 
 
+class TaskStatus(Resource):
+    @auth_required('token')
+    @roles_required('admin')
+    def get(self, task_id):
+        # State and progress ({done, total}) of a background job
+        result = AsyncResult(task_id)
+        info = result.info if isinstance(result.info, dict) else None
+        if result.failed():
+            return {'state': result.state, 'error': str(result.info)}, 200
+        return {'state': result.state, 'progress': info}, 200
+
+api.add_resource(TaskStatus, '/tasks/<string:task_id>')
+
+
+def category_listing(category_id=None):
+    # Get a single category by ID
+    if category_id:
+        category = read_session.get(Category, category_id)
+        if not category:
+            return {'message': 'Category not found'}, 404
+        services = read_session.query(Service).filter_by(category_id = category_id).all()
+        return [{ 'id': service.id, 'name': service.name, 'description': service.description, 'price': service.price} for service in services], 200
+    else:
+    # Get all categories
+        categories = read_session.query(Category).all()
+        return [
+            {'id': category.id, 'name': category.name, 'description': category.description}
+            for category in categories
+        ], 200
+
+
 class CategoryResource(Resource):
-    @cache.cached(timeout = 5)
     def get(self, category_id=None):
-        # Get a single category by ID
         if category_id:
-            category = Category.query.get(category_id)
-            if not category:
-                return {'message': 'Category not found'}, 404
-            services = Service.query.filter_by(category_id = category_id).all()
-            return [{ 'id': service.id, 'name': service.name, 'description': service.description, 'price': service.price} for service in services], 200
-        else: 
-        # Get all categories
-            categories = Category.query.all()
-            return [
-                {'id': category.id, 'name': category.name, 'description': category.description}
-                for category in categories
-            ], 200
+            return catalog.response(f'categories/{category_id}/services', ('category', 'service'),
+                                    lambda: category_listing(category_id))
+        return catalog.response('categories', ('category',), category_listing)
 
     def post(self):
         # Create a new category
@@ -231,6 +368,7 @@ class CategoryResource(Resource):
         )
         db.session.add(new_category)
         db.session.commit()
+        invalidate('category')
         return {
             'message': 'Category created',
             'category': {
@@ -248,6 +386,7 @@ class CategoryResource(Resource):
             category.name = data.get('name', category.name)
             category.description = data.get('description', category.description)
             db.session.commit()
+            invalidate('category')
             return {
                 'message': 'Category updated',
                 'category': {
@@ -265,37 +404,86 @@ class CategoryResource(Resource):
         if category:
             db.session.delete(category)
             db.session.commit()
+            invalidate('category')
             return {'message': 'Category deleted'}, 200
         else:
             return {'message': 'Category not found'}, 404
 
 api.add_resource(CategoryResource, '/categories/<int:category_id>/services', '/categories')
 
+
+class BulkResource(Resource):
+    @auth_required('token')
+    @roles_required('admin')
+    def get(self, kind):
+        # Stream every row as JSON Lines (default) or CSV
+        fmt = bulk.request_format()
+        if kind not in bulk.KINDS or fmt not in bulk.FORMATS:
+            return {'message': f'Unsupported export: {kind} as {fmt}'}, 400
+        return bulk.export_response(kind, fmt)
+
+    @auth_required('token')
+    @roles_required('admin')
+    def post(self, kind):
+        # Import rows from a JSON Lines or CSV body, reporting the rows that were rejected
+        fmt = bulk.request_format()
+        if kind not in bulk.KINDS or fmt not in bulk.FORMATS:
+            return {'message': f'Unsupported import: {kind} as {fmt}'}, 400
+        try:
+            upload = bulk.spool_upload(request.stream)
+        except bulk.InvalidUpload as e:
+            return {'message': str(e)}, 400
+        with upload:
+            report = bulk.import_rows(kind, bulk.read_rows(upload, fmt))
+        return report.as_dict(), 200
+
+api.add_resource(BulkResource, '/bulk/<string:kind>')
+
+def search_services(search_value, match):
+    """
+    Services matching the full-text query, best match first (all services when
+    the search is empty, none when it has no words to match)
+    """
+    query = read_session.query(Service)
+    if not search_value:
+        return query.all()
+    if not match:
+        return []
+    hits = search_index.service_matches(match)
+    return query.join(hits, Service.id == hits.c.id).order_by(hits.c.rank).all()
+
+
 class Search(Resource):
+    @query_budget(5)
     @auth_required("token")
     def post(self):
         parser = reqparse.RequestParser()
         parser.add_argument('search', help="Search Key", required=True)
         args = parser.parse_args()
         search_value = args.get('search')
-        search = "%{}%".format(search_value)
+        match = search_index.match_expression(search_value)
         
         user = current_user  # Get the current user
         
         # Check user's role and filter data accordingly
         if any(role.name == 'admin' for role in user.roles):
-            services = Service.query.filter(Service.name.like(search)).all()
-            service_requests = Service_req.query.filter(Service_req.remarks.like(search)).union(
-                Service_req.query.filter(Service_req.service_id.in_(
-                    Service.query.filter(Service.name.like(search)).with_entities(Service.id)
-                ))
-            ).all()
+            services = search_services(search_value, match)
+            service_requests = read_session.query(Service_req).options(*service_req_load_options)
+            if match:
+                hits = search_index.service_request_matches(match)
+                service_requests = service_requests.join(hits, Service_req.id == hits.c.id) \
+                    .order_by(hits.c.rank.is_(None), hits.c.rank, Service_req.id).all()
+            elif search_value:
+                # nothing in the search can match, like LIKE '%!!!%'
+                service_requests = []
+            else:
+                service_requests = service_requests.all()
         elif any(role.name == 'serv' for role in user.roles):
-            services = Service.query.filter(Service.name.like(search)).all()
-            service_requests = Service_req.query.filter_by(professional_id=user.id).all()
+            services = search_services(search_value, match)
+            service_requests = read_session.query(Service_req).options(*service_req_load_options).filter_by(professional_id=user.id).all()
         elif any(role.name == 'cust' for role in user.roles):
-            services = Service.query.filter(Service.name.like(search)).all()
-            service_requests = Service_req.query.filter_by(customer_id=user.id).all()
+            services = search_services(search_value, match)
+            service_requests = read_session.query(Service_req).options(*service_req_load_options).filter_by(customer_id=user.id).all()
         else:
             return {'message': 'Unauthorized'}, 403
 
@@ -316,24 +504,15 @@ class AdminSummary(Resource):
         if not any(role.name == 'admin' for role in user.roles):
             return {'message': 'Unauthorized'}, 403
         
-        # Fetch total users and service professionals
-        total_users = User.query.count()
-        total_service_pros = User.query.join(User.roles).filter_by(name='serv').count()
-
-        # Fetch total service requests, completed, and pending requests
-        total_requests = Service_req.query.count()
-        completed_requests = Service_req.query.filter_by(service_status='closed').count()
-        pending_requests = Service_req.query.filter(Service_req.service_status != 'completed').count()
-
-        # Fetch total services and categories
-        total_services = Service.query.count()
-        total_categories = Category.query.count()
+        totals = counters.values(
+            'users', 'service_pros', 'service_reqs', counters.status_counter('closed'), 'services', 'categories'
+        )
 
         # Fetch the most popular services (services with the most requests)
-        popular_services = db.session.query(Service, db.func.count(Service_req.id).label('request_count')) \
-            .join(Service_req, Service.id == Service_req.service_id) \
-            .group_by(Service.id) \
-            .order_by(db.desc('request_count')) \
+        popular_services = read_session.query(Service, ServiceStats.request_count) \
+            .join(ServiceStats, Service.id == ServiceStats.service_id) \
+            .filter(ServiceStats.request_count > 0) \
+            .order_by(ServiceStats.request_count.desc()) \
             .limit(5) \
             .all()
 
@@ -342,14 +521,15 @@ class AdminSummary(Resource):
                                  for service, request_count in popular_services]
 
         # Summary response data
+        completed_requests = totals[counters.status_counter('closed')]
         summary_data = {
-            'total_users': total_users,
-            'total_service_pros': total_service_pros,
-            'total_requests': total_requests,
+            'total_users': totals['users'],
+            'total_service_pros': totals['service_pros'],
+            'total_requests': totals['service_reqs'],
             'completed_requests': completed_requests,
-            'pending_requests': pending_requests,
-            'total_services': total_services,
-            'total_categories': total_categories,
+            'pending_requests': totals['service_reqs'] - completed_requests,
+            'total_services': totals['services'],
+            'total_categories': totals['categories'],
             'popular_services': popular_services_data
         }
 
@@ -366,16 +546,23 @@ class ServiceProfessionalSummary(Resource):
         # Assuming that the current user is a Service Professional
         user = current_user
 
-        # Total requests made by the service professional
-        total_requests = Service_req.query.filter_by(professional_id=user.id).count()
-        completed_requests = Service_req.query.filter_by(professional_id=user.id, service_status='closed').count()
-        pending_requests = Service_req.query.filter_by(professional_id=user.id, service_status='accepted').count()
+        etag = response_cache.etag('professional_summary', user_requests_tag(user.id))
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
+        # All three counts in one pass over the professional's requests
+        total_requests, completed_requests, pending_requests = read_session.query(
+            func.count(Service_req.id),
+            func.sum(case((Service_req.service_status == 'closed', 1), else_=0)),
+            func.sum(case((Service_req.service_status == 'accepted', 1), else_=0)),
+        ).filter(Service_req.professional_id == user.id).one()
 
         return {
             'total_requests': total_requests,
-            'completed_requests': completed_requests,
-            'pending_requests': pending_requests,
-        }
+            'completed_requests': completed_requests or 0,
+            'pending_requests': pending_requests or 0,
+        }, 200, response_cache.etag_headers(etag)
 
 api.add_resource(ServiceProfessionalSummary, '/professional/summary')
 
@@ -385,29 +572,60 @@ class CustomerSummary(Resource):
         # Assuming that the current user is a Customer
         user = current_user
 
-        # Total requests made by the customer
-        total_requests = Service_req.query.filter_by(customer_id=user.id).count()
-        completed_requests = Service_req.query.filter_by(customer_id=user.id, service_status='closed').count()
-        pending_requests = Service_req.query.filter_by(customer_id=user.id).filter(Service_req.service_status != 'closed').count()
+        etag = response_cache.etag('customer_summary', user_requests_tag(user.id))
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
+        # Sum the customer's monthly rollups instead of scanning their requests
+        total_requests, completed_requests = read_session.query(
+            func.coalesce(func.sum(MonthlyActivity.requested_count), 0),
+            func.coalesce(func.sum(MonthlyActivity.closed_count), 0),
+        ).filter(MonthlyActivity.customer_id == user.id).one()
 
         return {
             'total_requests': total_requests,
             'completed_requests': completed_requests,
-            'pending_requests': pending_requests,
-        }
+            'pending_requests': total_requests - completed_requests,
+        }, 200, response_cache.etag_headers(etag)
 
 
 api.add_resource(CustomerSummary, '/customer/summary')
 
-class ServiceTypeResource(Resource):
+class CustomerMonthlyActivity(Resource):
+    @auth_required("token")
     def get(self):
-        # Fetch all category names from the Category table
-        categories = Category.query.with_entities(Category.name).all()
+        """
+        Requested and closed service request counts per month for the current customer
+        """
+        user = current_user
+
+        etag = response_cache.etag('customer_monthly_activity', user_requests_tag(user.id))
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
+        months = read_session.query(MonthlyActivity).filter_by(customer_id=user.id).order_by(MonthlyActivity.month.desc()).all()
+        return [
+            {'month': month.month, 'requested': month.requested_count, 'closed': month.closed_count}
+            for month in months
+        ], 200, response_cache.etag_headers(etag)
+
+api.add_resource(CustomerMonthlyActivity, '/customer/monthly_activity')
+
+def service_types():
+    # Fetch all category names from the Category table
+    categories = read_session.query(Category).with_entities(Category.name).all()
+
+    # Format response to list all category names
+    category_list = [category.name for category in categories]
+
+    return {'service_types': category_list}, 200
 
-        # Format response to list all category names
-        category_list = [category.name for category in categories]
-        
-        return {'service_types': category_list}, 200
+
+class ServiceTypeResource(Resource):
+    def get(self):
+        return catalog.response('service_types', ('category',), service_types)
 
 # Register the API resource to expose it on /service_types
 api.add_resource(ServiceTypeResource, '/service_types')
@@ -424,37 +642,83 @@ feedback_fields = {
     'comments': fields.String,
     'date': fields.DateTime(dt_format='iso8601') 
 }
+feedback_serializer = serializers.Serializer(feedback_fields)
 
 # Parser to handle feedback submission
 feedback_parser = reqparse.RequestParser()
 feedback_parser.add_argument('rating', type=int, required=True, help="Rating (1-5) is required")
 feedback_parser.add_argument('comments', type=str, required=False, help="Optional comments for feedback")
 
+DEFAULT_TOP_FEEDBACK = 5
+MAX_TOP_FEEDBACK = 50
+
+
+def feedback_rows(query):
+    return (
+        query
+        .join(User, Feedback.customer_id == User.id)  # Join with User for customer_name
+        .join(Service, Feedback.service_id == Service.id)  # Join with Service for service_name
+        .with_entities(
+            Feedback.id,
+            Feedback.service_id,
+            Feedback.customer_id,
+            Feedback.rating,
+            Feedback.comments,
+            Feedback.date,
+            User.username.label('customer_name'),  # Alias for customer_name
+            Service.name.label('service_name')  # Alias for service_name
+        )
+    )
+
+
 class FeedbackResource(Resource):
-    @marshal_with(feedback_fields)
-    def get(self):
+    @cached_response('feedback', 'service', 'user', scope = public_scope)
+    def get(self, service_id=None):
         """
-        Fetch the top 5 feedback for each service, ordered by rating
+        /feedbacks: the top ?top (default 5) feedback of each service on the
+        page, best rated first; services with feedback are paged with ?page
+        and ?limit. /services/<id>/feedback: one page of a service's
+        feedback, best rated first.
         """
-        feedbacks = (
-            db.session.query(Feedback)
-            .join(User, Feedback.customer_id == User.id)  # Join with User for customer_name
-            .join(Service, Feedback.service_id == Service.id)  # Join with Service for service_name
-            .with_entities(
+        limit = page_size()
+        page = max(1, request.args.get('page', 1, type=int))
+
+        if service_id is not None:
+            total = read_session.query(ServiceStats.rating_count).filter_by(service_id=service_id).scalar() or 0
+            feedbacks = (
+                feedback_rows(read_session.query(Feedback).filter(Feedback.service_id == service_id))
+                .order_by(Feedback.rating.desc(), Feedback.id.desc())
+                .offset((page - 1) * limit).limit(limit)
+                .all()
+            )
+            return feedback_serializer.dumps(feedbacks), 200, {'X-Total-Count': str(total)}
+
+        top = max(1, min(request.args.get('top', DEFAULT_TOP_FEEDBACK, type=int), MAX_TOP_FEEDBACK))
+        rated = read_session.query(ServiceStats.service_id).filter(ServiceStats.rating_count > 0)
+        total = rated.count()
+        service_ids = [
+            row.service_id for row in
+            rated.order_by(ServiceStats.service_id).offset((page - 1) * limit).limit(limit)
+        ]
+
+        # rank each service's feedback with a window function, using the (service_id, rating) index
+        ranked = (
+            read_session.query(
                 Feedback.id,
-                Feedback.service_id,
-                Feedback.customer_id,
-                Feedback.rating,
-                Feedback.comments,
-                Feedback.date,
-                User.username.label('customer_name'),  # Alias for customer_name
-                Service.name.label('service_name')  # Alias for service_name
+                func.row_number().over(
+                    partition_by=Feedback.service_id, order_by=(Feedback.rating.desc(), Feedback.id.desc())
+                ).label('rank')
             )
-            .order_by(Feedback.service_id, Feedback.rating.desc())  # Order by service and rating
-            .all()
+            .filter(Feedback.service_id.in_(service_ids))
+            .subquery()
         )
-
-        return feedbacks, 200
+        feedbacks = (
+            feedback_rows(read_session.query(Feedback).join(ranked, ranked.c.id == Feedback.id))
+            .filter(ranked.c.rank <= top)
+            .order_by(Feedback.service_id, ranked.c.rank)
+            .all()
+        ) if service_ids else []
+        return feedback_serializer.dumps(feedbacks), 200, {'X-Total-Count': str(total)}
 
 
     @auth_required('token')
@@ -463,6 +727,8 @@ class FeedbackResource(Resource):
         Submit feedback for a specific service
         """
         args = feedback_parser.parse_args()
+        if args['rating'] not in counters.RATINGS:
+            return {'message': 'Rating must be between 1 and 5'}, 400
 
         # Ensure the service exists
         service = Service.query.get_or_404(service_id)
@@ -483,8 +749,28 @@ class FeedbackResource(Resource):
 
         db.session.add(feedback)
         db.session.commit()
+        invalidate('feedback')
 
         return {'message': 'Feedback submitted successfully', 'feedback': marshal(feedback, feedback_fields)}, 201
 
 # Register the FeedbackResource API resource
 api.add_resource(FeedbackResource, '/services/<int:service_id>/feedback', '/feedbacks')
+
+
+class ServiceRatings(Resource):
+    @cached_response('feedback', 'service', scope = public_scope)
+    def get(self, service_id):
+        """
+        Rating count, average and histogram of a service, from service_stats
+        """
+        stats = read_session.get(ServiceStats, service_id)
+        if stats is None and read_session.get(Service, service_id) is None:
+            return {'message': 'Service not found'}, 404
+        return {
+            'service_id': service_id,
+            'count': stats.rating_count if stats else 0,
+            'average': counters.rating_average(stats) if stats else None,
+            'histogram': {str(rating): getattr(stats, f'rating_{rating}') if stats else 0 for rating in counters.RATINGS},
+        }, 200
+
+api.add_resource(ServiceRatings, '/services/<int:service_id>/ratings')
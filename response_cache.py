@@ -0,0 +1,130 @@
+"""
+Response cache keyed on the principal and tagged with the tables a response
+depends on.
+
+Every tag has a version stored in the cache and the versions are part of
+each entry's key, so invalidating a tag on write makes every response built
+from it unreachable at once. Versions are random tokens rather than
+counters so a flushed or evicted tag can never bring an old entry back.
+"""
+from functools import wraps
+from uuid import uuid4
+import hashlib
+import logging
+from flask import Response, g, request
+from flask_security import current_user
+from extensions import cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 300
+
+
+def _tag_key(tag):
+    return f'tag:{tag}'
+
+
+def tag_versions(*tags):
+    keys = [_tag_key(tag) for tag in tags]
+    versions = cache.get_many(*keys)
+    missing = {key: uuid4().hex for key, version in zip(keys, versions) if version is None}
+    if missing:
+        cache.set_many(missing, timeout=0)
+    return [version if version is not None else missing[key] for key, version in zip(keys, versions)]
+
+
+def invalidate(*tags):
+    try:
+        cache.set_many({_tag_key(tag): uuid4().hex for tag in tags}, timeout=0)
+    except Exception as e:
+        logger.error(f"Failed to invalidate cache tags {tags}: {e}")
+
+
+def user_requests_tag(user_id):
+    # data version of the service requests a customer or professional is part of
+    return f'service_req:user:{user_id}'
+
+
+def etag(scope, *tags):
+    """
+    Validator for a response built from the given tags, it changes whenever one of them is invalidated.
+    None when the cache is unavailable: the response is then sent without one.
+    """
+    try:
+        versions = tag_versions(*tags)
+    except Exception as e:
+        logger.error(f"Response cache unavailable: {e}")
+        return None
+    return hashlib.sha1(repr((scope, versions)).encode()).hexdigest()
+
+
+def not_modified(etag):
+    """
+    304 response when the client already holds this version, else None
+    """
+    if etag is not None and request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
+    return None
+
+
+def etag_headers(etag):
+    if etag is None:
+        return {}
+    return {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+
+
+def principal_scope():
+    if not current_user.is_authenticated:
+        return 'anonymous'
+    return f'user:{current_user.id}'
+
+
+def role_scope():
+    if not current_user.is_authenticated:
+        return 'anonymous'
+    return 'roles:' + ','.join(sorted(role.name for role in current_user.roles))
+
+
+def public_scope():
+    return 'public'
+
+
+def _status(result):
+    if isinstance(result, tuple) and len(result) > 1:
+        return result[1]
+    return 200
+
+
+def cached_response(*tags, scope=principal_scope, timeout=DEFAULT_TIMEOUT, unless=None):
+    """
+    Cache a view's return value per scope, path and query string until
+    the timeout passes or one of the tags is invalidated.
+    Only successful, non streamed results are stored.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if unless is not None and unless():
+                return f(*args, **kwargs)
+
+            try:
+                parts = (scope(), request.path, sorted(request.args.items(multi=True)), tag_versions(*tags))
+                key = 'view:' + hashlib.sha1(repr(parts).encode()).hexdigest()
+                result = cache.get(key)
+            except Exception as e:
+                logger.error(f"Response cache unavailable: {e}")
+                return f(*args, **kwargs)
+            if result is not None:
+                g.cache_hits = g.get('cache_hits', 0) + 1
+                return result
+
+            g.cache_misses = g.get('cache_misses', 0) + 1
+            result = f(*args, **kwargs)
+            if _status(result) == 200 and not hasattr(result, 'status_code'):
+                try:
+                    cache.set(key, result, timeout=timeout)
+                except Exception as e:
+                    logger.error(f"Failed to cache response for {request.path}: {e}")
+            return result
+        return wrapper
+    return decorator
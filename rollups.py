@@ -0,0 +1,146 @@
+"""
+Per customer monthly activity rollups (monthly_activity), maintained in the
+same transaction as the service request writes that change them.
+
+A request counts as requested in the month of its date_of_request and as
+closed in the month of its date_of_completion while its status is 'closed'.
+A closed request without a date_of_completion (bulk imports reject them,
+older rows may have one) counts as closed in the month it was requested,
+so it is never pending here while the admin counters call it closed.
+Like counters.py, a before_flush hook records what changed and an
+after_flush hook writes the rollup rows; bulk statements must call
+rebuild() for the customers they touched.
+"""
+from collections import defaultdict
+import json
+from sqlalchemy import delete, event, inspect, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from model_history import stored_value
+from models import Service_req, MonthlyActivity
+
+
+def month_of(date):
+    return date.strftime('%Y-%m')
+
+
+def _closed_month(status, completed, requested):
+    if status != 'closed':
+        return None
+    return month_of(completed or requested)
+
+
+def _stored_closed_month(session, obj):
+    return _closed_month(*(stored_value(session, obj, attr)
+                           for attr in ('service_status', 'date_of_completion', 'date_of_request')))
+
+
+@event.listens_for(Session, 'before_flush')
+def collect_changes(session, flush_context, instances):
+    # (kind, sign, request, month, customer id); month None means the month of
+    # date_of_request, customer id None the request's customer after the flush
+    changes = []
+    for obj in session.new:
+        if isinstance(obj, Service_req):
+            changes.append(('requested', 1, obj, None, None))
+            if obj.service_status == 'closed':
+                # date_of_request is only set by the flush
+                completed = obj.date_of_completion
+                changes.append(('closed', 1, obj, month_of(completed) if completed else None, None))
+
+    for obj in session.deleted:
+        if isinstance(obj, Service_req):
+            # a deleted row leaves the months it is stored in, not the ones it was changed to
+            customer_id = stored_value(session, obj, 'customer_id')
+            changes.append(('requested', -1, obj, month_of(stored_value(session, obj, 'date_of_request')), customer_id))
+            closed = _stored_closed_month(session, obj)
+            if closed:
+                changes.append(('closed', -1, obj, closed, customer_id))
+
+    for obj in session.dirty:
+        if not isinstance(obj, Service_req):
+            continue
+        attrs = inspect(obj).attrs
+        if not (attrs.service_status.history.has_changes() or attrs.date_of_completion.history.has_changes()):
+            continue
+        # re-closing with a new date moves the request to the month of the new date
+        was_closed = _stored_closed_month(session, obj)
+        is_closed = _closed_month(obj.service_status, obj.date_of_completion, obj.date_of_request)
+        if was_closed != is_closed:
+            if was_closed:
+                changes.append(('closed', -1, obj, was_closed, None))
+            if is_closed:
+                changes.append(('closed', 1, obj, is_closed, None))
+
+    if changes:
+        flush_context.attributes['rollup_changes'] = changes
+
+
+@event.listens_for(Session, 'after_flush')
+def apply_changes(session, flush_context):
+    changes = flush_context.attributes.pop('rollup_changes', None)
+    if not changes:
+        return
+    conn = session.connection()
+    for kind, sign, obj, month, customer_id in changes:
+        customer_id = customer_id or obj.customer_id
+        if customer_id is None:
+            continue
+        update(conn, customer_id, month or month_of(obj.date_of_request), kind, obj.id, sign)
+
+
+def update(conn, customer_id, month, kind, request_id, sign):
+    """
+    Add (sign 1) or remove (sign -1) a request from one month's requested or closed list
+    """
+    ids_column = getattr(MonthlyActivity, f'{kind}_ids')
+    stored = conn.execute(
+        select(ids_column).where(MonthlyActivity.customer_id == customer_id, MonthlyActivity.month == month)
+    ).scalar()
+    ids = json.loads(stored) if stored else []
+    if sign > 0 and request_id not in ids:
+        ids.append(request_id)
+    elif sign < 0 and request_id in ids:
+        ids.remove(request_id)
+    else:
+        return
+
+    values = {f'{kind}_ids': json.dumps(ids), f'{kind}_count': len(ids)}
+    stmt = insert(MonthlyActivity).values(customer_id=customer_id, month=month, **values)
+    conn.execute(stmt.on_conflict_do_update(index_elements=[MonthlyActivity.customer_id, MonthlyActivity.month], set_=values))
+
+
+def rebuild(conn, customer_ids=None):
+    """
+    Recompute the rollups of the given customers (all customers when None)
+    """
+    requests = select(
+        Service_req.id, Service_req.customer_id, Service_req.date_of_request,
+        Service_req.date_of_completion, Service_req.service_status
+    ).where(Service_req.customer_id.isnot(None)).order_by(Service_req.id)
+    clear = delete(MonthlyActivity)
+    if customer_ids is not None:
+        customer_ids = list(customer_ids)
+        requests = requests.where(Service_req.customer_id.in_(customer_ids))
+        clear = clear.where(MonthlyActivity.customer_id.in_(customer_ids))
+
+    months = defaultdict(lambda: {'requested': [], 'closed': []})
+    for row in conn.execute(requests):
+        months[(row.customer_id, month_of(row.date_of_request))]['requested'].append(row.id)
+        closed = _closed_month(row.service_status, row.date_of_completion, row.date_of_request)
+        if closed:
+            months[(row.customer_id, closed)]['closed'].append(row.id)
+
+    conn.execute(clear)
+    if months:
+        conn.execute(insert(MonthlyActivity), [
+            {
+                'customer_id': customer_id,
+                'month': month,
+                'requested_count': len(ids['requested']),
+                'closed_count': len(ids['closed']),
+                'requested_ids': json.dumps(ids['requested']),
+                'closed_ids': json.dumps(ids['closed']),
+            }
+            for (customer_id, month), ids in months.items()
+        ])
@@ -0,0 +1,81 @@
+"""
+SQLite FTS5 full-text index over service names/descriptions and service
+request remarks.
+
+The virtual tables use the base tables as external content and are kept in
+sync by triggers, so every insert, update and delete is indexed whether it
+goes through the ORM or a bulk statement.
+"""
+import re
+from sqlalchemy import Float, Integer, bindparam, cast, func, null, select, text, union_all
+from models import Service_req
+
+TOKEN = re.compile(r'\w+')
+
+SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS service_fts USING fts5("
+    "name, description, content='service', content_rowid='id', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS service_fts_insert AFTER INSERT ON service BEGIN "
+    "INSERT INTO service_fts (rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS service_fts_delete AFTER DELETE ON service BEGIN "
+    "INSERT INTO service_fts (service_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS service_fts_update AFTER UPDATE OF name, description ON service BEGIN "
+    "INSERT INTO service_fts (service_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO service_fts (rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "INSERT INTO service_fts (service_fts) VALUES ('rebuild')",
+
+    "CREATE VIRTUAL TABLE IF NOT EXISTS service_req_fts USING fts5("
+    "remarks, content='service_req', content_rowid='id', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS service_req_fts_insert AFTER INSERT ON service_req BEGIN "
+    "INSERT INTO service_req_fts (rowid, remarks) VALUES (new.id, new.remarks); END",
+    "CREATE TRIGGER IF NOT EXISTS service_req_fts_delete AFTER DELETE ON service_req BEGIN "
+    "INSERT INTO service_req_fts (service_req_fts, rowid, remarks) VALUES ('delete', old.id, old.remarks); END",
+    "CREATE TRIGGER IF NOT EXISTS service_req_fts_update AFTER UPDATE OF remarks ON service_req BEGIN "
+    "INSERT INTO service_req_fts (service_req_fts, rowid, remarks) VALUES ('delete', old.id, old.remarks); "
+    "INSERT INTO service_req_fts (rowid, remarks) VALUES (new.id, new.remarks); END",
+    "INSERT INTO service_req_fts (service_req_fts) VALUES ('rebuild')",
+)
+
+
+def create(conn):
+    for statement in SCHEMA:
+        conn.exec_driver_sql(statement)
+
+
+def match_expression(term):
+    """
+    Turn free text into an FTS5 query where every word is a prefix match,
+    e.g. 'deep clean' -> '"deep"* "clean"*'. Returns None when there is
+    nothing to search for.
+    """
+    tokens = TOKEN.findall(term or '')
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def _hits(table, weights, match):
+    # bm25 is lower for better matches
+    return text(
+        f"SELECT rowid AS id, bm25({table}, {weights}) AS rank FROM {table} WHERE {table} MATCH :match"
+    ).bindparams(bindparam('match', match, unique=True)).columns(id=Integer, rank=Float).subquery()
+
+
+def service_matches(match):
+    """
+    (id, rank) of the services whose name or description match
+    """
+    return _hits('service_fts', '10.0, 1.0', match)
+
+
+def service_request_matches(match):
+    """
+    (id, rank) of the service requests whose remarks match, plus the requests
+    for a matching service (ranked after every remarks match)
+    """
+    by_remarks = _hits('service_req_fts', '1.0', match)
+    by_service = select(Service_req.id, cast(null(), Float).label('rank')).where(
+        Service_req.service_id.in_(select(service_matches(match).c.id))
+    )
+    hits = union_all(select(by_remarks.c.id, by_remarks.c.rank), by_service).subquery()
+    return select(hits.c.id, func.min(hits.c.rank).label('rank')).group_by(hits.c.id).subquery()
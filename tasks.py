@@ -1,66 +1,271 @@
-from mail_service import send_message
-from celery import shared_task
-from models import User, Service_req, db
-from jinja2 import Template
-from datetime import datetime
+from mail_service import send_messages
+from celery import chord, shared_task
+from flask import current_app
+from models import User, Role, Service, Service_req, ReportChunk, ReportDelivery, MonthlyActivity, db
+from sqlalchemy import func, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import joinedload
+import email_templates
+import cascade
+import events
+import reminders
+from database import read_session
+from datetime import datetime, timedelta
+import json
 import logging
 
 logger = logging.getLogger(__name__)
 
+def describe_age(delta):
+    if delta.days >= 1:
+        return f"{delta.days} day{'s' if delta.days != 1 else ''}"
+    hours = delta.seconds // 3600
+    return f"{hours} hour{'s' if hours != 1 else ''}"
+
+
 @shared_task(ignore_result=True)
 def send_daily_reminders():
     try:
-        professionals = User.query.join(User.roles).filter_by(name='serv').all()
-        for professional in professionals:
-            pending_requests = Service_req.query.filter_by(
-                professional_id=professional.id, service_status='requested'
-            ).all()
-            if pending_requests:
-                with open('daily_reminder.html', 'r') as f:
-                    template = Template(f.read())
-                send_message(
-                    professional.email,
-                    "Daily Reminder: Pending Service Requests",
-                    template.render(name=professional.username)
+        # Only requests created or changed since the last run, each reminded once (see reminders.py)
+        # the email reports everything pending (totals), not only what is new
+        due, totals, token = reminders.claim_due()
+
+        now = datetime.utcnow()
+        # (professional id, message) pairs, all sent over one pooled connection
+        batch = []
+        for professional_id, rows in due.items():
+            professional = rows[0]
+            pending_count, oldest = totals[professional_id]
+            batch.append((professional_id, (
+                professional.email,
+                "Daily Reminder: Pending Service Requests",
+                email_templates.render(
+                    'daily_reminder.html',
+                    name=professional.username,
+                    pending_count=pending_count,
+                    oldest_age=describe_age(now - oldest),
                 )
-                logger.info(f"Reminder sent to {professional.email}")
+            )))
+        failed_indices = []
+        send_messages([message for professional_id, message in batch], failed_indices)
+        failed_indices = set(failed_indices)
+        sent = [professional_id for i, (professional_id, message) in enumerate(batch) if i not in failed_indices]
+        failed = [professional_id for i, (professional_id, message) in enumerate(batch) if i in failed_indices]
+        reminders.finish(token, sent, 'sent')
+        reminders.finish(token, failed, 'failed')
+        logger.info(f"Daily reminders sent to {len(sent)} of {len(due)} professionals")
     except Exception as e:
         logger.error(f"Error in send_daily_reminders: {e}")
 
 
+# customers per chunk task
+REPORT_CHUNK_SIZE = 500
+# a dispatched chunk, or a sending chunk that made no progress, for this long is assumed lost and dispatched again
+REPORT_CHUNK_TIMEOUT = timedelta(minutes=30)
+# reports sent between two progress records of a chunk
+REPORT_SEND_BATCH = 50
+
+
+def report_period_start():
+    # first day of the current month
+    return datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def plan_report_chunks(period):
+    """
+    Split the customers into id ranges once per period; later runs reuse the plan
+    """
+    chunks = ReportChunk.query.filter_by(period=period).order_by(ReportChunk.first_customer_id).all()
+    if chunks:
+        return chunks
+
+    last_id = 0
+    while True:
+        ids = [id for (id,) in db.session.query(User.id)
+               .filter(User.id > last_id, User.roles.any(Role.name == 'cust'))
+               .order_by(User.id)
+               .limit(REPORT_CHUNK_SIZE)]
+        if not ids:
+            break
+        chunks.append(ReportChunk(period=period, first_customer_id=ids[0], last_customer_id=ids[-1]))
+        last_id = ids[-1]
+    db.session.add_all(chunks)
+    db.session.commit()
+    return chunks
+
+
+def load_monthly_activity(period, customer_ids):
+    """
+    {customer_id: (requested requests, closed requests)} for the period, read
+    from the monthly_activity rollups with one query for all the requests
+    """
+    activity = read_session.query(MonthlyActivity).filter(
+        MonthlyActivity.month == period, MonthlyActivity.customer_id.in_(customer_ids)
+    ).all()
+    ids = {customer.customer_id: (json.loads(customer.requested_ids), json.loads(customer.closed_ids)) for customer in activity}
+    wanted = {id for requested, closed in ids.values() for id in requested + closed}
+    requests = {
+        req.id: req for req in read_session.query(Service_req)
+        .options(joinedload(Service_req.service).load_only(Service.name))
+        .filter(Service_req.id.in_(wanted))
+    } if wanted else {}
+    return {
+        customer_id: ([requests[id] for id in requested if id in requests], [requests[id] for id in closed if id in requests])
+        for customer_id, (requested, closed) in ids.items()
+    }
+
+
 @shared_task(ignore_result=True)
 def send_monthly_reports():
+    """
+    Coordinator: plans the period's customer chunks and fans the unfinished
+    ones out to the workers, with summarize_monthly_reports run at the end
+    """
     try:
-        customers = User.query.join(User.roles).filter_by(name='cust').all()
-        for customer in customers:
-            past_month = datetime.utcnow().replace(day=1)  # Get the first day of the current month
-            services_requested = Service_req.query.filter(
-                Service_req.customer_id == customer.id,
-                Service_req.date_of_request >= past_month
-            ).all()
-            services_closed = Service_req.query.filter(
-                Service_req.customer_id == customer.id,
-                Service_req.date_of_completion >= past_month,
-                Service_req.service_status == "completed"
-            ).all()
-            
-            # Load the monthly report template
-            with open('monthly_report.html', 'r') as f:
-                template = Template(f.read())
-            
-            # Render HTML content for the report
-            report_content = template.render(
-                name=customer.username,
-                requested_services=services_requested,
-                closed_services=services_closed
-            )
-            
-            # Send the report via email
-            send_message(
-                customer.email,
-                "Monthly Activity Report",
-                report_content
-            )
-            logger.info(f"Monthly report sent to {customer.email}")
+        period = report_period_start().strftime('%Y-%m')
+        now = datetime.utcnow()
+        chunks = [
+            chunk for chunk in plan_report_chunks(period)
+            if chunk.status == 'pending'
+            or (chunk.status in ('dispatched', 'sending') and chunk.updated_at < now - REPORT_CHUNK_TIMEOUT)
+        ]
+        if not chunks:
+            logger.info(f"Monthly reports for {period}: every chunk already sent")
+            return
+
+        for chunk in chunks:
+            chunk.status = 'dispatched'
+            chunk.updated_at = now
+        db.session.commit()
+
+        chord(send_monthly_report_chunk.s(chunk.id) for chunk in chunks)(summarize_monthly_reports.s(period))
+        logger.info(f"Monthly reports for {period}: dispatched {len(chunks)} chunks")
     except Exception as e:
         logger.error(f"Error in send_monthly_reports: {e}")
+
+
+def hold_report_chunk(chunk_id, seen_status, seen_updated_at, **values):
+    """
+    Set the chunk to 'sending' (or values) only if it still has the status
+    and updated_at this worker saw, so one worker at a time sends it.
+    Returns the new updated_at, or None if another run took the chunk.
+    """
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        held = conn.execute(
+            update(ReportChunk)
+            .where(ReportChunk.id == chunk_id, ReportChunk.status == seen_status, ReportChunk.updated_at == seen_updated_at)
+            .values(**{'status': 'sending', **values, 'updated_at': now})
+        ).rowcount
+    return now if held else None
+
+
+def record_deliveries(period, customer_ids):
+    if customer_ids:
+        with db.engine.begin() as conn:
+            conn.execute(insert(ReportDelivery).on_conflict_do_nothing(), [
+                {'period': period, 'customer_id': customer_id, 'sent_at': datetime.utcnow()} for customer_id in customer_ids
+            ])
+
+
+@shared_task
+def send_monthly_report_chunk(chunk_id):
+    chunk = db.session.get(ReportChunk, chunk_id)
+    if chunk is None:
+        # pruned or never committed; report nothing so the chord still summarizes
+        logger.warning(f"Monthly report chunk {chunk_id} not found, skipping")
+        return {'chunk_id': chunk_id, 'sent': 0, 'failed': 0}
+    if chunk.status == 'done':
+        return {'chunk_id': chunk.id, 'sent': chunk.sent, 'failed': chunk.failed}
+    period, first_customer_id, last_customer_id = chunk.period, chunk.first_customer_id, chunk.last_customer_id
+    held = hold_report_chunk(chunk_id, 'dispatched', chunk.updated_at) if chunk.status == 'dispatched' else None
+    db.session.rollback()
+    if held is None:
+        logger.info(f"Monthly report chunk {chunk_id} is being sent by another worker, skipping")
+        return {'chunk_id': chunk_id, 'sent': 0, 'failed': 0}
+
+    in_chunk = (ReportDelivery.period == period,
+                ReportDelivery.customer_id.between(first_customer_id, last_customer_id))
+    # customers an earlier, interrupted attempt already sent the report to
+    delivered = {customer_id for (customer_id,) in read_session.query(ReportDelivery.customer_id).filter(*in_chunk)}
+    customers = [customer for customer in read_session.query(User).filter(
+        User.id.between(first_customer_id, last_customer_id),
+        User.roles.any(Role.name == 'cust')
+    ).order_by(User.id) if customer.id not in delivered]
+    activity = load_monthly_activity(period, [customer.id for customer in customers])
+
+    # (customer id, message) pairs
+    reports = []
+    sent = failed = 0
+    for customer in customers:
+        try:
+            requested, closed = activity.get(customer.id, ([], []))
+            content = email_templates.render(
+                'monthly_report.html', name=customer.username, requested_services=requested, closed_services=closed
+            )
+            reports.append((customer.id, (customer.email, "Monthly Activity Report", content)))
+        except Exception as e:
+            failed += 1
+            logger.error(f"Failed to build monthly report for {customer.email}: {e}")
+
+    for start in range(0, len(reports), REPORT_SEND_BATCH):
+        batch = reports[start:start + REPORT_SEND_BATCH]
+        failed_indices = []
+        send_messages([message for customer_id, message in batch], failed_indices)
+        failed_indices = set(failed_indices)
+        sent += len(batch) - len(failed_indices)
+        failed += len(failed_indices)
+        record_deliveries(period, [customer_id for i, (customer_id, message) in enumerate(batch) if i not in failed_indices])
+        # progress keeps the chunk from looking lost while a long chunk is sent
+        held = hold_report_chunk(chunk_id, 'sending', held)
+        if held is None:
+            logger.warning(f"Monthly report chunk {chunk_id} was dispatched again, stopping")
+            return {'chunk_id': chunk_id, 'sent': sent, 'failed': failed}
+
+    # the chunk's total includes the reports earlier attempts sent
+    total_sent = read_session.query(func.count()).select_from(ReportDelivery).filter(*in_chunk).scalar()
+    read_session.remove()
+    hold_report_chunk(chunk_id, 'sending', held, status='done', sent=total_sent, failed=failed)
+    logger.info(f"Monthly report chunk {chunk_id}: {sent} sent, {failed} failed, {total_sent} sent in all")
+    return {'chunk_id': chunk_id, 'sent': sent, 'failed': failed}
+
+
+@shared_task(ignore_result=True)
+def summarize_monthly_reports(results, period):
+    sent = sum(result['sent'] for result in results)
+    failed = sum(result['failed'] for result in results)
+    total_sent, total_failed = db.session.query(
+        func.coalesce(func.sum(ReportChunk.sent), 0), func.coalesce(func.sum(ReportChunk.failed), 0)
+    ).filter_by(period=period, status='done').one()
+    remaining = ReportChunk.query.filter(ReportChunk.period == period, ReportChunk.status != 'done').count()
+    logger.info(
+        f"Monthly reports for {period}: this run sent {sent} and failed {failed} in {len(results)} chunks; "
+        f"period total {total_sent} sent, {total_failed} failed, {remaining} chunks left"
+    )
+
+
+def _run_cascade(task, cascade, label):
+    done = total = 0
+    for done, total in cascade:
+        task.update_state(state='PROGRESS', meta={'done': done, 'total': total})
+    logger.info(f"{label}: {done} dependent rows handled")
+    return {'done': done, 'total': total}
+
+
+@shared_task(bind=True)
+def delete_service_cascade(self, service_id):
+    return _run_cascade(self, cascade.delete_service(service_id), f"Deleted service {service_id}")
+
+
+@shared_task(bind=True)
+def delete_professional_cascade(self, user_id):
+    return _run_cascade(self, cascade.delete_professional(user_id), f"Deleted professional {user_id}")
+
+
+@shared_task(ignore_result=True)
+def prune_service_req_events():
+    # clients that fall further behind than this get a reset event and reload
+    before = datetime.utcnow() - timedelta(days=current_app.config['EVENT_RETENTION_DAYS'])
+    with db.engine.begin() as conn:
+        pruned = events.prune(conn, before)
+    logger.info(f"Pruned {pruned} service request events older than {before:%Y-%m-%d %H:%M}")
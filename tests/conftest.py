@@ -0,0 +1,109 @@
+"""
+Shared fixtures. The app is created once per test session by importing
+main; create_app reads the FLASK_* overrides below from the environment,
+so it runs against a temporary SQLite database and SimpleCache, with
+TESTING on (query budgets raise instead of warning).
+
+Tests share the database: the helpers create users with unique emails and
+tests only assert on the rows they created.
+"""
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_database_dir = tempfile.mkdtemp(prefix='household-tests-')
+os.environ['FLASK_SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(_database_dir, 'data.db')}"
+os.environ['FLASK_CACHE_TYPE'] = 'SimpleCache'
+os.environ['FLASK_DEBUG'] = 'false'
+os.environ['FLASK_TESTING'] = 'true'
+
+_unique = itertools.count(1)
+
+
+@pytest.fixture(scope='session')
+def app():
+    import main
+    yield main.app
+    shutil.rmtree(_database_dir, ignore_errors=True)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(app):
+    def make(role, **kwargs):
+        from extensions import db
+        from flask_security.utils import hash_password
+        n = next(_unique)
+        values = dict(username=f'{role} {n}', email=f'{role}{n}@example.com', active=True, pin='600001')
+        if role == 'serv':
+            values['service_type'] = 'Cleaning'
+        values.update(kwargs)
+        with app.app_context():
+            user = app.extensions['security'].datastore.create_user(
+                password=hash_password('pass'), roles=[role], **values
+            )
+            db.session.commit()
+            return user.id
+    return make
+
+
+@pytest.fixture
+def make_service(app):
+    def make(category='Cleaning', name=None, price=100):
+        from extensions import db
+        from models import Category, Service
+        with app.app_context():
+            category_row = Category.query.filter_by(name=category).first()
+            if category_row is None:
+                category_row = Category(name=category, description=f'{category} at home')
+                db.session.add(category_row)
+                db.session.flush()
+            service = Service(name=name or f'service {next(_unique)}', description='d', price=price,
+                              category_id=category_row.id)
+            db.session.add(service)
+            db.session.commit()
+            return service.id
+    return make
+
+
+@pytest.fixture
+def make_request(app):
+    def make(customer_id, service_id, professional_id=None, remarks='remark'):
+        from extensions import db
+        from models import Service_req
+        with app.app_context():
+            service_request = Service_req(customer_id=customer_id, service_id=service_id,
+                                          professional_id=professional_id, remarks=remarks)
+            db.session.add(service_request)
+            db.session.commit()
+            return service_request.id
+    return make
+
+
+@pytest.fixture
+def login(client):
+    def token(user_id):
+        from extensions import db
+        from models import User
+        with client.application.app_context():
+            email = db.session.get(User, user_id).email
+        response = client.post('/user-login', json={'email': email, 'password': 'pass'})
+        return {'Authentication-Token': response.get_json()['token']}
+    return token
+
+
+@pytest.fixture
+def admin_headers(app, login):
+    from models import User
+    with app.app_context():
+        admin_id = User.query.filter_by(email='admin@iitm.ac.in').one().id
+    return login(admin_id)
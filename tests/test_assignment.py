@@ -0,0 +1,90 @@
+"""
+The professional index (assignment.py) matches the database after backlog
+assignments and role changes.
+"""
+import itertools
+import pytest
+from sqlalchemy import select
+import assignment
+
+_pins = itertools.count(700001)
+
+
+@pytest.fixture
+def pin():
+    # customers and professionals of a pin of their own match nobody else's requests
+    return str(next(_pins))
+
+
+def index_matches_database():
+    loads = assignment.index.loads()
+    assignment.index.rebuild()
+    return loads == assignment.index.loads()
+
+
+def test_backlog_skips_requests_assigned_meanwhile(app, monkeypatch, make_user, make_service, make_request, pin):
+    from extensions import db
+    from models import Service_req, ServiceReqEvent
+    customer_id = make_user('cust', pin=pin)
+    professional_id = make_user('serv', pin=pin)
+    other_professional_id = make_user('serv', pin=pin, service_type='Painting')
+    service_id = make_service(category='Cleaning')
+    taken, free = make_request(customer_id, service_id), make_request(customer_id, service_id)
+    with app.app_context():
+        assignment.index.rebuild()
+
+    plan = assignment.index.assign_many
+
+    def assign_by_hand_meanwhile(requests):
+        planned = plan(requests)
+        # an admin assigns one of the planned requests before the backlog UPDATE runs
+        with app.app_context():
+            db.session.get(Service_req, taken).professional_id = other_professional_id
+            db.session.commit()
+        return planned
+    monkeypatch.setattr(assignment.index, 'assign_many', assign_by_hand_meanwhile)
+
+    with app.app_context():
+        assigned, unmatched = assignment.assign_backlog()
+        mine = [row for row in assigned if row[0] in (taken, free)]
+        assert mine == [(free, professional_id, customer_id)]
+        assert db.session.get(Service_req, taken).professional_id == other_professional_id
+        assigned_events = db.session.execute(
+            select(ServiceReqEvent.service_req_id, ServiceReqEvent.professional_id)
+            .where(ServiceReqEvent.kind == 'assigned', ServiceReqEvent.service_req_id.in_([taken, free]))
+        ).all()
+        assert sorted(assigned_events) == sorted([(taken, other_professional_id), (free, professional_id)])
+        assert assignment.index.loads()[professional_id] == 1
+        assert index_matches_database()
+
+
+def test_professional_losing_role_leaves_index(app, make_user, pin):
+    from extensions import db
+    from models import User
+    professional_id = make_user('serv', pin=pin)
+    with app.app_context():
+        assignment.index.rebuild()
+        assert assignment.index.pick('Cleaning', pin) == professional_id
+
+        datastore = app.extensions['security'].datastore
+        datastore.remove_role_from_user(db.session.get(User, professional_id), 'serv')
+        db.session.commit()
+        assert assignment.index.pick('Cleaning', pin) is None
+        assert professional_id not in assignment.index.loads()
+        assert index_matches_database()
+
+
+def test_request_reassigned_then_deleted_in_one_session(app, make_user, make_service, make_request, pin):
+    from extensions import db
+    from models import Service_req
+    customer_id = make_user('cust', pin=pin)
+    professional_id, other_professional_id = make_user('serv', pin=pin), make_user('serv', pin=pin)
+    request_id = make_request(customer_id, make_service(), professional_id=professional_id)
+    with app.app_context():
+        assignment.index.rebuild()
+        service_request = db.session.get(Service_req, request_id)
+        service_request.professional_id = other_professional_id
+        db.session.delete(service_request)
+        db.session.commit()
+        assert assignment.index.loads()[professional_id] == 0
+        assert index_matches_database()
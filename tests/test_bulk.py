@@ -0,0 +1,77 @@
+"""
+Bulk imports (bulk.py) through POST /api/bulk/<kind>.
+"""
+import itertools
+from sqlalchemy import select
+from extensions import db
+from models import Service_req, ServiceReqEvent
+
+_explicit_ids = itertools.count(900001)
+
+
+def import_csv(client, headers, kind, body):
+    return client.post(f'/api/bulk/{kind}', data=body, content_type='text/csv', headers=headers)
+
+
+def test_empty_cells_get_defaults(app, client, admin_headers, make_user, make_service):
+    customer_id, service_id = make_user('cust'), make_service()
+    body = (
+        'customer_id,professional_id,service_id,date_of_request,service_status,remarks\n'
+        f'{customer_id},,{service_id},,,\n'
+        f',,{service_id},,closed,\n'
+    )
+    report = import_csv(client, admin_headers, 'service_requests', body.encode()).get_json()
+    assert report['inserted'] == 1
+    assert report['errors'] == [{'line': 3, 'errors': {
+        'customer_id': 'is required', 'date_of_completion': "is required when service_status is 'closed'",
+    }}]
+    with app.app_context():
+        imported = db.session.execute(
+            select(Service_req).where(Service_req.customer_id == customer_id)
+        ).scalar_one()
+        assert (imported.service_status, imported.remarks) == ('requested', 'No remarks')
+        assert imported.professional_id is None and imported.date_of_request is not None
+
+
+def test_invalid_utf8_rejected_before_import(app, client, admin_headers, make_user, make_service):
+    customer_id, service_id = make_user('cust'), make_service()
+    body = (
+        'customer_id,service_id,remarks\n'
+        f'{customer_id},{service_id},fine\n'
+    ).encode() + f'{customer_id},{service_id},caf'.encode() + b'\xe9\n'
+    response = import_csv(client, admin_headers, 'service_requests', body)
+    assert response.status_code == 400
+    assert 'line 3' in response.get_json()['message']
+    with app.app_context():
+        assert not db.session.execute(select(Service_req.id).where(Service_req.customer_id == customer_id)).all()
+
+
+def test_created_events_for_returned_ids(app, client, admin_headers, make_user, make_service):
+    customer_id, service_id = make_user('cust'), make_service()
+    explicit_id = next(_explicit_ids)
+    body = (
+        'id,customer_id,service_id\n'
+        f',{customer_id},{service_id}\n'
+        f'{explicit_id},{customer_id},{service_id}\n'
+        f',{customer_id},{service_id}\n'
+    )
+    assert import_csv(client, admin_headers, 'service_requests', body.encode()).get_json()['inserted'] == 3
+    with app.app_context():
+        ids = set(db.session.execute(select(Service_req.id).where(Service_req.customer_id == customer_id)).scalars())
+        assert explicit_id in ids and len(ids) == 3
+        created = db.session.execute(
+            select(ServiceReqEvent.service_req_id).where(ServiceReqEvent.kind == 'created', ServiceReqEvent.customer_id == customer_id)
+        ).scalars().all()
+        assert sorted(created) == sorted(ids)
+
+
+def test_closed_request_needs_completion_date(app, client, admin_headers, make_user, make_service):
+    customer_id, service_id = make_user('cust'), make_service()
+    body = (
+        'customer_id,service_id,service_status,date_of_completion\n'
+        f'{customer_id},{service_id},closed,\n'
+        f'{customer_id},{service_id},closed,2024-05-02T10:00:00\n'
+    )
+    report = import_csv(client, admin_headers, 'service_requests', body.encode()).get_json()
+    assert report['inserted'] == 1
+    assert report['errors'] == [{'line': 2, 'errors': {'date_of_completion': "is required when service_status is 'closed'"}}]
@@ -0,0 +1,79 @@
+"""
+Deleting a service professional through DELETE /api/service_pro/<id> and a
+service through DELETE /api/services/<id>.
+"""
+from sqlalchemy import update
+from extensions import db
+from models import User, Service, Service_req
+import cascade
+import principal_cache
+
+
+def status(client, headers):
+    return client.get('/api/service_requests', headers=dict(headers, Accept='application/json')).status_code
+
+
+def exists(app, model, id):
+    with app.app_context():
+        return db.session.get(model, id) is not None
+
+
+def test_customer_cannot_delete_professional(app, client, login, make_user, make_service, make_request):
+    customer_id, professional_id = make_user('cust'), make_user('serv')
+    request_id = make_request(customer_id, make_service(), professional_id=professional_id)
+    response = client.delete(f'/api/service_pro/{professional_id}', headers=login(customer_id))
+    assert response.status_code == 403
+    assert exists(app, User, professional_id) and exists(app, Service_req, request_id)
+
+
+def test_customer_cannot_delete_service(app, client, login, make_user, make_service, make_request):
+    customer_id, service_id = make_user('cust'), make_service()
+    request_id = make_request(customer_id, service_id)
+    response = client.delete(f'/api/services/{service_id}', headers=login(customer_id))
+    assert response.status_code == 403
+    assert exists(app, Service, service_id) and exists(app, Service_req, request_id)
+
+
+def test_only_professionals_are_deleted(app, client, admin_headers, make_user):
+    customer_id = make_user('cust')
+    response = client.delete(f'/api/service_pro/{customer_id}', headers=admin_headers)
+    assert response.status_code == 404
+    assert exists(app, User, customer_id)
+
+
+def test_admin_deletes_professional(app, client, admin_headers, make_user, make_service, make_request):
+    customer_id, professional_id = make_user('cust'), make_user('serv')
+    request_id = make_request(customer_id, make_service(), professional_id=professional_id)
+    response = client.delete(f'/api/service_pro/{professional_id}', headers=admin_headers)
+    assert response.status_code == 200
+    assert not exists(app, User, professional_id)
+    # the customer's request stays, waiting for another professional
+    with app.app_context():
+        service_request = db.session.get(Service_req, request_id)
+        assert (service_request.professional_id, service_request.service_status) == (None, 'requested')
+
+
+def test_professional_rejected_while_cascade_runs(app, client, login, make_user, make_service, make_request):
+    customer_id, professional_id = make_user('cust'), make_user('serv')
+    make_request(customer_id, make_service(), professional_id=professional_id)
+    headers = login(professional_id)
+    # the professional's principal is now cached
+    assert status(client, headers) == 200
+
+    with app.app_context():
+        steps = cascade.delete_professional(professional_id)
+        next(steps)
+        assert status(client, headers) == 401
+        cascade.run(steps)
+    assert status(client, headers) == 401
+
+
+def test_evict_users_after_core_update(app, client, login, make_user):
+    customer_id = make_user('cust')
+    headers = login(customer_id)
+    assert status(client, headers) == 200
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(update(User).where(User.id == customer_id).values(active=False))
+        principal_cache.evict_users([customer_id])
+    assert status(client, headers) == 401
@@ -0,0 +1,48 @@
+"""
+Catalog snapshots (catalog.py): compressed representations negotiated by
+Accept-Encoding, ETags answered with 304 and a new version after a write.
+"""
+import gzip
+import itertools
+import json
+import pytest
+
+_names = itertools.count(1)
+
+
+def get(client, path, headers=None, **extra):
+    return client.get(path, headers=dict(headers or {}, **extra))
+
+
+def test_gzip_matches_the_identity_body(client, login, make_user):
+    headers = login(make_user('cust'))
+    plain = get(client, '/api/services', headers)
+    assert plain.status_code == 200 and 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    zipped = get(client, '/api/services', headers, **{'Accept-Encoding': 'gzip'})
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(zipped.data)) == plain.get_json()
+    # each representation has its own validator
+    assert zipped.headers['ETag'] != plain.headers['ETag']
+
+
+def test_brotli_preferred_when_installed(client):
+    brotli = pytest.importorskip('brotli')
+    response = get(client, '/api/service_types', **{'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert json.loads(brotli.decompress(response.data)) == get(client, '/api/service_types').get_json()
+
+
+def test_not_modified_until_a_write(client):
+    etag = get(client, '/api/categories').headers['ETag']
+    assert get(client, '/api/categories', **{'If-None-Match': etag}).status_code == 304
+    # the validator of another representation of the same version matches too
+    zipped_etag = get(client, '/api/categories', **{'Accept-Encoding': 'gzip'}).headers['ETag']
+    assert get(client, '/api/categories', **{'If-None-Match': zipped_etag}).status_code == 304
+
+    name = f'Catalog test {next(_names)}'
+    assert client.post('/api/categories', json={'name': name, 'description': 'd'}).status_code == 201
+    response = get(client, '/api/categories', **{'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+    assert name in [category['name'] for category in response.get_json()]
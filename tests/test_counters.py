@@ -0,0 +1,95 @@
+"""
+The admin summary counters (counters.py) stay in line with the base tables
+as feedback and service requests are added, edited and deleted.
+"""
+import pytest
+from extensions import db
+from models import Feedback, Service_req
+import counters
+
+
+@pytest.fixture
+def consistent(app):
+    # no rebuild: drift left behind by any earlier test fails here instead of being wiped out
+    def check():
+        with app.app_context():
+            with db.engine.connect() as conn:
+                return counters.drift(conn)
+    assert check() == {}
+    yield check
+    assert check() == {}
+
+
+def add_feedback(app, customer_id, service_id, rating):
+    with app.app_context():
+        feedback = Feedback(customer_id=customer_id, service_id=service_id, rating=rating)
+        db.session.add(feedback)
+        db.session.commit()
+        return feedback.id
+
+
+def test_feedback_added_edited_and_deleted(app, consistent, make_user, make_service):
+    customer_id, service_id, other_service_id = make_user('cust'), make_service(), make_service()
+    feedback_id = add_feedback(app, customer_id, service_id, 5)
+    assert consistent() == {}
+
+    with app.app_context():
+        feedback = db.session.get(Feedback, feedback_id)
+        feedback.rating, feedback.service_id = 2, other_service_id
+        db.session.commit()
+    assert consistent() == {}
+
+    with app.app_context():
+        db.session.delete(db.session.get(Feedback, feedback_id))
+        db.session.commit()
+    assert consistent() == {}
+
+
+def test_feedback_edited_then_deleted_in_one_session(app, consistent, make_user, make_service):
+    customer_id, service_id, other_service_id = make_user('cust'), make_service(), make_service()
+    feedback_id = add_feedback(app, customer_id, service_id, 4)
+    with app.app_context():
+        feedback = db.session.get(Feedback, feedback_id)
+        feedback.rating, feedback.service_id = 1, other_service_id
+        db.session.delete(feedback)
+        db.session.commit()
+    assert consistent() == {}
+
+
+def test_feedback_changed_without_loading_then_deleted(app, consistent, make_user, make_service):
+    customer_id, service_id = make_user('cust'), make_service()
+    feedback_id = add_feedback(app, customer_id, service_id, 3)
+    with app.app_context():
+        feedback = db.session.get(Feedback, feedback_id)
+        # the old rating was never loaded into the session
+        db.session.expire(feedback, ['rating'])
+        feedback.rating = 5
+        db.session.delete(feedback)
+        db.session.commit()
+    assert consistent() == {}
+
+
+def test_request_edited_then_deleted_in_one_session(app, consistent, make_user, make_service, make_request):
+    customer_id, service_id, other_service_id = make_user('cust'), make_service(), make_service()
+    request_id = make_request(customer_id, service_id)
+    with app.app_context():
+        service_request = db.session.get(Service_req, request_id)
+        service_request.service_status, service_request.service_id = 'closed', other_service_id
+        db.session.delete(service_request)
+        db.session.commit()
+    assert consistent() == {}
+
+
+def test_professional_role_removed_and_added(app, consistent, make_user):
+    from models import User
+    professional_id = make_user('serv')
+    datastore = app.extensions['security'].datastore
+    with app.app_context():
+        datastore.remove_role_from_user(db.session.get(User, professional_id), 'serv')
+        db.session.commit()
+    assert consistent() == {}
+
+    with app.app_context():
+        datastore.add_role_to_user(db.session.get(User, professional_id), 'serv')
+        db.session.commit()
+    assert consistent() == {}
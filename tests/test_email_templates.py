@@ -0,0 +1,52 @@
+"""
+The shared Jinja environment (email_templates.py) compiles each template
+once, writes the bytecode cache and only reloads templates in debug.
+"""
+import os
+import pytest
+import email_templates
+
+
+@pytest.fixture
+def fresh_environment(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(email_templates, '_environment', None)
+    monkeypatch.setitem(app.config, 'EMAIL_TEMPLATE_CACHE_DIR', str(tmp_path))
+
+    def create():
+        monkeypatch.setattr(email_templates, '_environment', None)
+        with app.app_context():
+            environment = email_templates.environment()
+        compiled = []
+        compile = environment.compile
+
+        def counting_compile(source, name=None, *args, **kwargs):
+            compiled.append(name)
+            return compile(source, name, *args, **kwargs)
+        monkeypatch.setattr(environment, 'compile', counting_compile)
+        return environment, compiled
+    return create
+
+
+def render_reminder():
+    return email_templates.render('daily_reminder.html', name='pro', pending_count=1, oldest_age='2 hours')
+
+
+def test_compiled_once_and_cached_as_bytecode(app, tmp_path, fresh_environment):
+    environment, compiled = fresh_environment()
+    assert email_templates.environment() is environment
+    render_reminder()
+    render_reminder()
+    assert compiled == ['daily_reminder.html']
+    assert os.listdir(tmp_path)
+
+    # a new process loads the bytecode instead of compiling
+    environment, compiled = fresh_environment()
+    render_reminder()
+    assert compiled == []
+
+
+@pytest.mark.parametrize('debug', [False, True])
+def test_auto_reload_only_in_debug(app, monkeypatch, fresh_environment, debug):
+    monkeypatch.setitem(app.config, 'DEBUG', debug)
+    environment, _ = fresh_environment()
+    assert environment.auto_reload is debug
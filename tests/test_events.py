@@ -0,0 +1,147 @@
+"""
+The service request change feed (events.py) over the in-process broker:
+event order, what each role sees, resuming from Last-Event-ID and the
+reset event once the events a client missed were pruned.
+"""
+from datetime import datetime, timedelta
+import json
+import pytest
+from sqlalchemy import func, update
+import events
+
+
+@pytest.fixture(autouse=True)
+def short_streams(app, monkeypatch):
+    # streams end quickly so the test client can read the whole body
+    monkeypatch.setitem(app.config, 'EVENT_STREAM_MAX_SECONDS', 0.3)
+    monkeypatch.setitem(app.config, 'EVENT_HEARTBEAT_SECONDS', 0.1)
+    monkeypatch.setattr(events, 'broker', events.MemoryBroker())
+
+
+@pytest.fixture
+def newest_event_id(app):
+    def newest():
+        from extensions import db
+        from models import ServiceReqEvent
+        with app.app_context():
+            return db.session.query(func.max(ServiceReqEvent.id)).scalar() or 0
+    return newest
+
+
+def read_events(client, headers, last_event_id):
+    """
+    [(event name, data)] sent by one stream resumed after last_event_id
+    """
+    response = client.get('/api/service_requests/events', headers=dict(headers, **{'Last-Event-ID': str(last_event_id)}))
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    sent = []
+    for block in response.get_data(as_text=True).split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.splitlines() if line and not line.startswith(':'))
+        if 'event' in lines:
+            sent.append((lines['event'], json.loads(lines['data'])))
+    return sent
+
+
+def update_request(app, service_request_id, **values):
+    from extensions import db
+    from models import Service_req
+    with app.app_context():
+        service_request = db.session.get(Service_req, service_request_id)
+        for name, value in values.items():
+            setattr(service_request, name, value)
+        db.session.commit()
+
+
+def test_memory_broker_wakes_subscribers():
+    broker = events.MemoryBroker()
+    subscription = broker.subscribe()
+    assert not subscription.wait(0)
+    broker.publish()
+    broker.publish()
+    # a burst is one wakeup
+    assert subscription.wait(0)
+    assert not subscription.wait(0)
+
+
+def test_events_in_order(app, client, admin_headers, make_user, make_service, make_request, newest_event_id):
+    customer_id, professional_id = make_user('cust'), make_user('serv')
+    start = newest_event_id()
+    service_request_id = make_request(customer_id, make_service())
+    update_request(app, service_request_id, professional_id=professional_id)
+    update_request(app, service_request_id, service_status='accepted')
+
+    sent = [(name, data) for name, data in read_events(client, admin_headers, start)
+            if data['service_request_id'] == service_request_id]
+    assert [name for name, data in sent] == ['created', 'assigned', 'status']
+    ids = [data['id'] for name, data in sent]
+    assert ids == sorted(ids)
+    created, assigned, status = (data for name, data in sent)
+    assert created['professional_id'] is None and created['status'] == 'requested'
+    assert assigned['professional_id'] == professional_id and assigned['previous_professional_id'] is None
+    assert status['status'] == 'accepted' and status['customer_id'] == customer_id
+
+
+def test_events_scoped_by_role(app, client, login, admin_headers, make_user, make_service, make_request,
+                               newest_event_id):
+    customer_id, other_customer_id = make_user('cust'), make_user('cust')
+    professional_id, other_professional_id = make_user('serv'), make_user('serv')
+    service_id = make_service()
+    start = newest_event_id()
+    own = make_request(customer_id, service_id, professional_id=professional_id)
+    unassigned = make_request(other_customer_id, service_id)
+    elsewhere = make_request(other_customer_id, service_id, professional_id=other_professional_id)
+    mine = {own, unassigned, elsewhere}
+
+    def seen(headers):
+        return {data['service_request_id'] for name, data in read_events(client, headers, start)} & mine
+
+    assert seen(admin_headers) == mine
+    # professionals see every request, like GET /api/service_requests
+    assert seen(login(professional_id)) == mine
+    assert seen(login(customer_id)) == {own}
+    assert seen(login(other_customer_id)) == {unassigned, elsewhere}
+
+
+def test_resume_after_last_event_id(app, client, admin_headers, make_user, make_service, make_request,
+                                    newest_event_id):
+    customer_id = make_user('cust')
+    service_id = make_service()
+    start = newest_event_id()
+    first = make_request(customer_id, service_id)
+    seen_up_to = newest_event_id()
+    second = make_request(customer_id, service_id)
+    third = make_request(customer_id, service_id)
+
+    everything = [data['service_request_id'] for name, data in read_events(client, admin_headers, start)]
+    assert everything == [first, second, third]
+    resumed = read_events(client, admin_headers, seen_up_to)
+    assert [data['service_request_id'] for name, data in resumed] == [second, third]
+    assert all(data['id'] > seen_up_to for name, data in resumed)
+    assert read_events(client, admin_headers, newest_event_id()) == []
+
+
+def test_reset_after_prune(app, client, admin_headers, make_user, make_service, make_request, newest_event_id):
+    from extensions import db
+    from models import ServiceReqEvent
+    import tasks
+    customer_id = make_user('cust')
+    service_id = make_service()
+    start = newest_event_id()
+    make_request(customer_id, service_id)
+    make_request(customer_id, service_id)
+    kept = make_request(customer_id, service_id)
+
+    # everything before the last request falls out of the retention window
+    with app.app_context():
+        kept_from = db.session.query(func.min(ServiceReqEvent.id)).filter_by(service_req_id=kept).scalar()
+        with db.engine.begin() as conn:
+            conn.execute(update(ServiceReqEvent).where(ServiceReqEvent.id < kept_from)
+                         .values(created_at=datetime.utcnow() - timedelta(days=30)))
+        tasks.prune_service_req_events()
+
+    sent = read_events(client, admin_headers, start)
+    assert sent[0] == ('reset', {})
+    assert [data['service_request_id'] for name, data in sent[1:]] == [kept]
+    # a client that is not behind the pruned events gets no reset
+    assert read_events(client, admin_headers, kept_from - 1)[0][0] == 'created'
@@ -0,0 +1,53 @@
+"""
+Top-k feedback per service (GET /api/feedbacks), one service's feedback
+and the rating aggregates read from service_stats.
+"""
+
+
+def rate(client, headers, service_id, *ratings):
+    ids = []
+    for rating in ratings:
+        response = client.post(f'/api/services/{service_id}/feedback', headers=headers, json={'rating': rating})
+        assert response.status_code == 201
+        ids.append(response.get_json()['feedback']['id'])
+    return ids
+
+
+def top_feedback(client, service_ids, **params):
+    response = client.get('/api/feedbacks', query_string=dict(limit=1000, **params))
+    assert response.status_code == 200
+    return [(row['service_id'], row['id']) for row in response.get_json() if row['service_id'] in service_ids]
+
+
+def test_top_k_per_service(client, login, make_user, make_service):
+    headers = login(make_user('cust'))
+    many, few = make_service(), make_service()
+    ids = rate(client, headers, many, 3, 5, 1, 5, 4, 2, 5)
+    few_ids = rate(client, headers, few, 2, 4)
+
+    # best rated first, the newest first among equal ratings
+    best = [ids[6], ids[3], ids[1], ids[4], ids[0], ids[5], ids[2]]
+    assert top_feedback(client, {many, few}, top=3) == [(many, id) for id in best[:3]] + [(few, few_ids[1]), (few, few_ids[0])]
+    assert top_feedback(client, {many, few}) == [(many, id) for id in best[:5]] + [(few, few_ids[1]), (few, few_ids[0])]
+
+
+def test_one_service_paged(client, login, make_user, make_service):
+    headers = login(make_user('cust'))
+    service_id = make_service()
+    ids = rate(client, headers, service_id, 1, 4, 2)
+    response = client.get(f'/api/services/{service_id}/feedback', query_string={'limit': 2, 'page': 2})
+    assert [row['id'] for row in response.get_json()] == [ids[0]]
+    assert response.headers['X-Total-Count'] == '3'
+
+
+def test_ratings(client, login, make_user, make_service):
+    headers = login(make_user('cust'))
+    service_id = make_service()
+    assert client.get(f'/api/services/{service_id}/ratings').get_json()['count'] == 0
+
+    rate(client, headers, service_id, 5, 4, 4)
+    assert client.get(f'/api/services/{service_id}/ratings').get_json() == {
+        'service_id': service_id, 'count': 3, 'average': 4.33,
+        'histogram': {'1': 0, '2': 0, '3': 0, '4': 2, '5': 1},
+    }
+    assert client.get('/api/services/999999/ratings').status_code == 404
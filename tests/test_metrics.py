@@ -0,0 +1,47 @@
+"""
+The request metrics (metrics.py) count requests that fail with an
+unhandled exception as 500s and report email template render times.
+"""
+from flask import Flask
+import pytest
+import metrics
+
+
+def failing_app(**config):
+    app = Flask(__name__)
+    app.config.update(config)
+    metrics.init_app(app)
+
+    @app.route('/boom')
+    def boom():
+        raise RuntimeError('boom')
+    return app
+
+
+def requests_total(endpoint, status):
+    sample = f'http_requests_total{{endpoint="{endpoint}",method="GET",status="{status}"}} '
+    for line in metrics.registry.render().splitlines():
+        if line.startswith(sample):
+            return int(line[len(sample):])
+    return 0
+
+
+@pytest.mark.parametrize('propagate', [True, False])
+def test_unhandled_exception_recorded_as_500(propagate):
+    before = requests_total('boom', 500)
+    client = failing_app(PROPAGATE_EXCEPTIONS=propagate).test_client()
+    if propagate:
+        with pytest.raises(RuntimeError):
+            client.get('/boom')
+    else:
+        assert client.get('/boom').status_code == 500
+    assert requests_total('boom', 500) == before + 1
+
+
+def test_template_render_times_exported():
+    import email_templates
+    # the context tasks.send_daily_reminders passes
+    content = email_templates.render('daily_reminder.html', name='pro', pending_count=2, oldest_age='3 days')
+    assert 'Hey pro,' in content and '2 pending service requests' in content and '3 days' in content
+    renders = email_templates.render_stats()['daily_reminder.html']['renders']
+    assert f'template_render_seconds_count{{template="daily_reminder.html"}} {renders}' in metrics.registry.render()
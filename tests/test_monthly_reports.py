@@ -0,0 +1,117 @@
+"""
+Monthly report chunks are sent by one worker at a time, and a chunk that
+runs again only sends to the customers that did not get the report yet.
+"""
+from datetime import datetime, timedelta
+import itertools
+import pytest
+import tasks
+
+_periods = itertools.count(1)
+
+
+@pytest.fixture
+def outbox(monkeypatch):
+    sent = []
+
+    def send_messages(messages, failed=None):
+        sent.extend(to for to, subject, body in messages)
+        return len(messages)
+    monkeypatch.setattr(tasks, 'send_messages', send_messages)
+    return sent
+
+
+@pytest.fixture
+def chunk(app, make_user):
+    """
+    A dispatched chunk of five new customers, in a period of its own
+    """
+    from extensions import db
+    from models import ReportChunk, User
+    customer_ids = [make_user('cust') for _ in range(5)]
+    with app.app_context():
+        chunk = ReportChunk(period=f'2099-{next(_periods):02d}', first_customer_id=customer_ids[0],
+                            last_customer_id=customer_ids[-1], status='dispatched', updated_at=datetime.utcnow())
+        db.session.add(chunk)
+        db.session.commit()
+        emails = [db.session.get(User, customer_id).email for customer_id in customer_ids]
+        return chunk.id, emails
+
+
+def chunk_row(app, chunk_id):
+    from extensions import db
+    from models import ReportChunk
+    with app.app_context():
+        return db.session.get(ReportChunk, chunk_id)
+
+
+def test_chunk_sent_once(app, chunk, outbox):
+    chunk_id, emails = chunk
+    assert tasks.send_monthly_report_chunk(chunk_id) == {'chunk_id': chunk_id, 'sent': 5, 'failed': 0}
+    assert outbox == emails
+    row = chunk_row(app, chunk_id)
+    assert (row.status, row.sent, row.failed) == ('done', 5, 0)
+    # a duplicate delivery of the task sends nothing more
+    tasks.send_monthly_report_chunk(chunk_id)
+    assert outbox == emails
+
+
+def test_chunk_held_by_another_worker_is_skipped(app, chunk, outbox):
+    chunk_id, emails = chunk
+    row = chunk_row(app, chunk_id)
+    with app.app_context():
+        assert tasks.hold_report_chunk(chunk_id, 'dispatched', row.updated_at) is not None
+    assert tasks.send_monthly_report_chunk(chunk_id) == {'chunk_id': chunk_id, 'sent': 0, 'failed': 0}
+    assert outbox == []
+
+
+def test_retry_after_crash_skips_delivered_customers(app, chunk, outbox, monkeypatch):
+    chunk_id, emails = chunk
+    monkeypatch.setattr(tasks, 'REPORT_SEND_BATCH', 2)
+    send_messages = tasks.send_messages
+
+    def crash_after_first_batch(messages, failed=None):
+        if outbox:
+            raise RuntimeError('worker lost')
+        return send_messages(messages, failed)
+    monkeypatch.setattr(tasks, 'send_messages', crash_after_first_batch)
+    with pytest.raises(RuntimeError):
+        tasks.send_monthly_report_chunk(chunk_id)
+    assert outbox == emails[:2]
+    assert chunk_row(app, chunk_id).status == 'sending'
+
+    # the coordinator dispatches the chunk again once it looks lost
+    from extensions import db
+    from models import ReportChunk
+    with app.app_context():
+        row = db.session.get(ReportChunk, chunk_id)
+        row.status, row.updated_at = 'dispatched', datetime.utcnow()
+        db.session.commit()
+    monkeypatch.setattr(tasks, 'send_messages', send_messages)
+    assert tasks.send_monthly_report_chunk(chunk_id)['sent'] == 3
+    assert outbox == emails
+    assert chunk_row(app, chunk_id).sent == 5
+
+
+def test_worker_stops_when_chunk_dispatched_again(app, chunk, outbox, monkeypatch):
+    chunk_id, emails = chunk
+    monkeypatch.setattr(tasks, 'REPORT_SEND_BATCH', 2)
+    send_messages = tasks.send_messages
+
+    def redispatch_while_sending(messages, failed=None):
+        # the coordinator took the chunk for lost while this worker was sending
+        from extensions import db
+        from models import ReportChunk
+        with app.app_context():
+            row = db.session.get(ReportChunk, chunk_id)
+            row.status, row.updated_at = 'dispatched', datetime.utcnow() + timedelta(seconds=1)
+            db.session.commit()
+        return send_messages(messages, failed)
+    monkeypatch.setattr(tasks, 'send_messages', redispatch_while_sending)
+    assert tasks.send_monthly_report_chunk(chunk_id)['sent'] == 2
+    assert outbox == emails[:2]
+
+    # the new dispatch sends to the rest only
+    monkeypatch.setattr(tasks, 'send_messages', send_messages)
+    tasks.send_monthly_report_chunk(chunk_id)
+    assert outbox == emails
@@ -0,0 +1,34 @@
+"""
+GET /api/service_requests pages newest first, so clients that never follow
+X-Next-Cursor still see the requests made most recently.
+"""
+from datetime import datetime, timedelta
+from pagination import DEFAULT_PAGE_SIZE
+
+
+def test_new_request_on_first_page(app, client, login, make_user, make_service, make_request):
+    from extensions import db
+    from models import Service_req
+    customer_id, service_id = make_user('cust'), make_service()
+    start = datetime.utcnow() - timedelta(days=30)
+    with app.app_context():
+        db.session.add_all([
+            Service_req(customer_id=customer_id, service_id=service_id, remarks='old',
+                        date_of_request=start + timedelta(minutes=i))
+            for i in range(DEFAULT_PAGE_SIZE + 5)
+        ])
+        db.session.commit()
+    request_id = make_request(customer_id, service_id)
+
+    headers = dict(login(customer_id), Accept='application/json')
+    response = client.get('/api/service_requests', headers=headers)
+    first_page = [service_request['id'] for service_request in response.get_json()]
+    assert len(first_page) == DEFAULT_PAGE_SIZE
+    assert first_page[0] == request_id
+
+    response = client.get('/api/service_requests', headers=headers,
+                          query_string={'cursor': response.headers['X-Next-Cursor']})
+    second_page = [service_request['id'] for service_request in response.get_json()]
+    assert len(second_page) == 6
+    assert 'X-Next-Cursor' not in response.headers
+    assert not set(first_page) & set(second_page)
@@ -0,0 +1,65 @@
+"""
+Changes made to a user through the ORM reach the principal cache
+(principal_cache.py) before the next request authenticates.
+"""
+from uuid import uuid4
+from extensions import db
+from models import User
+import principal_cache
+
+
+def summary(client, headers):
+    return client.get('/api/admin/summary', headers=dict(headers, Accept='application/json')).status_code
+
+
+def customer_summary(client, headers):
+    return client.get('/api/customer/summary', headers=dict(headers, Accept='application/json')).status_code
+
+
+def cached(app, user_id):
+    with app.app_context():
+        return principal_cache.principals.get(db.session.get(User, user_id).fs_uniquifier) is not None
+
+
+def test_deactivated_user_rejected(app, client, login, make_user):
+    customer_id = make_user('cust')
+    headers = login(customer_id)
+    assert customer_summary(client, headers) == 200
+    assert cached(app, customer_id)
+
+    with app.app_context():
+        db.session.get(User, customer_id).active = False
+        db.session.commit()
+    assert customer_summary(client, headers) == 401
+
+
+def test_role_change_applies_to_next_request(app, client, login, make_user):
+    customer_id = make_user('cust')
+    headers = login(customer_id)
+    assert summary(client, headers) == 403
+    assert cached(app, customer_id)
+
+    datastore = app.extensions['security'].datastore
+    with app.app_context():
+        datastore.add_role_to_user(db.session.get(User, customer_id), 'admin')
+        db.session.commit()
+    assert summary(client, headers) == 200
+
+    with app.app_context():
+        datastore.remove_role_from_user(db.session.get(User, customer_id), 'admin')
+        db.session.commit()
+    assert summary(client, headers) == 403
+
+
+def test_rotated_uniquifier_invalidates_token(app, client, login, make_user):
+    customer_id = make_user('cust')
+    headers = login(customer_id)
+    assert customer_summary(client, headers) == 200
+    assert cached(app, customer_id)
+
+    with app.app_context():
+        db.session.get(User, customer_id).fs_uniquifier = uuid4().hex
+        db.session.commit()
+    assert customer_summary(client, headers) == 401
+    # a new login works with the new uniquifier
+    assert customer_summary(client, login(customer_id)) == 200
@@ -0,0 +1,78 @@
+"""
+The service request listing and search stay within their @query_budget
+for every role however many rows they return; TESTING is on, so a view
+over budget raises QueryBudgetExceeded.
+"""
+import pytest
+from flask import g
+from query_counter import QueryBudgetExceeded
+import resources
+
+
+@pytest.fixture
+def rows(app, make_user, make_service, make_request):
+    """
+    Requests of three customers spread over two professionals and two services
+    """
+    customers = [make_user('cust') for _ in range(3)]
+    professionals = [make_user('serv') for _ in range(2)]
+    services = [make_service(), make_service(category='Plumbing')]
+    for i in range(12):
+        make_request(customers[i % 3], services[i % 2],
+                     professional_id=professionals[i % 2] if i % 4 else None, remarks=f'leaking tap {i}')
+    return {'admin': None, 'cust': customers[0], 'serv': professionals[0]}
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(app):
+    # a cached response would run fewer queries than the view itself
+    from extensions import cache
+    with app.app_context():
+        cache.clear()
+
+
+def headers_for(role, rows, login, app):
+    if role == 'admin':
+        from models import User
+        with app.app_context():
+            return login(User.query.filter_by(email='admin@iitm.ac.in').one().id)
+    return login(rows[role])
+
+
+@pytest.mark.parametrize('role', ['admin', 'cust', 'serv'])
+def test_service_requests_within_budget(app, client, login, rows, role):
+    headers = headers_for(role, rows, login, app)
+    with client:
+        response = client.get('/api/service_requests', headers=headers)
+        assert response.status_code == 200
+        assert g.query_count <= 4
+    service_requests = response.get_json()
+    if role == 'cust':
+        assert len(service_requests) == 4
+    else:
+        # admins and professionals list every request
+        assert len(service_requests) >= 12
+    assert any(service_request['professional_name'] for service_request in service_requests)
+
+
+@pytest.mark.parametrize('role', ['admin', 'cust', 'serv'])
+def test_search_within_budget(app, client, login, rows, role):
+    headers = headers_for(role, rows, login, app)
+    with client:
+        response = client.post('/api/search_services', json={'search': 'leaking'}, headers=headers)
+        assert response.status_code == 200
+        assert g.query_count <= 5
+    found = len(response.get_json()['service_requests'])
+    if role == 'admin':
+        assert found >= 12
+    else:
+        # their own requests: four made by the customer, three assigned to the professional
+        assert found == {'cust': 4, 'serv': 3}[role]
+
+
+def test_lazy_loading_exceeds_budget(app, client, login, rows, monkeypatch):
+    # without the eager loads every row loads its customer, professional and service
+    monkeypatch.setattr(resources, 'service_req_load_options', ())
+    headers = headers_for('admin', rows, login, app)
+    with pytest.raises(QueryBudgetExceeded):
+        client.get('/api/service_requests', headers=headers)
@@ -0,0 +1,191 @@
+"""
+Incremental daily reminders (reminders.py, tasks.send_daily_reminders):
+each pending request is reminded to its professional once, runs catch up
+on what they missed, and failed or abandoned reminders are tried again.
+
+The watermark is shared by the whole test database, so tests only look
+at the emails sent to the professionals they created.
+"""
+from datetime import datetime, timedelta
+import re
+import pytest
+from sqlalchemy import delete, select, update
+from extensions import db
+from models import Reminder, Service_req, ServiceReqEvent, TaskWatermark, User
+import reminders
+import tasks
+
+
+class Outbox(list):
+    """
+    Sent (to, body) pairs; addresses added to failing are not delivered
+    """
+    def __init__(self):
+        super().__init__()
+        self.failing = set()
+
+
+@pytest.fixture
+def outbox(monkeypatch):
+    sent = Outbox()
+
+    def send_messages(messages, failed=None):
+        for i, (to, subject, body) in enumerate(messages):
+            if to in sent.failing:
+                failed.append(i)
+            else:
+                sent.append((to, body))
+        return len(messages) - len(failed)
+    monkeypatch.setattr(tasks, 'send_messages', send_messages)
+    return sent
+
+
+@pytest.fixture
+def professional(app, make_user):
+    def make():
+        professional_id = make_user('serv')
+        with app.app_context():
+            return professional_id, db.session.get(User, professional_id).email
+    return make
+
+
+def run(app):
+    with app.app_context():
+        tasks.send_daily_reminders()
+
+
+def sent_to(outbox, email):
+    return [body for to, body in outbox if to == email]
+
+
+def pending_count(body):
+    return int(re.search(r'You have (\d+) pending', body).group(1))
+
+
+def reminder_rows(app, professional_id):
+    with app.app_context():
+        return {row.service_req_id: (row.status, row.attempts) for row in db.session.execute(
+            select(Reminder).where(Reminder.professional_id == professional_id)
+        ).scalars()}
+
+
+def test_first_run_reminds_every_pending_request(app, outbox, professional, make_user, make_service, make_request):
+    professional_id, email = professional()
+    customer_id, service_id = make_user('cust'), make_service()
+    pending = [make_request(customer_id, service_id, professional_id=professional_id) for _ in range(2)]
+    accepted = make_request(customer_id, service_id, professional_id=professional_id)
+    with app.app_context():
+        db.session.get(Service_req, accepted).service_status = 'accepted'
+        db.session.commit()
+        db.session.execute(delete(TaskWatermark))
+        db.session.commit()
+
+    run(app)
+    [body] = sent_to(outbox, email)
+    assert pending_count(body) == 2
+    assert reminder_rows(app, professional_id) == {request_id: ('sent', 1) for request_id in pending}
+
+
+def test_each_request_reminded_once(app, outbox, professional, make_user, make_service, make_request):
+    professional_id, email = professional()
+    customer_id, service_id = make_user('cust'), make_service()
+    make_request(customer_id, service_id, professional_id=professional_id)
+    run(app)
+    run(app)
+    assert len(sent_to(outbox, email)) == 1
+
+    # a new request is reminded, and the email counts everything still pending
+    make_request(customer_id, service_id, professional_id=professional_id)
+    run(app)
+    bodies = sent_to(outbox, email)
+    assert len(bodies) == 2 and pending_count(bodies[-1]) == 2
+
+
+def test_catches_up_after_missed_runs(app, outbox, professional, make_user, make_service, make_request):
+    professional_id, email = professional()
+    other_id, other_email = professional()
+    customer_id, service_id = make_user('cust'), make_service()
+    run(app)
+    # several days of changes without a run
+    make_request(customer_id, service_id, professional_id=professional_id)
+    make_request(customer_id, service_id, professional_id=other_id)
+    make_request(customer_id, service_id, professional_id=professional_id)
+    run(app)
+    assert pending_count(sent_to(outbox, email)[0]) == 2
+    assert len(sent_to(outbox, other_email)) == 1
+
+
+def test_catches_up_after_events_were_pruned(app, outbox, professional, make_user, make_service, make_request):
+    professional_id, email = professional()
+    customer_id, service_id = make_user('cust'), make_service()
+    run(app)
+    missed = make_request(customer_id, service_id, professional_id=professional_id)
+    make_request(customer_id, service_id)
+    with app.app_context():
+        # the events up to the missed request are pruned before the next run
+        last_missed = db.session.execute(
+            select(ServiceReqEvent.id).where(ServiceReqEvent.service_req_id == missed).order_by(ServiceReqEvent.id.desc())
+        ).scalars().first()
+        db.session.execute(delete(ServiceReqEvent).where(ServiceReqEvent.id <= last_missed))
+        db.session.commit()
+
+    run(app)
+    assert len(sent_to(outbox, email)) == 1
+    assert reminder_rows(app, professional_id) == {missed: ('sent', 1)}
+
+
+def test_reassigned_request_reminds_new_professional(app, outbox, professional, make_user, make_service, make_request):
+    first_id, first_email = professional()
+    second_id, second_email = professional()
+    request_id = make_request(make_user('cust'), make_service(), professional_id=first_id)
+    run(app)
+    with app.app_context():
+        db.session.get(Service_req, request_id).professional_id = second_id
+        db.session.commit()
+    run(app)
+    assert len(sent_to(outbox, first_email)) == 1
+    assert len(sent_to(outbox, second_email)) == 1
+    assert reminder_rows(app, second_id) == {request_id: ('sent', 1)}
+
+
+def test_failed_reminders_retried_up_to_the_limit(app, outbox, professional, make_user, make_service, make_request):
+    professional_id, email = professional()
+    request_id = make_request(make_user('cust'), make_service(), professional_id=professional_id)
+    outbox.failing.add(email)
+    for attempt in range(1, reminders.MAX_REMINDER_ATTEMPTS + 1):
+        run(app)
+        assert reminder_rows(app, professional_id) == {request_id: ('failed', attempt)}
+    # given up after MAX_REMINDER_ATTEMPTS
+    outbox.failing.clear()
+    run(app)
+    assert sent_to(outbox, email) == []
+
+
+def test_failed_reminder_sent_on_retry(app, outbox, professional, make_user, make_service, make_request):
+    professional_id, email = professional()
+    request_id = make_request(make_user('cust'), make_service(), professional_id=professional_id)
+    outbox.failing.add(email)
+    run(app)
+    outbox.failing.clear()
+    run(app)
+    assert len(sent_to(outbox, email)) == 1
+    assert reminder_rows(app, professional_id) == {request_id: ('sent', 2)}
+
+
+def test_stale_claim_reclaimed(app, outbox, professional, make_user, make_service, make_request):
+    professional_id, email = professional()
+    request_id = make_request(make_user('cust'), make_service(), professional_id=professional_id)
+    with app.app_context():
+        # a run that claimed its reminders and died before sending
+        due, totals, token = reminders.claim_due()
+    assert professional_id in due
+
+    run(app)
+    assert sent_to(outbox, email) == []
+    with app.app_context():
+        db.session.execute(update(Reminder).where(Reminder.professional_id == professional_id)
+                           .values(updated_at=datetime.utcnow() - reminders.STALE_CLAIM - timedelta(minutes=1)))
+        db.session.commit()
+    run(app)
+    assert len(sent_to(outbox, email)) == 1
+    assert reminder_rows(app, professional_id) == {request_id: ('sent', 2)}
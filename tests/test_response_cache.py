@@ -0,0 +1,100 @@
+"""
+The response cache (response_cache.py): cached lists follow writes through
+tag invalidation, customers never share a cached list, and the summaries
+revalidate with ETags.
+"""
+from flask import g
+import pytest
+from models import Service_req
+import response_cache
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(app):
+    from extensions import cache
+    with app.app_context():
+        cache.clear()
+
+
+def list_ids(client, headers):
+    """
+    Ids on the first page of GET /api/service_requests and whether it came from the cache
+    """
+    with client:
+        response = client.get('/api/service_requests', headers=dict(headers, Accept='application/json'))
+        assert response.status_code == 200
+        hit = g.get('cache_hits', 0) == 1
+    return [row['id'] for row in response.get_json()], hit
+
+
+def test_post_and_patch_invalidate(client, login, make_user, make_service):
+    customer_id, service_id = make_user('cust'), make_service()
+    headers = login(customer_id)
+    assert list_ids(client, headers) == ([], False)
+    assert list_ids(client, headers) == ([], True)
+
+    response = client.post('/api/service_requests', headers=headers, json={'service_id': service_id, 'auto_assign': False})
+    request_id = response.get_json()['service_request_id']
+    assert list_ids(client, headers) == ([request_id], False)
+
+    client.patch(f'/api/service_requests/{request_id}', headers=headers, json={'service_status': 'closed'})
+    with client:
+        rows = client.get('/api/service_requests', headers=dict(headers, Accept='application/json')).get_json()
+        assert g.get('cache_hits', 0) == 0
+    assert rows[0]['service_status'] == 'closed'
+
+
+def test_bulk_import_and_cascade_invalidate(app, client, admin_headers, make_user, make_service, make_request):
+    customer_id, service_id = make_user('cust'), make_service()
+    request_id = make_request(customer_id, service_id)
+    ids, _ = list_ids(client, admin_headers)
+    assert request_id in ids
+    assert list_ids(client, admin_headers)[1]
+
+    body = f'customer_id,service_id\n{customer_id},{service_id}\n'
+    response = client.post('/api/bulk/service_requests', data=body, content_type='text/csv', headers=admin_headers)
+    assert response.get_json()['inserted'] == 1
+    with app.app_context():
+        imported = Service_req.query.filter_by(customer_id=customer_id).filter(Service_req.id != request_id).one().id
+    ids, hit = list_ids(client, admin_headers)
+    assert not hit and {request_id, imported} <= set(ids)
+
+    assert client.delete(f'/api/services/{service_id}', headers=admin_headers).status_code == 200
+    ids, hit = list_ids(client, admin_headers)
+    assert not hit and request_id not in ids
+
+
+def test_customers_never_share_a_list(client, login, make_user, make_service, make_request):
+    customer_id, other_customer_id = make_user('cust'), make_user('cust')
+    service_id = make_service()
+    mine, theirs = make_request(customer_id, service_id), make_request(other_customer_id, service_id)
+    assert list_ids(client, login(customer_id)) == ([mine], False)
+    assert list_ids(client, login(other_customer_id)) == ([theirs], False)
+    assert list_ids(client, login(customer_id)) == ([mine], True)
+
+
+def test_summary_not_modified_until_requests_change(client, login, make_user, make_service):
+    customer_id, service_id = make_user('cust'), make_service()
+    headers = login(customer_id)
+    response = client.get('/api/customer/summary', headers=headers)
+    etag = response.headers['ETag']
+    assert response.get_json()['total_requests'] == 0
+
+    assert client.get('/api/customer/summary', headers=dict(headers, **{'If-None-Match': etag})).status_code == 304
+
+    client.post('/api/service_requests', headers=headers, json={'service_id': service_id, 'auto_assign': False})
+    response = client.get('/api/customer/summary', headers=dict(headers, **{'If-None-Match': etag}))
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag and response.get_json()['total_requests'] == 1
+
+
+def test_summary_without_etag_when_cache_down(client, login, make_user, monkeypatch):
+    headers = login(make_user('serv'))
+
+    def unavailable(*keys):
+        raise ConnectionError('cache down')
+    monkeypatch.setattr(response_cache.cache, 'get_many', unavailable)
+    response = client.get('/api/professional/summary', headers=dict(headers, **{'If-None-Match': '*'}))
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
+    assert response.get_json()['total_requests'] == 0
@@ -0,0 +1,59 @@
+"""
+The monthly activity rollups (rollups.py) follow closed requests to the
+month of their stored date_of_completion.
+"""
+from datetime import datetime
+import json
+from extensions import db
+from models import MonthlyActivity, Service_req
+
+
+def closed_ids(app, customer_id):
+    with app.app_context():
+        rows = MonthlyActivity.query.filter_by(customer_id=customer_id).all()
+        return {row.month: json.loads(row.closed_ids) for row in rows if row.closed_count}
+
+
+def close(app, request_id, completed):
+    with app.app_context():
+        service_request = db.session.get(Service_req, request_id)
+        service_request.service_status, service_request.date_of_completion = 'closed', completed
+        db.session.commit()
+
+
+def test_reclosed_with_new_date(app, make_user, make_service, make_request):
+    customer_id = make_user('cust')
+    request_id = make_request(customer_id, make_service())
+    close(app, request_id, datetime(2024, 1, 15))
+    assert closed_ids(app, customer_id) == {'2024-01': [request_id]}
+
+    close(app, request_id, datetime(2024, 2, 3))
+    assert closed_ids(app, customer_id) == {'2024-02': [request_id]}
+
+
+def test_changed_then_deleted_in_one_session(app, make_user, make_service, make_request):
+    customer_id = make_user('cust')
+    request_id = make_request(customer_id, make_service())
+    close(app, request_id, datetime(2024, 3, 10))
+    with app.app_context():
+        service_request = db.session.get(Service_req, request_id)
+        service_request.service_status, service_request.date_of_completion = 'requested', None
+        db.session.delete(service_request)
+        db.session.commit()
+    assert closed_ids(app, customer_id) == {}
+
+
+def test_closed_without_completion_date(app, make_user, make_service, make_request):
+    import rollups
+    customer_id = make_user('cust')
+    request_id = make_request(customer_id, make_service())
+    with app.app_context():
+        service_request = db.session.get(Service_req, request_id)
+        service_request.date_of_request, service_request.service_status = datetime(2024, 4, 20), 'closed'
+        db.session.commit()
+    assert closed_ids(app, customer_id) == {'2024-04': [request_id]}
+
+    with app.app_context():
+        with db.engine.begin() as conn:
+            rollups.rebuild(conn, [customer_id])
+    assert closed_ids(app, customer_id) == {'2024-04': [request_id]}
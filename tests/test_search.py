@@ -0,0 +1,84 @@
+"""
+POST /api/search_services matches word prefixes through the FTS5 index
+(search_index.py), ranks services by bm25, follows updates and deletes
+through the triggers and scopes service requests by role.
+"""
+import itertools
+import pytest
+from extensions import db
+from models import Service, Service_req
+
+_words = itertools.count(1)
+
+
+@pytest.fixture
+def word():
+    # a word of its own, so other tests' rows never match
+    return f'w{next(_words)}scrubbing'
+
+
+def search(client, headers, value):
+    response = client.post('/api/search_services', json={'search': value}, headers=headers)
+    assert response.status_code == 200
+    found = response.get_json()
+    return [row['id'] for row in found['services']], [row['id'] for row in found['service_requests']]
+
+
+def add_service(app, make_service, name, description='d'):
+    service_id = make_service(name=name)
+    with app.app_context():
+        db.session.get(Service, service_id).description = description
+        db.session.commit()
+    return service_id
+
+
+def test_prefix_match(app, client, admin_headers, make_service, word):
+    service_id = add_service(app, make_service, f'Deep {word}')
+    assert search(client, admin_headers, word[:-4])[0] == [service_id]
+    assert search(client, admin_headers, f'deep {word[:-4]}')[0] == [service_id]
+
+
+def test_name_ranks_before_description(app, client, admin_headers, make_service, word):
+    in_description = add_service(app, make_service, 'Kitchen', description=f'includes {word}')
+    in_name = add_service(app, make_service, f'{word} kitchen')
+    assert search(client, admin_headers, word)[0] == [in_name, in_description]
+
+
+def test_index_follows_update_and_delete(app, client, admin_headers, make_service, word):
+    service_id = add_service(app, make_service, f'Old {word}')
+    with app.app_context():
+        db.session.get(Service, service_id).name = 'Renamed'
+        db.session.commit()
+    assert search(client, admin_headers, word)[0] == []
+
+    with app.app_context():
+        db.session.get(Service, service_id).description = f'now {word}'
+        db.session.commit()
+    assert search(client, admin_headers, word)[0] == [service_id]
+
+    with app.app_context():
+        db.session.delete(db.session.get(Service, service_id))
+        db.session.commit()
+    assert search(client, admin_headers, word)[0] == []
+
+
+def test_requests_scoped_by_role(app, client, login, admin_headers, make_user, make_service, make_request, word):
+    customer_id, other_customer_id = make_user('cust'), make_user('cust')
+    professional_id = make_user('serv')
+    service_id = make_service()
+    mine = make_request(customer_id, service_id, professional_id=professional_id, remarks=f'tap {word}')
+    theirs = make_request(other_customer_id, service_id, remarks=f'sink {word}')
+
+    assert sorted(search(client, admin_headers, word)[1]) == sorted([mine, theirs])
+    assert search(client, login(customer_id), word)[1] == [mine]
+    assert search(client, login(professional_id), word)[1] == [mine]
+    with app.app_context():
+        db.session.get(Service_req, theirs).remarks = 'sink'
+        db.session.commit()
+    assert search(client, admin_headers, word)[1] == [mine]
+
+
+@pytest.mark.parametrize('value', ['!!!', '"'])
+def test_nothing_to_match(client, admin_headers, make_service, make_user, make_request, value):
+    make_request(make_user('cust'), make_service())
+    assert search(client, admin_headers, value) == ([], [])
@@ -0,0 +1,145 @@
+"""
+The precompiled serializers must produce the same bytes as marshal +
+json.dumps (one row) and marshal + output_json (a response body).
+"""
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import json
+import pytest
+from flask import Flask
+from flask_restful import marshal
+from flask_restful.representations.json import output_json
+from resources import (service_req_fields, service_req_serializer, service_fields, service_serializer,
+                       service_listing_fields, service_listing_serializer, feedback_fields, feedback_serializer,
+                       service_listing)
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, create_engine, select
+import serializers
+
+
+def person(i):
+    return SimpleNamespace(username=f'user {i} – Ünïcode 日本', email=f'user{i}@example.com', phone=None,
+                           address='12 "Quoted" St\n', pin=str(600000 + i))
+
+
+def service_requests():
+    requested = datetime(2024, 1, 1, 9, 30)
+    return [
+        SimpleNamespace(
+            id=1, customer_id=2, customer=person(2), professional_id=3, professional=person(3),
+            service_id=4, service=SimpleNamespace(name='Déep cleaning'),
+            date_of_request=requested, date_of_completion=requested + timedelta(days=2),
+            service_status='closed', remarks='tab\t backslash \\ emoji 🧹',
+        ),
+        # unassigned: no professional, no completion date
+        SimpleNamespace(
+            id=2, customer_id=2, customer=person(2), professional_id=None, professional=None,
+            service_id=4, service=SimpleNamespace(name='Déep cleaning'),
+            date_of_request=requested.replace(tzinfo=timezone(timedelta(hours=5, minutes=30))),
+            date_of_completion=None, service_status='requested', remarks=None,
+        ),
+        # every relationship and datetime missing
+        SimpleNamespace(
+            id=3, customer_id=None, customer=None, professional_id=None, professional=None,
+            service_id=None, service=None, date_of_request=None, date_of_completion=None,
+            service_status=None, remarks='',
+        ),
+    ]
+
+
+def services():
+    return [
+        SimpleNamespace(id=1, name='Plomberie générale', description=None, price=None, category_id=1),
+        SimpleNamespace(id=2, name='service "two"', description='déscription ✓', price=250, category_id=None),
+    ]
+
+
+def listings():
+    return [
+        SimpleNamespace(id=1, name='ラベル', description=None, price=100, category_id=1,
+                        rating_count=0, rating_average=None),
+        SimpleNamespace(id=2, name='b', description='d', price=100, category_id=1,
+                        rating_count=3, rating_average=3.67),
+        SimpleNamespace(id=3, name='c', description='d', price=100, category_id=1,
+                        rating_count=2, rating_average=4.0),
+        SimpleNamespace(id=4, name='d', description='d', price=100, category_id=1,
+                        rating_count=3, rating_average=1 / 3),
+        # written as NaN / Infinity / -Infinity, like json.dumps does
+        SimpleNamespace(id=5, name='e', description='d', price=100, category_id=1,
+                        rating_count=1, rating_average=float('nan')),
+        SimpleNamespace(id=6, name='f', description='d', price=100, category_id=1,
+                        rating_count=1, rating_average=float('inf')),
+        SimpleNamespace(id=7, name='g', description='d', price=100, category_id=1,
+                        rating_count=1, rating_average=float('-inf')),
+    ]
+
+
+def feedback():
+    # Row tuples, as FeedbackResource.get returns them
+    metadata = MetaData()
+    table = Table(
+        'feedback', metadata, Column('id', Integer), Column('service_id', Integer), Column('customer_id', Integer),
+        Column('customer_name', String), Column('service_name', String), Column('rating', Integer),
+        Column('comments', String), Column('date', DateTime),
+    )
+    engine = create_engine('sqlite://')
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(table.insert(), [
+            {'id': 1, 'service_id': 1, 'customer_id': 2, 'customer_name': 'Zoë', 'service_name': 'Nettoyage',
+             'rating': 5, 'comments': 'très bien ✓', 'date': datetime(2024, 2, 1, 10, 0, 0, 123456)},
+            {'id': 2, 'service_id': 1, 'customer_id': None, 'customer_name': None, 'service_name': None,
+             'rating': None, 'comments': None, 'date': None},
+        ])
+        return conn.execute(select(table)).all()
+
+
+CASES = [
+    ('service_req_fields', service_req_fields, service_req_serializer, service_requests),
+    ('service_fields', service_fields, service_serializer, services),
+    ('service_listing_fields', service_listing_fields, service_listing_serializer, listings),
+    ('feedback_fields', feedback_fields, feedback_serializer, feedback),
+]
+
+
+@pytest.fixture(params=[False, True], ids=['production', 'debug'])
+def bare_app(request):
+    app = Flask(__name__)
+    app.debug = request.param
+    with app.test_request_context():
+        yield app
+
+
+@pytest.mark.parametrize('name, fields, serializer, rows', CASES, ids=[case[0] for case in CASES])
+def test_row_matches_marshal(name, fields, serializer, rows):
+    for row in rows():
+        assert serializer.row(row) == json.dumps(marshal(row, fields))
+
+
+@pytest.mark.parametrize('name, fields, serializer, rows', CASES, ids=[case[0] for case in CASES])
+def test_body_matches_output_json(bare_app, name, fields, serializer, rows):
+    for objs in (rows(), rows()[:1], []):
+        expected = output_json(marshal(objs, fields), 200).get_data()
+        assert serializers.output_json(serializer.dumps(objs), 200).get_data() == expected
+
+
+def test_service_listing_rows_match_marshal(app, monkeypatch, make_service, make_user):
+    # real Row tuples from the listing query, with the rounded Float average
+    from extensions import db
+    from models import Feedback
+    customer_id = make_user('cust')
+    rated = make_service(name='Réparation rated')
+    make_service(name='unrated')
+    with app.app_context():
+        for rating in (5, 4, 2):
+            db.session.add(Feedback(service_id=rated, customer_id=customer_id, rating=rating, comments='ok'))
+        db.session.commit()
+
+    queried = []
+    dumps = service_listing_serializer.dumps
+    monkeypatch.setattr(service_listing_serializer, 'dumps', lambda rows: queried.extend(rows) or dumps(rows))
+    with app.test_request_context():
+        body, status = service_listing()
+        assert body == output_json(marshal(queried, service_listing_fields), 200).get_data(as_text=True)
+    listed = {row['name']: row for row in json.loads(body)}
+    assert listed['Réparation rated']['rating_average'] == 3.67
+    assert listed['unrated']['rating_average'] is None
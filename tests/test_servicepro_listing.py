@@ -0,0 +1,44 @@
+"""
+GET /all_servicepro and /inactive_servicepro filter, count and page the
+professionals in SQL (views.servicepro_page).
+"""
+import itertools
+import pytest
+
+_types = itertools.count(1)
+
+
+@pytest.fixture
+def service_type():
+    # a service type of its own, so other tests' professionals never match
+    return f'Gardening {next(_types)}'
+
+
+def listing(client, headers, path='/all_servicepro', **params):
+    response = client.get(path, headers=headers, query_string=params)
+    assert response.status_code == 200
+    return [row['id'] for row in response.get_json()], int(response.headers['X-Total-Count'])
+
+
+def test_filters(client, admin_headers, make_user, service_type):
+    chennai = make_user('serv', service_type=service_type, city='Chennai', pin='600001', experience='2')
+    senior = make_user('serv', service_type=service_type, city='Chennai', pin='600002', experience='12')
+    mumbai = make_user('serv', service_type=service_type, city='Mumbai', pin='400001', experience='5', active=False)
+    make_user('cust', service_type=service_type, city='Chennai')
+
+    assert listing(client, admin_headers, service_type=service_type) == ([chennai, senior, mumbai], 3)
+    assert listing(client, admin_headers, service_type=service_type, city='Chennai') == ([chennai, senior], 2)
+    assert listing(client, admin_headers, service_type=service_type, pin='400001') == ([mumbai], 1)
+    # compared as numbers, '12' >= 5 although '12' < '5' as text
+    assert listing(client, admin_headers, service_type=service_type, min_experience=5) == ([senior, mumbai], 2)
+    assert listing(client, admin_headers, '/inactive_servicepro', service_type=service_type) == ([mumbai], 1)
+
+
+def test_pages(client, admin_headers, make_user, service_type):
+    ids = [make_user('serv', service_type=service_type) for _ in range(5)]
+    assert listing(client, admin_headers, service_type=service_type, limit=2) == (ids[:2], 5)
+    assert listing(client, admin_headers, service_type=service_type, limit=2, page=2) == (ids[2:4], 5)
+    assert listing(client, admin_headers, service_type=service_type, limit=2, page=3) == (ids[4:], 5)
+    assert listing(client, admin_headers, service_type=service_type, limit=2, page=4) == ([], 5)
+    # page numbers below 1 give the first page
+    assert listing(client, admin_headers, service_type=service_type, limit=2, page=0) == (ids[:2], 5)
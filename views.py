@@ -1,11 +1,43 @@
 from flask import jsonify, render_template, render_template_string, request
 from flask_security import auth_required, current_user, roles_required, roles_accepted, SQLAlchemyUserDatastore
 from flask_security.utils import hash_password, verify_password
+from sqlalchemy import Integer, cast
+from sqlalchemy.orm import load_only
 from extensions import db
-from models import Service
+from pagination import page_size
+from response_cache import invalidate
+from models import Service, User, Role
 from datetime import datetime
 
 
+def servicepro_page(active=None):
+    """
+    One page of service professionals matching the request's filters.
+    Returns the users on the page and the total number of matches.
+    """
+    query = User.query.join(User.roles).filter(Role.name == 'serv').options(
+        load_only(User.username, User.service_type, User.experience, User.active)
+    )
+    if active is True:
+        query = query.filter(User.active.is_(True))
+    elif active is False:
+        query = query.filter(User.active.isnot(True))
+
+    for name in ('service_type', 'city', 'pin'):
+        value = request.args.get(name)
+        if value:
+            query = query.filter(getattr(User, name) == value)
+    min_experience = request.args.get('min_experience', type=int)
+    if min_experience is not None:
+        query = query.filter(cast(User.experience, Integer) >= min_experience)
+
+    total = query.count()
+    limit = page_size()
+    page = max(1, request.args.get('page', 1, type=int))
+    users = query.order_by(User.id).offset((page - 1) * limit).limit(limit).all()
+    return users, total
+
+
 def create_view(app, user_datastore : SQLAlchemyUserDatastore, cache):
 
     # cache test
@@ -112,6 +144,7 @@ def create_view(app, user_datastore : SQLAlchemyUserDatastore, cache):
 
         user.active = True
         db.session.commit()
+        invalidate('user')
         return jsonify({'message' : 'user is activated'}), 200
     
  
@@ -120,15 +153,9 @@ def create_view(app, user_datastore : SQLAlchemyUserDatastore, cache):
     @roles_required('admin')
     @app.route('/inactive_servicepro', methods=['GET'])
     def get_inactive_servicepro():
-        # Query for all users
-        all_users = user_datastore.user_model().query.all()
-        
-        # Filter users to get only inactive professionals
-        inactive_servicepro = [
-            user for user in all_users 
-            if not user.active and any(role.name == 'serv' for role in user.roles)
-        ]
-        
+        # One page of inactive professionals, filtered in the database
+        inactive_servicepro, total = servicepro_page(active=False)
+
         # Prepare the response data
         results = [
             {
@@ -140,21 +167,15 @@ def create_view(app, user_datastore : SQLAlchemyUserDatastore, cache):
             for user in inactive_servicepro
         ]
         
-        return jsonify(results), 200
+        return jsonify(results), 200, {'X-Total-Count': total}
 
     # Endpoint to get all service professionals (active and inactive)
     @roles_required('admin')
     @app.route('/all_servicepro', methods=['GET'])
     def get_all_servicepro():
-        # Query for all users
-        all_users = user_datastore.user_model().query.all()
-        
-        # Filter users to get all service professionals
-        all_servicepro = [
-            user for user in all_users 
-            if any(role.name == 'serv' for role in user.roles)
-        ]
-        
+        # One page of professionals (active and inactive), filtered in the database
+        all_servicepro, total = servicepro_page()
+
         # Prepare the response data
         results = [
             {
@@ -167,4 +188,4 @@ def create_view(app, user_datastore : SQLAlchemyUserDatastore, cache):
             for user in all_servicepro
         ]
         
-        return jsonify(results), 200
+        return jsonify(results), 200, {'X-Total-Count': total}